@@ -11,6 +11,7 @@ import getpass
 CREDENTIALS_PATH = {'desktop': path.join(path.join(environ['USERPROFILE']), 'Desktop')}
 CREDENTIALS_PATH['folder'] = CREDENTIALS_PATH['desktop'] + "\\TFS"
 CREDENTIALS_PATH['file'] = CREDENTIALS_PATH['folder'] + "\\config.txt"
+CREDENTIALS_PATH['session'] = CREDENTIALS_PATH['folder'] + "\\session.json"
 
 
 class CredentialsError(Exception):
@@ -84,9 +85,11 @@ def add_new_credentials():
     credentials['uri'] = "https://tfs2018.net-bet.net/tfs/DefaultCollection/"
     credentials['project'] = "theLotter"
 
-    # Save credentials in config file
+    # Save credentials in config file (the session of the old credentials is dropped)
     if not path.isdir(CREDENTIALS_PATH['folder']):
         mkdir(CREDENTIALS_PATH['folder'])
+    if path.exists(CREDENTIALS_PATH['session']):
+        remove(CREDENTIALS_PATH['session'])
     with open(CREDENTIALS_PATH['file'], "w+") as file:
         file.write(credentials['userName'] + "\n")
         file.write(credentials['password'] + "\n")
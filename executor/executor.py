@@ -0,0 +1,174 @@
+"""
+The Executor module runs per-item operations concurrently on a bounded thread pool.
+Every item gets its own result (or error), and the items output is printed in the
+same order as the items were given, as if they were handled one after the other.
+Every handled item is a watchdog heartbeat, and once the watchdog expired
+the items that didn't start are not handled.
+"""
+
+import contextvars
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from watchdog import watchdog
+
+CONFIG_PATH = "./executor_config.txt"
+
+
+class _OutputRouter:
+    """
+    A stdout replacement that keeps the output of each worker thread in a separate buffer,
+    and passes the output of any other thread to the original stdout
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        """
+        Writes the text to the current thread buffer (if it has one)
+        :param text: the text to write
+        :return: the number of written characters
+        """
+        buffer = self.buffers.get(threading.get_ident())
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        """
+        Flushes the original stdout
+        :return: None
+        """
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Executor:
+    """
+    Executor class that runs a function over many items with a limited concurrency
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers if max_workers is not None else get_max_workers()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                        thread_name_prefix="tfs-worker")
+        self._workers = threading.local()
+        self._router = None
+        self._router_users = 0
+        self._lock = threading.Lock()
+
+    def run(self, func, items):
+        """
+        Runs func on every item and waits for all of them to finish.
+        The output of every item is printed once the items before it are done.
+        :param func: a function that gets a single item
+        :param items: the items to handle
+        :return: a list with a result dictionary per item, in the given order.
+                 Each result has the "item", its "result" and an "error" (None on success)
+        """
+        items = list(items)
+
+        # A worker waiting for its own pool may never be scheduled, so nested runs are serial
+        if getattr(self._workers, "active", False) or self.max_workers <= 1 or len(items) <= 1:
+            return [self._run_item(func, item) for item in items]
+
+        self._install_router()
+        try:
+            # Every item runs in a copy of the caller context (e.g. the instrumented operation)
+            futures = [self._pool.submit(contextvars.copy_context().run,
+                                         self._run_buffered, func, item) for item in items]
+            results = ([])
+            for future in futures:
+                result, output = future.result()
+                self._router.stream.write(output)
+                results.append(result)
+            return results
+        finally:
+            self._uninstall_router()
+
+    def shutdown(self):
+        """
+        Stops the worker threads
+        :return: None
+        """
+        self._pool.shutdown(wait=True)
+
+    def _run_buffered(self, func, item):
+        """
+        Runs a single item inside a worker thread, while keeping its output aside
+        :return: a tuple of the item result dictionary and its output
+        """
+        buffer = io.StringIO()
+        self._router.buffers[threading.get_ident()] = buffer
+        self._workers.active = True
+        try:
+            return self._run_item(func, item), buffer.getvalue()
+        finally:
+            self._workers.active = False
+            del self._router.buffers[threading.get_ident()]
+
+    @staticmethod
+    def _run_item(func, item):
+        """
+        Runs a single item and collects its result or error
+        :return: the item result dictionary
+        """
+        if watchdog.is_cancelled():
+            return {"item": item, "result": None,
+                    "error": watchdog.OperationCancelledError("The watchdog expired")}
+        try:
+            return {"item": item, "result": func(item), "error": None}
+        except Exception as error:  # pylint: disable=broad-except
+            return {"item": item, "result": None, "error": error}
+        finally:
+            watchdog.heartbeat()
+
+    def _install_router(self):
+        with self._lock:
+            if self._router_users == 0:
+                self._router = _OutputRouter(sys.stdout)
+                sys.stdout = self._router
+            self._router_users += 1
+
+    def _uninstall_router(self):
+        with self._lock:
+            self._router_users -= 1
+            if self._router_users == 0:
+                if sys.stdout is self._router:
+                    sys.stdout = self._router.stream
+                self._router = None
+
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the shared executor of the process
+    :return: an Executor object
+    """
+    global _EXECUTOR  # pylint: disable=global-statement
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = Executor()
+        return _EXECUTOR
+
+
+def get_max_workers(default=4):
+    """
+    Get the concurrency limit setup from config
+    :param default: default concurrency limit
+    :return: the maximal number of concurrent workers
+    """
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "r") as file:
+            try:
+                return max(1, int(file.readlines()[0]))
+            except (IndexError, ValueError):
+                pass
+    return default
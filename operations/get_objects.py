@@ -2,9 +2,37 @@
 The module is responsible for giving PBI and tasks information
 """
 
-import os
-import signal
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from tfs_connect import classification
+
+# A links query of a work item and all of the work items under it
+TREE_QUERY = "SELECT [System.Id] FROM WorkItemLinks " \
+             "WHERE [Source].[System.Id] = {0} " \
+             "AND [System.Links.LinkType] = 'System.LinkTypes.Hierarchy-Forward' " \
+             "MODE (Recursive)"
+
+# The number of work items read in a single page of a query (the TFS bulk read limit)
+QUERY_PAGE_SIZE = 200
+
+# The number of IDs a single WIQL request of query_workitems returns
+QUERY_ID_PAGE_SIZE = 10000
+
+# The fields the operations read, instead of the full work items
+# (a new task takes the area and the iteration of its PBI)
+PBI_LOCATION_FIELDS = ("System.AreaId", "System.IterationId")
+PBI_TYPE_FIELDS = ("System.WorkItemType",) + PBI_LOCATION_FIELDS
+TASK_COPY_FIELDS = ("System.WorkItemType",
+                    "System.Title",
+                    "Microsoft.VSTS.Common.BacklogPriority",
+                    "Microsoft.VSTS.Common.Activity",
+                    "System.Description")
+TITLE_FIELDS = ("System.Title",)
+
+# The area and the iteration (under the project) of the removed work items
+REMOVED_NODE_NAME = "Optimizers"
 
 
 class WorkitemDoesntMatchIDError(Exception):
@@ -13,6 +41,26 @@ class WorkitemDoesntMatchIDError(Exception):
     """
 
 
+class RemovedNodeDoesntExistError(Exception):
+    """
+    An exception that represents a missing area or iteration of the removed work items
+    """
+
+
+def get_classification_index(tfs_instance):
+    """
+    Get the areas and iterations index of the project, if the user can read it
+    :param tfs_instance: The tfs instance
+    :return: a ClassificationIndex, or None if it can't be read
+             (the area and iteration paths are then used as they are)
+    """
+    try:
+        return tfs_instance.get_classification()
+    except requests.exceptions.RequestException as error:
+        print(f"Can't read the areas and iterations, using their paths as is: {error}")
+        return None
+
+
 def get_item_id():
     """
     The function gets an item number from the user.
@@ -30,161 +78,192 @@ def get_item_id():
             return pbi_id
 
 
-def __get_available_tasks(user_credentials):
+def get_item_ids():
     """
-    The function is responsible of creating the template for each type of task
-    :param user_credentials: The user credentials object
-    :return: a dictionary of all tasks
+    The function gets several item numbers from the user.
+    :return: A list of integers representing the items IDs
     """
-    tasks_dict = ({})
 
-    # Write tests
-    tasks_dict["WriteTests"] = {
-        'System.Title': 'Write Tests',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '160',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
-    # Run Tests
-    tasks_dict["RunTests"] = {
-        'System.Title': 'Run Tests',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '180',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
-    # Review tests
-    tasks_dict["ReviewTests"] = {
-        'System.Title': 'Review Tests',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '170',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Requirements',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '0.5',  # Remaining Work
-        'System.AssignedTo': user_credentials['name'],  # Assigned to the System Analyst
-    }
-    # HLD
-    tasks_dict["HighLevelDesign"] = {
-        'System.Title': 'High Level Design',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '10',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '0',  # Remaining Work
-    }
-    # Release plan
-    tasks_dict["ReleasePlan"] = {
-        'System.Title': 'Release Plan',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '150',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '0.5',  # Remaining Work
-        'System.Description': "1) What needs to be released? including work order</br></br>" +
-                              "2) Dependencies (other PBIs, other teams)</br></br>" +
-                              "3) PM Work (demo, content, security…)</br></br>" +
-                              "4) Release to all environments</br>* QA2 (full QA)</br>" +
-                              "* Staging2</br>* Production (feature sanity if possible)</br>*" +
-                              " PerfCD</br>* ProdLikeCD"
-    }
-    # Remove toggle from code
-    tasks_dict["RemoveToggleCode"] = {
-        'System.Title': 'Remove toggle from code',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '50',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
-    # Remove toggle from consul
-    tasks_dict["RemoveToggleConsul"] = {
-        'System.Title': 'Remove toggle from consul',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '60',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
-    # Activate toggle
-    tasks_dict["ActivateToggle"] = {
-        'System.Title': 'Activate feature toggle',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '50',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
-    # Rollback plan
-    tasks_dict["Rollback"] = {
-        'System.Title': 'Rollback Plan',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '20',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '0',  # Remaining Work
-    }
-    # Notify
-    tasks_dict["Notify"] = {
-        'System.Title': 'Notify ...',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '190',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Requirements',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '0',  # Remaining Work
-    }
-    # Exploratory Tests
-    tasks_dict["ExploratoryTests"] = {
-        'System.Title': 'Exploratory Tests',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '180',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
-    # General task
-    tasks_dict["Requirement"] = {
-        'System.Title': 'Requirement',  # Title
-        'Microsoft.VSTS.Common.BacklogPriority': '20',  # Backlog Priority
-        'Microsoft.VSTS.Common.Activity': 'Development',  # Activity
-        'Microsoft.VSTS.Scheduling.RemainingWork': '',  # Remaining Work
-    }
+    while True:
+        ids_input = input("Enter Item IDs (separated by commas):")
+        try:
+            item_ids = [int(item_id) for item_id in ids_input.replace(" ", "").split(",")
+                        if item_id]
+        except ValueError:
+            print("Invalid IDs. Try again")
+        else:
+            if item_ids:
+                return item_ids
+            print("No IDs were given. Try again")
 
-    return tasks_dict
 
+def get_task_copy(original_task_data, target_pbi_data):
+    """
+    The function builds the fields of a copy of a task under another PBI
+    :param original_task_data: a TFS work item object of the task to copy
+                               (with at least the TASK_COPY_FIELDS)
+    :param target_pbi_data: the target PBI data (with at least the PBI_LOCATION_FIELDS)
+    :return: a task fields dictionary, or None if the work item is not a task
+    """
+    original_task = original_task_data.fields
+    if original_task["System.WorkItemType"] != "Task":
+        return None
 
-def get_tasks(user_credentials, pbi_type):
+    target_task = ({})
+    try:
+        target_task["System.State"] = "To Do"
+        target_task["System.AreaId"] = target_pbi_data["System.AreaId"]
+        target_task["System.IterationId"] = target_pbi_data["System.IterationId"]
+        target_task["System.Title"] = original_task["System.Title"]
+        target_task["Microsoft.VSTS.Common.BacklogPriority"] = \
+            original_task["Microsoft.VSTS.Common.BacklogPriority"]
+        target_task["Microsoft.VSTS.Common.Activity"] = \
+            original_task["Microsoft.VSTS.Common.Activity"]
+        target_task["System.Description"] = original_task["System.Description"]
+    except:
+        pass
+    return target_task
+
+
+def __get_page_query(query, last_id):
     """
-    Function to get the tasks we want to add to the PBI
-    :param user_credentials: a TFS credentials object
-    :param pbi_type: a string representing the type of tasks required, default is "regular"
-    :return: a list of dictionaries with the tasks fields
+    :param query: A flat WIQL query, e.g. "SELECT [System.Id] FROM WorkItems WHERE ..."
+    :param last_id: The last work item ID of the previous page (0 for the first page)
+    :return: The query of the work items after last_id, in the ID order
     """
+    query = re.split(r'\s+ORDER\s+BY\s+', query, flags=re.IGNORECASE)[0]
+    condition = "[System.Id] > {0}".format(last_id)
+    match = re.search(r'\s+WHERE\s+', query, re.IGNORECASE)
+    if match is None:
+        return "{0} WHERE {1} ORDER BY [System.Id]".format(query, condition)
+    return "{0} WHERE {1} AND ({2}) ORDER BY [System.Id]".format(query[:match.start()], condition,
+                                                                query[match.end():])
 
-    available_tasks = __get_available_tasks(user_credentials)
-    tasks = list([])
 
-    if pbi_type == "RegularTasks":
-        tasks.append(available_tasks["WriteTests"])
-        tasks.append(available_tasks["RunTests"])
-        tasks.append(available_tasks["ReviewTests"])
-        tasks.append(available_tasks["HighLevelDesign"])
-        tasks.append(available_tasks["ReleasePlan"])
-        tasks.append(available_tasks["Requirement"])
+def __get_id_pages(tfs_instance, query, page_size, query_page_size):
+    """
+    The generator runs a WIQL query a page of IDs at a time (past the WIQL results limit),
+    and yields the IDs in pages of page_size
+    :return: A generator of work item ID lists
+    """
+    last_id = 0
+    while True:
+        query_result = tfs_instance.run_wiql(__get_page_query(query, last_id),
+                                             top=query_page_size)
+        item_ids = [workitem['id'] for workitem in query_result.get('workItems', [])]
+        for index in range(0, len(item_ids), page_size):
+            yield item_ids[index:index + page_size]
+        if len(item_ids) < query_page_size:
+            return
+        last_id = item_ids[-1]
+
+
+def query_workitems(tfs_instance, query, fields=None, page_size=QUERY_PAGE_SIZE, prefetch=True,
+                    query_page_size=QUERY_ID_PAGE_SIZE):
+    """
+    The function runs a WIQL query and yields its work items, read in bulk a page at a time.
+    The query itself is run a page of IDs at a time (by "[System.Id] > the last ID"),
+    so any number of items can be read, while at most query_page_size IDs and two pages of items
+    are held in memory (the current page and the prefetched one).
+    :param tfs_instance: The tfs instance
+    :param query: A flat WIQL query, e.g. "SELECT [System.Id] FROM WorkItems WHERE ..."
+                  (its ORDER BY is replaced by the ID order)
+    :param fields: An optional list of the field names to read (see TFSConnection.get_workitems)
+    :param page_size: The number of work items read in a single request
+    :param prefetch: Read the next page while the current page is handled
+    :param query_page_size: The number of IDs a single WIQL request returns
+    :return: A generator of TFS work item objects, in the ID order
+    """
+    pages = __get_id_pages(tfs_instance, query, page_size, query_page_size)
 
-    if pbi_type == "CleanupTasks":
-        tasks.append(available_tasks["RemoveToggleCode"])
-        tasks.append(available_tasks["RemoveToggleConsul"])
-        tasks.append(available_tasks["HighLevelDesign"])
-        tasks.append(available_tasks["ReleasePlan"])
-        tasks.append(available_tasks["ExploratoryTests"])
+    def read_next_page():
+        page = next(pages, None)
+        return None if page is None else tfs_instance.get_workitems(page, fields=fields)
 
-    if pbi_type == "ExploratoryTasks":
-        tasks.append(available_tasks["HighLevelDesign"])
-        tasks.append(available_tasks["ReleasePlan"])
-        tasks.append(available_tasks["ExploratoryTests"])
+    if not prefetch:
+        for workitems in iter(read_next_page, None):
+            yield from workitems
+        return
 
-    if pbi_type == "GoingLiveTasks":
-        tasks.append(available_tasks["ActivateToggle"])
-        tasks.append(available_tasks["Rollback"])
-        tasks.append(available_tasks["Notify"])
-        tasks.append(available_tasks["ExploratoryTests"])
+    # Only the prefetch thread advances the pages generator
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tfs-prefetch") as pool:
+        next_page = pool.submit(contextvars.copy_context().run, read_next_page)
+        while True:
+            workitems = next_page.result()
+            if workitems is None:
+                return
+            next_page = pool.submit(contextvars.copy_context().run, read_next_page)
+            yield from workitems
 
-    if pbi_type == "E2ETasks":
-        tasks.append(available_tasks["WriteTests"])
-        tasks.append(available_tasks["RunTests"])
-        tasks.append(available_tasks["ReviewTests"])
 
-    return tasks
+def get_tree(tfs_instance, root_id, fields=None):
+    """
+    The function gets a work item and the whole hierarchy under it (e.g. Feature -> PBI -> Task).
+    The hierarchy is resolved by a single links query (or by the mirror, while it is fresh),
+    and the items are read in bulk.
+    :param tfs_instance: The tfs instance
+    :param root_id: The top work item ID
+    :param fields: An optional list of the field names to read (by default, the full items)
+    :return: A dictionary with the "root" work item, all of the "items" by ID,
+             and the "children" IDs of every item
+    """
+    root_id = int(root_id)
+    children = None
+    if tfs_instance.mirror is not None and tfs_instance.mirror.is_fresh():
+        children = tfs_instance.mirror.get_descendants(root_id)
+    if children is None:
+        query_result = tfs_instance.run_wiql(TREE_QUERY.format(root_id))
+        children = {root_id: []}
+        for relation in query_result.get('workItemRelations', []):
+            if relation.get('source') and relation.get('target'):
+                children.setdefault(relation['source']['id'], []).append(relation['target']['id'])
+                children.setdefault(relation['target']['id'], [])
+
+    items = {int(workitem.id): workitem
+             for workitem in tfs_instance.get_workitems(children, fields=fields)}
+    return {"root": items[root_id], "items": items, "children": children}
+
+
+def get_tree_levels(tree):
+    """
+    The function splits a hierarchy to its levels
+    :param tree: A hierarchy dictionary (see get_tree)
+    :return: A list of work item lists, from the root level down
+    """
+    levels = ([])
+    level = [int(tree["root"].id)]
+    while level:
+        levels.append([tree["items"][item_id] for item_id in level])
+        level = [child_id for item_id in level for child_id in tree["children"][item_id]]
+    return levels
 
 
-def __get_next_iteration(original_pbi_data):
+def get_tree_items(tree, workitem_type):
     """
-    Get the next iteration path for a given PBI
+    The function gets all of the work items of a given type in a hierarchy
+    :param tree: A hierarchy dictionary (see get_tree)
+    :param workitem_type: A work item type, e.g. "Product Backlog Item"
+    :return: A list of work items, from the root level down
+    """
+    return [workitem for level in get_tree_levels(tree) for workitem in level
+            if workitem["System.WorkItemType"] == workitem_type]
+
+
+def __get_next_iteration(tfs_instance, original_pbi_data):
+    """
+    Get the next iteration path for a given PBI: the iteration that starts after the PBI one.
+    If the iterations have no dates (or can't be read),
+    the trailing "Current" is dropped from the PBI iteration.
+    :param tfs_instance: The tfs instance
     :param original_pbi_data: A TFS workitem object
     :return: A string of the next iteration path
     """
     original_iteration = original_pbi_data["System.IterationPath"]
+    classification_index = get_classification_index(tfs_instance)
+    if classification_index is not None:
+        next_iteration = classification_index.get_next_iteration(original_iteration)
+        if next_iteration is not None:
+            return next_iteration['path']
     original_iteration_split = original_iteration.split("\\")
     if original_iteration_split[-1] == "Current":
         original_iteration_split.pop()
@@ -204,7 +283,7 @@ def __get_cleanup_title(tfs_instance, original_pbi_fields, parent_id, title_type
         cleanup_pbi_title = original_pbi_fields["System.Title"] + " - Cleanup"
     elif title_type == "CreateCleanupFromFeature":
         if parent_id is not None:
-            feature_data = tfs_instance.get_workitem(parent_id)
+            feature_data = tfs_instance.get_workitem(parent_id, fields=TITLE_FIELDS)
             cleanup_pbi_title = feature_data["System.Title"] + ": Cleanup"
         else:
             cleanup_pbi_title = original_pbi_fields["System.Title"] + " - Cleanup"
@@ -220,6 +299,7 @@ def get_cleanup_pbi(tfs_instance, original_pbi_id, title_type=None):
     :param original_pbi_id: Source PBI ID
     :param title_type: Either a PBI or a Feature title
     :return: A dictionary with the cleanup fields ("data") and its parent_id ("parent_id") if exists
+    :raises requests.exceptions.RequestException: if the PBI can't be read (after the retries)
     """
 
     cleanup_pbi = ({})
@@ -227,13 +307,7 @@ def get_cleanup_pbi(tfs_instance, original_pbi_id, title_type=None):
     cleanup_pbi["parent_id"] = None
 
     # Get PBI data
-    try:
-        original_pbi_data = tfs_instance.connection.get_workitem(original_pbi_id)
-    except requests.exceptions.HTTPError as ex:
-        print('An HTTP error: {0}'.format(ex))
-        os.kill(os.getpid(), signal.SIGTERM)
-    except Exception as ex:
-        print(ex)
+    original_pbi_data = tfs_instance.get_workitem(original_pbi_id)
 
     # Build the PBI fields
     original_pbi_fields = original_pbi_data.fields
@@ -257,7 +331,7 @@ def get_cleanup_pbi(tfs_instance, original_pbi_id, title_type=None):
         cleanup_pbi["data"]["NetBet.ProductPreparationState"] = "Not Required"
         cleanup_pbi["data"]["NetBet.TechnicalPreparationState"] = "Not Started"
         cleanup_pbi["data"]["System.IterationPath"] = \
-            __get_next_iteration(original_pbi_data)
+            __get_next_iteration(tfs_instance, original_pbi_data)
 
         # Fields that should be as the original PBI (if they have any value)
         fields_to_copy = ["NetBet.FinancialEntity2",
@@ -274,13 +348,24 @@ def get_cleanup_pbi(tfs_instance, original_pbi_id, title_type=None):
     return cleanup_pbi
 
 
-def get_removed_task_data(user_credentials, rel_count=0):
+def get_removed_task_data(user_credentials, rel_count=0, classification_index=None):
     """
     The function is responsible of creating the template for a removed task
-    :return: a dictionary with the task
+    :param user_credentials: The user credentials object
+    :param rel_count: the number of relations to remove from the task
+    :param classification_index: an optional ClassificationIndex, to check the removed items
+                                 area and iteration exist
+    :raises RemovedNodeDoesntExistError: if the index doesn't have the area or the iteration
+    :return: a JSON-patch that removes the task and its relations
     """
-    optimizers_area_path = user_credentials['project'] + r'\Optimizers'
-    optimizers_iteration_path = user_credentials['project'] + r'\Optimizers'
+    optimizers_area_path = user_credentials['project'] + '\\' + REMOVED_NODE_NAME
+    optimizers_iteration_path = user_credentials['project'] + '\\' + REMOVED_NODE_NAME
+    if classification_index is not None:
+        for path, structure_type in ((optimizers_area_path, classification.AREA),
+                                     (optimizers_iteration_path, classification.ITERATION)):
+            if classification_index.get_node_by_path(path, structure_type) is None:
+                raise RemovedNodeDoesntExistError(
+                    f'The {structure_type} {path} of the removed items doesn\'t exist')
 
     task_data = {
         'System.State': 'Removed',
@@ -292,11 +377,30 @@ def get_removed_task_data(user_credentials, rel_count=0):
                  for name, value in task_data.items()] \
         if task_data else []
 
+    # Remove from the last relation, so the indexes of the remaining ones don't change
     if rel_count > 0:
-        for rel in range(rel_count):
+        for rel in reversed(range(rel_count)):
             task_dict.append({
                 "op": "remove",
                 "path": "/relations/" + str(rel)
             })
 
     return task_dict
+
+
+def get_removed_item_update(user_credentials, item_data, classification_index=None):
+    """
+    The function builds the single update that removes a work item and drops all of its relations.
+    The relations are removed by their indexes, so the update is rejected if the item changed
+    since it was read (e.g. it was read from the cache or the mirror)
+    :param user_credentials: The user credentials object
+    :param item_data: A TFS workitem object
+    :param classification_index: an optional ClassificationIndex (see get_removed_task_data)
+    :return: a tuple of the work item ID and its JSON-patch
+    """
+    relations = item_data.data.get('relations') or []
+    update_data = get_removed_task_data(user_credentials, rel_count=len(relations),
+                                        classification_index=classification_index)
+    if relations and item_data.data.get('rev') is not None:
+        update_data.insert(0, {"op": "test", "path": "/rev", "value": item_data.data['rev']})
+    return int(item_data.id), update_data
@@ -0,0 +1,312 @@
+"""
+The module runs operations without user interaction.
+Operation records are read from a JSONL or CSV stream, and a JSONL result is written per record.
+
+A JSONL record looks like {"operation": "RegularTasks", "pbi_id": 1234},
+and a CSV stream starts with a header line, e.g. "operation,pbi_id,source_id,target_id,task_id".
+The targets of CloneTasksToMany are a "target_ids" list (or a "1;2;3" CSV value).
+The task operations (adding, cloning and removing tasks) of a window are planned together
+(see manage_plans), so they share their reads and their $batch requests.
+A dry run only plans them, and reports the requests.
+"""
+
+import contextlib
+import csv
+import itertools
+import json
+import sys
+from executor import executor
+from operations import get_objects
+from operations import manage_operations
+from operations import manage_plans
+from operations import manage_tasks
+from tfs_connect import instrumentation
+
+# The maximal number of records that are read ahead of the written results
+DEFAULT_WINDOW = 32
+
+TASK_OPERATIONS = ("RegularTasks", "CleanupTasks", "GoingLiveTasks", "E2ETasks",
+                   "ExploratoryTasks")
+
+# Operations that need the user (e.g. UpdateCredentials) can't run in a batch
+BATCH_OPERATIONS = [operation.name for operation in manage_operations.initiate_operations()
+                    if operation.name not in ("UpdateCredentials", "EndProgram")]
+
+
+class RecordError(Exception):
+    """
+    An error indicating an operation record is invalid
+    """
+
+
+def read_records(stream):
+    """
+    The function reads operation records from a JSONL or CSV stream, one at a time
+    :param stream: a text stream
+    :return: a generator of record dictionaries
+    """
+    lines = (line for line in stream if line.strip())
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+
+    lines = itertools.chain([first_line], lines)
+    if first_line.lstrip().startswith("{"):
+        for line in lines:
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                yield RecordError(f'Invalid JSON record: {error}')
+    else:
+        for record in csv.DictReader(lines):
+            yield {key.strip(): value.strip() for key, value in record.items()
+                   if key is not None and value}
+
+
+def __get_id(record, key):
+    """
+    :param record: an operation record
+    :param key: the ID key
+    :return: the ID as an integer
+    """
+    try:
+        return int(record[key])
+    except KeyError:
+        raise RecordError(f'The record is missing "{key}"')
+    except (TypeError, ValueError):
+        raise RecordError(f'Invalid "{key}": {record[key]}')
+
+
+def __get_ids(record, key):
+    """
+    :param record: an operation record
+    :param key: the IDs key
+    :return: the IDs as a list of integers
+    """
+    item_ids = record.get(key)
+    if isinstance(item_ids, str):
+        item_ids = [item_id for item_id in item_ids.split(";") if item_id.strip()]
+    if not item_ids or not isinstance(item_ids, list):
+        raise RecordError(f'The record is missing "{key}"')
+    try:
+        return [int(item_id) for item_id in item_ids]
+    except (TypeError, ValueError):
+        raise RecordError(f'Invalid "{key}": {record[key]}')
+
+
+def run_record(record, tfs_instance, user_credentials):
+    """
+    The function runs the operation of a single record
+    :param record: an operation record
+    :param tfs_instance: the TFS connection
+    :param user_credentials: the credentials
+    :return: the operation result
+    """
+    if isinstance(record, RecordError):
+        raise record
+
+    operation = record.get("operation")
+    if operation not in BATCH_OPERATIONS:
+        raise RecordError(f'Unsupported operation: {operation}')
+
+    if operation in TASK_OPERATIONS:
+        return manage_tasks.add_tasks_to_pbi(tfs_instance, user_credentials,
+                                             pbi_id=__get_id(record, "pbi_id"),
+                                             pbi_type=operation)
+    if operation == "CloneTasks":
+        return manage_tasks.clone_pbi_tasks(tfs_instance,
+                                            source_pbi_id=__get_id(record, "source_id"),
+                                            target_pbi_id=__get_id(record, "target_id"))
+    if operation == "CloneTasksToMany":
+        return manage_tasks.clone_pbi_tasks_to_many(
+            tfs_instance, source_pbi_id=__get_id(record, "source_id"),
+            target_pbi_ids=__get_ids(record, "target_ids"))
+    if operation in ("CreateCleanupFromPBI", "CreateCleanupFromFeature"):
+        return manage_tasks.copy_pbi_to_cleanup(tfs_instance, user_credentials,
+                                                title_type=operation,
+                                                original_pbi_id=__get_id(record, "pbi_id"))
+    if operation == "RemovePBITasks":
+        return manage_tasks.remove_pbi_with_tasks(tfs_instance, user_credentials,
+                                                  pbi_id=__get_id(record, "pbi_id"))
+    return manage_tasks.remove_task_from_pbi(tfs_instance, user_credentials,
+                                             task_id=__get_id(record, "task_id"))
+
+
+def plan_record(record, user_credentials, classification_index=None):
+    """
+    The function plans the operation of a single record, if it can be planned
+    (the operations that depend on the results of their own writes can't)
+    :param record: an operation record
+    :param user_credentials: the credentials
+    :param classification_index: an optional ClassificationIndex, to check the removed tasks
+                                 area and iteration
+    :return: a planner generator (see manage_plans), or None
+    """
+    if isinstance(record, RecordError):
+        raise record
+    if not isinstance(record, dict):
+        raise RecordError(f'Invalid record: {json.dumps(record)}')
+
+    operation = record.get("operation")
+    if operation not in BATCH_OPERATIONS:
+        raise RecordError(f'Unsupported operation: {operation}')
+
+    if operation in TASK_OPERATIONS:
+        return manage_tasks.plan_add_tasks_to_pbi(user_credentials, __get_id(record, "pbi_id"),
+                                                  pbi_type=operation)
+    if operation == "CloneTasks":
+        return manage_tasks.plan_clone_pbi_tasks(__get_id(record, "source_id"),
+                                                 [__get_id(record, "target_id")])
+    if operation == "CloneTasksToMany":
+        return manage_tasks.plan_clone_pbi_tasks(__get_id(record, "source_id"),
+                                                 __get_ids(record, "target_ids"))
+    if operation == "RemoveTask":
+        return manage_tasks.plan_remove_task(user_credentials, __get_id(record, "task_id"),
+                                             classification_index=classification_index)
+    return None
+
+
+def run_planned_records(planners, tfs_instance, dry_run=False):
+    """
+    The function runs planned records together, in a single set of reads and $batch requests
+    :param planners: a list of planner generators (see plan_record)
+    :param tfs_instance: the TFS connection
+    :param dry_run: plan only, without writing
+    :return: a tuple of a result dictionary per planner (like the executor results),
+             and the plan summary. A dry run result is the number of the record writes
+    """
+    with instrumentation.operation("Plan"):
+        results, summary = manage_plans.run_plans(planners, tfs_instance, dry_run=dry_run)
+    if dry_run:
+        return [{"result": len(result["writes"]), "error": result["error"]}
+                for result in results], summary
+    return [{"result": manage_plans.report(result), "error": result["error"]}
+            for result in results], summary
+
+
+def run_instrumented_record(record, tfs_instance, user_credentials):
+    """
+    The function runs the operation of a single record, tagging its HTTP calls
+    with the record operation
+    :return: the operation result
+    """
+    operation = record.get("operation") if isinstance(record, dict) else None
+    with instrumentation.operation(str(operation)):
+        return run_record(record, tfs_instance, user_credentials)
+
+
+def get_record_result(record_number, record, item_result):
+    """
+    Builds the JSONL result of a record
+    :param record_number: the record ordinal number in the stream
+    :param record: the operation record
+    :param item_result: the executor result of the record
+    :return: a result dictionary
+    """
+    result = {"record": record_number,
+              "operation": record.get("operation") if isinstance(record, dict) else None,
+              "status": "ok",
+              "result": item_result["result"]}
+    if item_result["error"] is not None:
+        result["status"] = "error"
+        result["error"] = str(item_result["error"])
+    elif item_result["result"] is None:
+        result["status"] = "error"
+        result["error"] = "The operation failed, see the log for details"
+    return result
+
+
+def run_window(chunk, tfs_instance, user_credentials, dry_run=False):
+    """
+    The function runs a window of records, in their order: the task operations of every sequence
+    of records that can be planned are planned together, and the other records run concurrently
+    :param chunk: a list of (record number, record) tuples
+    :param tfs_instance: the TFS connection
+    :param user_credentials: the credentials
+    :param dry_run: plan only, without writing (the other records are skipped)
+    :return: a tuple of a result dictionary per record (None if it was skipped),
+             and the plans summary
+    """
+    # The removed tasks area and iteration are checked once per window
+    classification_index = None
+    if any(isinstance(record, dict) and record.get("operation") == "RemoveTask"
+           for _, record in chunk):
+        classification_index = get_objects.get_classification_index(tfs_instance)
+
+    planners = ([])
+    for _, record in chunk:
+        try:
+            planners.append(plan_record(record, user_credentials,
+                                        classification_index=classification_index))
+        except RecordError as error:
+            planners.append(error)
+
+    item_results = [None] * len(chunk)
+    total = {"writes": 0, "merged_writes": 0, "read_requests": 0, "write_requests": 0,
+             "requests": 0}
+    for planned, indexes in itertools.groupby(range(len(chunk)),
+                                              key=lambda index: planners[index] is not None):
+        indexes = list(indexes)
+        if planned:
+            # The invalid records have their error as a result
+            for index in indexes:
+                if isinstance(planners[index], RecordError):
+                    item_results[index] = {"result": None, "error": planners[index]}
+            indexes = [index for index in indexes
+                       if not isinstance(planners[index], RecordError)]
+            results, summary = run_planned_records([planners[index] for index in indexes],
+                                                   tfs_instance, dry_run=dry_run)
+            total = {key: value + summary[key] for key, value in total.items()}
+        elif dry_run:
+            results = [None] * len(indexes)
+        else:
+            results = executor.get_executor().run(
+                lambda item: run_instrumented_record(item[1], tfs_instance, user_credentials),
+                [chunk[index] for index in indexes])
+        for index, item_result in zip(indexes, results):
+            item_results[index] = item_result
+    return item_results, total
+
+
+def run_batch(input_stream, output_stream, tfs_instance, user_credentials, window=DEFAULT_WINDOW,
+              dry_run=False):
+    """
+    The function runs all of the records in the input stream.
+    Up to "window" records are handled concurrently, so the memory use doesn't depend
+    on the stream length. The operations log is written to stderr.
+    A dry run plans the records that can be planned, skips the others, and writes
+    the number of requests the plans need to stderr.
+    :param input_stream: a JSONL or CSV text stream of operation records
+    :param output_stream: a text stream for the JSONL results
+    :param tfs_instance: the TFS connection
+    :param user_credentials: the credentials
+    :param window: the number of records handled together
+    :param dry_run: plan only, without writing
+    :return: the number of failed records
+    """
+    failed = 0
+    total = {"writes": 0, "merged_writes": 0, "read_requests": 0, "write_requests": 0,
+             "requests": 0}
+    records = enumerate(read_records(input_stream), start=1)
+    with contextlib.redirect_stdout(sys.stderr):
+        while True:
+            chunk = list(itertools.islice(records, window))
+            if not chunk:
+                break
+            item_results, summary = run_window(chunk, tfs_instance, user_credentials,
+                                               dry_run=dry_run)
+            total = {key: value + summary[key] for key, value in total.items()}
+            for (record_number, record), item_result in zip(chunk, item_results):
+                if item_result is None:
+                    result = {"record": record_number, "operation": record.get("operation"),
+                              "status": "skipped"}
+                else:
+                    result = get_record_result(record_number, record, item_result)
+                if dry_run and result["status"] == "ok":
+                    result["status"] = "planned"
+                failed += result["status"] == "error"
+                output_stream.write(json.dumps(result) + "\n")
+            output_stream.flush()
+    if dry_run:
+        manage_plans.print_summary(total, stream=sys.stderr)
+    return failed
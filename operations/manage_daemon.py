@@ -0,0 +1,210 @@
+"""
+The module serves operations to local tools, as a long-lived process.
+The operations run against a warm TFS connection (with its caches and worker pool),
+so a request doesn't pay the interpreter startup, the credentials load and the connection setup.
+
+The requests are the batch records (see manage_batch), served over localhost HTTP:
+    POST /operations  - a record, or a list of records, and the result (or list of results)
+    GET  /health      - the server status
+    GET  /metrics     - the HTTP metrics in the Prometheus text format
+or over a Unix socket, as a JSONL record per line and a JSONL result per line.
+
+The operations run with the user credentials, so only the user may request them:
+a POST needs the token the server writes (readable only by its owner) to TOKEN_PATH
+in its TOKEN_HEADER, and a JSON content type. Browser requests (with an Origin) are rejected.
+The Unix socket is created readable and writable only by its owner.
+"""
+
+import contextlib
+import hmac
+import json
+import os
+import secrets
+import socketserver
+import sys
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from executor import executor
+from operations import manage_batch
+from tfs_connect import instrumentation
+
+DEFAULT_HOST = "127.0.0.1"
+
+# The file of the token a POST request needs, generated on every start
+TOKEN_PATH = "./tfs_daemon.token"
+TOKEN_HEADER = "X-TFS-Token"
+
+
+def run_records(records, tfs_instance, user_credentials):
+    """
+    The function runs operation records concurrently
+    :param records: a list of operation records
+    :param tfs_instance: the TFS connection
+    :param user_credentials: the credentials
+    :return: a list of result dictionaries, in the given order
+    """
+    items = list(enumerate(records, start=1))
+    results = executor.get_executor().run(
+        lambda item: manage_batch.run_instrumented_record(item[1], tfs_instance, user_credentials),
+        items)
+    return [manage_batch.get_record_result(record_number, record, item_result)
+            for (record_number, record), item_result in zip(items, results)]
+
+
+class OperationsHandler(BaseHTTPRequestHandler):
+    """
+    An HTTP request handler of the operations server
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Serves the server status and metrics
+        :return: None
+        """
+        if self.headers.get("Origin") is not None:
+            self._send(403, json.dumps({"error": "Browser requests are not allowed"}),
+                       "application/json")
+        elif self.path == "/health":
+            self._send(200, json.dumps({"status": "ok"}), "application/json")
+        elif self.path == "/metrics":
+            self._send(200, instrumentation.INSTRUMENTATION.to_prometheus(),
+                       "text/plain; version=0.0.4")
+        else:
+            self._send(404, json.dumps({"error": "Unknown path"}), "application/json")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Runs the posted operation records
+        :return: None
+        """
+        if self.path != "/operations":
+            self._send(404, json.dumps({"error": "Unknown path"}), "application/json")
+            return
+        error = self._get_request_error()
+        if error is not None:
+            self.close_connection = True  # the request body is not read
+            self._send(error[0], json.dumps({"error": error[1]}), "application/json")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as error:
+            self._send(400, json.dumps({"error": f'Invalid JSON request: {error}'}),
+                       "application/json")
+            return
+
+        records = request if isinstance(request, list) else [request]
+        results = run_records(records, self.server.tfs_instance, self.server.user_credentials)
+        self._send(200, json.dumps(results if isinstance(request, list) else results[0]),
+                   "application/json")
+
+    def _get_request_error(self):
+        """
+        :return: a tuple of the HTTP status and the error message of a request
+                 that is not allowed, or None
+        """
+        if self.headers.get("Origin") is not None:
+            return 403, "Browser requests are not allowed"
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            return 415, "The request content type must be application/json"
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode("utf-8"),
+                                   self.server.token.encode("utf-8")):
+            return 401, f'Missing or invalid {TOKEN_HEADER} header'
+        return None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # The requests are logged to stderr, as the operations log
+        sys.stderr.write("%s - %s\n" % (self.address_string(), format % args))
+
+    def _send(self, status, body, content_type):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OperationsStreamHandler(socketserver.StreamRequestHandler):
+    """
+    A Unix socket handler of the operations server: a JSONL record per line
+    """
+    def handle(self):
+        for record in manage_batch.read_records(line.decode("utf-8") for line in self.rfile):
+            result, = run_records([record], self.server.tfs_instance, self.server.user_credentials)
+            self.wfile.write((json.dumps(result) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+def write_token(token_path):
+    """
+    The function generates a new token, and writes it to a file readable only by its owner
+    :param token_path: the token file path
+    :return: the token
+    """
+    token = secrets.token_urlsafe(32)
+    if os.path.exists(token_path):
+        os.remove(token_path)  # a file of another owner (or mode) is not reused
+    descriptor = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "w") as file:
+        file.write(token)
+    os.chmod(token_path, 0o600)
+    return token
+
+
+def create_server(tfs_instance, user_credentials, port=None, socket_path=None,
+                  token_path=TOKEN_PATH):
+    """
+    The function creates the operations server, on a localhost port or on a Unix socket
+    :param tfs_instance: the TFS connection the operations run against
+    :param user_credentials: the credentials
+    :param port: a localhost TCP port (0 for any free port)
+    :param socket_path: a Unix socket path (instead of the port)
+    :param token_path: the file of the token the HTTP requests need
+    :return: a server object (see serve)
+    """
+    if socket_path is not None:
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            raise OSError("Unix sockets are not supported on this system")
+        # The socket is created with the owner permissions only, before anyone can connect
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(socket_path, OperationsStreamHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+        server.token_path = None
+    else:
+        server = ThreadingHTTPServer((DEFAULT_HOST, port), OperationsHandler)
+        try:
+            server.token = write_token(token_path)
+        except OSError:
+            server.server_close()
+            raise
+        server.token_path = token_path
+    server.daemon_threads = True
+    server.tfs_instance = tfs_instance
+    server.user_credentials = user_credentials
+    return server
+
+
+def serve(server):
+    """
+    The function serves requests until the process is interrupted.
+    The operations log is written to stderr.
+    :param server: a server object (see create_server)
+    :return: None
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+                os.remove(server.server_address)  # the Unix socket file
+            if server.token_path is not None and os.path.exists(server.token_path):
+                os.remove(server.token_path)
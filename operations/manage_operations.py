@@ -68,7 +68,9 @@ def initiate_operations():
                                          "Create a cleanup PBI for a Feature"))
     operations_list.append(OperationType(9, "RemoveTask", "Remove a task"))
     operations_list.append(OperationType(10, "RemovePBITasks", "Remove a PBI and its tasks"))
-    operations_list.append(OperationType(11, "UpdateCredentials", "Update your TFS credentials"))
-    operations_list.append(OperationType(12, "EndProgram", "Exit"))
+    operations_list.append(OperationType(11, "CloneTasksToMany",
+                                         "Clone tasks from a PBI to many PBIs"))
+    operations_list.append(OperationType(12, "UpdateCredentials", "Update your TFS credentials"))
+    operations_list.append(OperationType(13, "EndProgram", "Exit"))
 
     return operations_list
@@ -0,0 +1,331 @@
+"""
+The module splits the operations to a plan and its execution.
+An operation planner is a generator: it yields the reads it needs (a read, a hierarchy read,
+or a list of them) and gets their results, and it returns the writes it wants.
+The planners of several operations run together in rounds, so the reads of a round are
+deduplicated and read in bulk once. The writes of all of the planners are then optimized
+(the updates and the relation edits of every item are merged to a single update)
+and sent together in $batch requests. A dry run reads and plans, but doesn't write.
+"""
+
+import math
+import requests
+from operations import get_objects
+from tfs_connect import tfs
+
+READ = "read"
+TREE = "tree"
+CREATE = "create"
+UPDATE = "update"
+
+
+def read(item_ids, fields=None, expand=None, skip_missing=False):
+    """
+    :param item_ids: a list of work item IDs
+    :param fields: an optional list of the field names to read
+    :param expand: an optional expand mode (see TFSConnection.get_workitems)
+    :param skip_missing: if the bulk read fails, read the items one by one,
+                         so an item that can't be read doesn't fail the others
+    :return: a read step, its result is the list of the work items, in the given order
+             (with skip_missing, an item that can't be read is its read error instead)
+    """
+    return {"kind": READ, "ids": [int(item_id) for item_id in item_ids],
+            "fields": tuple(fields) if fields else None, "expand": expand,
+            "skip_missing": skip_missing}
+
+
+def read_tree(root_id, fields=None):
+    """
+    :param root_id: the top work item ID
+    :param fields: an optional list of the field names to read
+    :return: a hierarchy read step, its result is a hierarchy dictionary (see get_objects.get_tree)
+    """
+    return {"kind": TREE, "root_id": int(root_id), "fields": tuple(fields) if fields else None}
+
+
+def create(workitem_type, parent_item_id, patch, done, failed):
+    """
+    :param workitem_type: the new work item type
+    :param parent_item_id: the parent work item ID (or None)
+    :param patch: a list of JSON-patch operations
+    :param done: the success message, with an {id} of the new work item
+    :param failed: the failure message (the error is added to it)
+    :return: a write of a new work item
+    """
+    return {"kind": CREATE, "type": workitem_type, "parent_id": parent_item_id, "patch": patch,
+            "done": done, "failed": failed}
+
+
+def update(item_id, patch, done, failed):
+    """
+    :param item_id: the work item ID
+    :param patch: a list of JSON-patch operations
+    :param done: the success message, with an {id} of the work item
+    :param failed: the failure message (the error is added to it)
+    :return: a write of a work item update
+    """
+    return {"kind": UPDATE, "id": int(item_id), "patch": patch, "done": done, "failed": failed}
+
+
+def __read_round(tfs_instance, steps):
+    """
+    Reads all of the steps of a planning round.
+    Every work item is read once: in full if any step needs it in full,
+    or else with all of the fields the steps need.
+    :param tfs_instance: the TFS connection
+    :param steps: a list of read steps
+    :return: a tuple of the results (or errors) by step index and the number of read requests
+    """
+    # A work item is read by its fields (a frozenset) or in full, by its expand mode (a string)
+    needed = {}
+    for step in steps:
+        for item_id in step.get("ids", []):
+            current = needed.get(item_id)
+            if step["fields"] is None:
+                expand = (step["expand"] or "all").lower()
+                needed[item_id] = expand if current is None or isinstance(current, frozenset) \
+                    or current == expand else "all"
+            elif current is None or isinstance(current, frozenset):
+                needed[item_id] = (current or frozenset()) | frozenset(step["fields"])
+    groups = {}
+    for item_id, read_mode in needed.items():
+        groups.setdefault(read_mode, []).append(item_id)
+
+    workitems = {}
+    failed_ids = set()
+    request_count = 0
+    for read_mode, item_ids in groups.items():
+        request_count += math.ceil(len(item_ids) / tfs.BULK_READ_LIMIT)
+        try:
+            if isinstance(read_mode, frozenset):
+                found = tfs_instance.get_workitems(item_ids, fields=sorted(read_mode))
+            else:
+                found = tfs_instance.get_workitems(item_ids, expand=read_mode)
+            workitems.update((int(workitem.id), workitem) for workitem in found)
+        except requests.exceptions.RequestException:
+            failed_ids.update(item_ids)
+
+    trees = {}
+    results = {}
+    for index, step in enumerate(steps):
+        if step["kind"] == TREE:
+            key = (step["root_id"], step["fields"])
+            if key not in trees:
+                try:
+                    trees[key] = get_objects.get_tree(tfs_instance, step["root_id"],
+                                                      fields=step["fields"])
+                    request_count += 1 + math.ceil(len(trees[key]["items"]) /
+                                                   tfs.BULK_READ_LIMIT)
+                except requests.exceptions.RequestException as error:
+                    trees[key] = error
+                    request_count += 1
+            results[index] = trees[key]
+        elif failed_ids.intersection(step["ids"]) and step.get("skip_missing"):
+            # The items of a failed shared read are read one by one, so only the invalid IDs fail
+            results[index] = ([])
+            for item_id in step["ids"]:
+                if item_id in workitems:
+                    results[index].append(workitems[item_id])
+                    continue
+                request_count += 1
+                try:
+                    workitems[item_id], = tfs_instance.get_workitems(
+                        [item_id], fields=step["fields"], expand=step["expand"])
+                    results[index].append(workitems[item_id])
+                except requests.exceptions.RequestException as error:
+                    results[index].append(error)
+        elif failed_ids.intersection(step["ids"]):
+            # A failed shared read is read again by each step, so an invalid ID fails its step only
+            request_count += math.ceil(len(step["ids"]) / tfs.BULK_READ_LIMIT)
+            try:
+                results[index] = tfs_instance.get_workitems(step["ids"], fields=step["fields"],
+                                                            expand=step["expand"])
+            except requests.exceptions.RequestException as error:
+                results[index] = error
+        else:
+            results[index] = [workitems[item_id] for item_id in step["ids"]]
+    return results, request_count
+
+
+def plan_operations(planners, tfs_instance):
+    """
+    The function runs operation planners together, a round of reads at a time
+    :param planners: a list of planner generators
+    :param tfs_instance: the TFS connection
+    :return: a plan dictionary: the "writes" (a list per planner, None if the planner failed),
+             the planners "errors" (None on success) and the number of "read_requests"
+    """
+    writes = [None] * len(planners)
+    errors = [None] * len(planners)
+    read_requests = 0
+    pending = {}
+
+    def advance(index, value=None, error=None):
+        try:
+            step = planners[index].throw(error) if error is not None else \
+                planners[index].send(value)
+        except StopIteration as stop:
+            writes[index] = stop.value or []
+        except Exception as planner_error:  # pylint: disable=broad-except
+            errors[index] = planner_error
+        else:
+            pending[index] = step
+
+    for index in range(len(planners)):
+        advance(index)
+    while pending:
+        steps = ([])
+        for step in pending.values():
+            steps.extend(step if isinstance(step, list) else [step])
+        results, request_count = __read_round(tfs_instance, steps)
+        read_requests += request_count
+
+        round_pending, pending = pending, {}
+        position = 0
+        for index, step in round_pending.items():
+            count = len(step) if isinstance(step, list) else 1
+            step_results = [results[position + offset] for offset in range(count)]
+            position += count
+            failed = [result for result in step_results if isinstance(result, Exception)]
+            if failed:
+                advance(index, error=failed[0])
+            else:
+                advance(index, value=step_results if isinstance(step, list) else step_results[0])
+    return {"writes": writes, "errors": errors, "read_requests": read_requests}
+
+
+def optimize(plan):
+    """
+    The function merges the writes of a plan: the updates and the relation edits of every item
+    are merged to a single update (a field written twice keeps its last value),
+    and all of the writes are packed together in $batch requests
+    :param plan: a plan dictionary (see plan_operations)
+    :return: a dictionary of the "creates" and the "updates" to send (see apply_writes),
+             the "targets" of every planner write (its kind and index in the sent writes),
+             and the number of "write_requests"
+    """
+    creates = ([])
+    updates = {}
+    targets = ([])
+    for planner_writes in plan["writes"]:
+        planner_targets = ([])
+        for write in planner_writes or []:
+            if write["kind"] == CREATE:
+                planner_targets.append((CREATE, len(creates)))
+                creates.append((write["type"], write["parent_id"], write["patch"]))
+            else:
+                planner_targets.append((UPDATE, write["id"]))
+                updates.setdefault(write["id"], []).append(write["patch"])
+        targets.append(planner_targets)
+
+    merged_updates = [(item_id, __merge_patches(patches)) for item_id, patches in updates.items()]
+    update_indexes = {item_id: index for index, (item_id, _) in enumerate(merged_updates)}
+    targets = [[(kind, target if kind == CREATE else update_indexes[target])
+                for kind, target in planner_targets] for planner_targets in targets]
+    return {"creates": creates, "updates": merged_updates, "targets": targets,
+            "write_requests": math.ceil((len(creates) + len(merged_updates)) / tfs.BATCH_LIMIT)}
+
+
+def __merge_patches(patches):
+    """
+    :param patches: the JSON-patches of the writes of a single item, in their order
+    :return: a single JSON-patch: the test operations (e.g. of the read revision), the relation
+             removals of the last write that removes relations (the indexes of every write are of
+             the item as it was read, so the removals of two writes are not added up),
+             the field changes (the last change of every field) and the relation additions
+             (without duplicates)
+    """
+    tests = ([])
+    removals = ([])
+    fields = {}
+    additions = ([])
+    for patch in patches:
+        patch_removals = ([])
+        for operation in patch:
+            if operation['op'] == 'test':
+                if operation not in tests:
+                    tests.append(operation)
+            elif operation['path'].startswith('/relations'):
+                if operation['op'] == 'remove':
+                    patch_removals.append(operation)
+                elif operation not in additions:
+                    additions.append(operation)
+            else:
+                fields[operation['path']] = operation
+        removals = patch_removals or removals
+    removals = sorted(removals, key=lambda operation: int(operation['path'].split('/')[-1]),
+                      reverse=True)
+    return tests + removals + list(fields.values()) + additions
+
+
+def run_plans(planners, tfs_instance, dry_run=False):
+    """
+    The function plans operations together, and executes their optimized writes
+    :param planners: a list of planner generators
+    :param tfs_instance: the TFS connection
+    :param dry_run: plan (and read) only, without writing
+    :return: a tuple of a result dictionary per planner and the plan summary.
+             A result has the planner "error" (None on success) and the list of its "writes",
+             a (write, write result) tuple each (the write result is None on a dry run).
+             The summary has the number of the planned "writes", the "merged_writes" to send,
+             and the (estimated) "read_requests", "write_requests" and total "requests"
+    """
+    plan = plan_operations(planners, tfs_instance)
+    optimized = optimize(plan)
+    summary = {"read_requests": plan["read_requests"],
+               "writes": sum(len(writes or []) for writes in plan["writes"]),
+               "merged_writes": len(optimized["creates"]) + len(optimized["updates"]),
+               "write_requests": optimized["write_requests"]}
+    summary["requests"] = summary["read_requests"] + summary["write_requests"]
+
+    create_results = update_results = None
+    if not dry_run and summary["merged_writes"]:
+        create_results, update_results = tfs_instance.apply_writes(optimized["creates"],
+                                                                   optimized["updates"])
+    results = ([])
+    for error, writes, targets in zip(plan["errors"], plan["writes"], optimized["targets"]):
+        write_results = ([])
+        for write, (kind, index) in zip(writes or [], targets):
+            if create_results is None:
+                write_results.append((write, None))
+            else:
+                write_results.append((write, (create_results if kind == CREATE else
+                                              update_results)[index]))
+        results.append({"error": error, "writes": write_results})
+    return results, summary
+
+
+def report(result):
+    """
+    The function prints the outcome of a planned operation
+    :param result: a planner result (see run_plans)
+    :return: a list of the IDs of the written work items (None if the planning failed)
+    """
+    if result["error"] is not None:
+        if isinstance(result["error"], requests.exceptions.RequestException):
+            print(f'An HTTP error: {result["error"]}')
+        else:
+            print(f'Oops.. the operation failed: {result["error"]}')
+        return
+    item_ids = ([])
+    for write, write_result in result["writes"]:
+        if write_result is None:
+            continue
+        if write_result["error"] is None:
+            print(write["done"].format(id=write_result["id"]))
+            item_ids.append(write_result["id"])
+        else:
+            print(f'{write["failed"]}: {write_result["error"]}')
+    return item_ids
+
+
+def print_summary(summary, stream=None):
+    """
+    The function prints the number of requests of a plan
+    :param summary: the plan summary (see run_plans)
+    :param stream: the output stream (stdout by default)
+    :return: None
+    """
+    print(f'The plan has {summary["writes"]} writes, merged to {summary["merged_writes"]}: '
+          f'{summary["read_requests"]} read requests and {summary["write_requests"]} '
+          f'write requests ({summary["requests"]} HTTP requests)', file=stream)
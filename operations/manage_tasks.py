@@ -4,62 +4,44 @@ The module is in charge of performing the tfs requested operations
 
 import requests.exceptions
 from operations import get_objects
+from operations import manage_plans
+from operations import task_templates
 
+WORKITEM_TYPE_NAMES = {"Task": "Task", "Product Backlog Item": "PBI", "Feature": "Feature"}
 
-def copy_task(tfs_instance, original_task_data, target_pbi_data):
-    """
-    Function to copy a TFS task from one PBI to another PBI as a child
-    :param tfs_instance: the TFS connection
-    :param original_task_data: a TFS work item object of the task to copy
-    :param target_pbi_data: the target PBI data
-    :return: the new task ID
-    """
 
-    # Build the task fields
-    original_task = original_task_data.fields
-
-    # Only if type is "Task"
-    if original_task["System.WorkItemType"] == "Task":
-        target_task = ({})
-        try:
-            target_task["System.State"] = "To Do"
-            target_task["System.AreaId"] = target_pbi_data["System.AreaId"]
-            target_task["System.IterationId"] = target_pbi_data["System.IterationId"]
-            target_task["System.Title"] = original_task["System.Title"]
-            target_task["Microsoft.VSTS.Common.BacklogPriority"] = \
-                original_task["Microsoft.VSTS.Common.BacklogPriority"]
-            target_task["Microsoft.VSTS.Common.Activity"] = \
-                original_task["Microsoft.VSTS.Common.Activity"]
-            target_task["System.Description"] = original_task["System.Description"]
-        except:
-            pass
-
-        # Add a new task to the target PBI with the source task fields
-        try:
-            new_task = tfs_instance.add_workitem(target_task,
-                                                 target_pbi_data.id, workitem_type="Task")
-            print("Task " +
-                  str(new_task) +
-                  " was copied to PBI " +
-                  str(target_pbi_data.id) +
-                  " successfully")
-        except requests.exceptions.HTTPError as error:
-            print(f'Oops.. there was an HTTP error: {error}')
-            return
-
-
-def copy_pbi_to_cleanup(tfs_instance, user_credentials, title_type):
+def copy_pbi_to_cleanup(tfs_instance, user_credentials, title_type, original_pbi_id=None):
     """
     Function to duplicate a PBI in the same feature if available
     :param tfs_instance: the TFS connection
     :param user_credentials: the credentials
     :param title_type: which title should be
+    :param original_pbi_id: a given PBI to create the cleanup from
     :return: the new PBI ID
     """
 
     # Get the original PBI ID
-    print("Please enter the original PBI ID")
-    original_pbi_id = get_objects.get_item_id()
+    if original_pbi_id is None:
+        print("Please enter the original PBI ID")
+        original_pbi_id = get_objects.get_item_id()
+
+    # A Feature gets a single cleanup PBI, based on its latest PBI and depending on all of them
+    try:
+        original_data = tfs_instance.get_workitem(original_pbi_id)
+        related_ids = [original_pbi_id]
+        if original_data["System.WorkItemType"] == "Feature":
+            tree = get_objects.get_tree(tfs_instance, original_pbi_id,
+                                        fields=get_objects.PBI_TYPE_FIELDS)
+            related_ids = [int(pbi.id) for pbi in
+                           get_objects.get_tree_items(tree, "Product Backlog Item")]
+            if not related_ids:
+                print("The Feature doesn't have any PBI")
+                return
+            original_pbi_id = max(related_ids)
+            title_type = "CreateCleanupFromFeature"
+    except requests.exceptions.RequestException as error:
+        print('An HTTP error: {0}'.format(error))
+        return
 
     # Get the cleanup PBI tasks
     try:
@@ -69,6 +51,12 @@ def copy_pbi_to_cleanup(tfs_instance, user_credentials, title_type):
     except get_objects.WorkitemDoesntMatchIDError:
         print("Workitem ID doesn't match a PBI")
         return
+    except requests.exceptions.RequestException as error:
+        print('An HTTP error: {0}'.format(error))
+        return
+    if original_data["System.WorkItemType"] == "Feature":
+        cleanup_pbi["data"]["System.Description"] = "Cleanup PBI for Feature " + \
+                                                    str(original_data.id)
 
     # Add the cleanup PBI
     try:
@@ -76,8 +64,8 @@ def copy_pbi_to_cleanup(tfs_instance, user_credentials, title_type):
                                             parent_item_id=cleanup_pbi["parent_id"],
                                             workitem_type="PBI")
         print(f'PBI {str(new_pbi)} was created successfully')
-        new_pbi_data = tfs_instance.connection.get_workitem(new_pbi)
-    except requests.exceptions.HTTPError as error:
+        new_pbi_data = tfs_instance.get_workitem(new_pbi)
+    except requests.exceptions.RequestException as error:
         print("Oops.. there was an HTTP error: {0}".format(error))
         return
 
@@ -87,11 +75,12 @@ def copy_pbi_to_cleanup(tfs_instance, user_credentials, title_type):
                    '_apis/wit/workItems/'
     relations = ([])
     try:
-        relations.append({'rel': 'System.LinkTypes.Related',
-                          'url': relation_url + str(original_pbi_id)})
-        relations.append({'rel': 'System.LinkTypes.Dependency-Reverse',
-                          'url': relation_url + str(original_pbi_id)})
-        new_pbi_data.add_relations_raw(relations)
+        for related_id in related_ids:
+            relations.append({'rel': 'System.LinkTypes.Related',
+                              'url': relation_url + str(related_id)})
+            relations.append({'rel': 'System.LinkTypes.Dependency-Reverse',
+                              'url': relation_url + str(related_id)})
+        tfs_instance.add_relations(new_pbi_data.id, relations)
     except:
         pass
 
@@ -99,9 +88,10 @@ def copy_pbi_to_cleanup(tfs_instance, user_credentials, title_type):
     try:
         add_tasks_to_pbi(tfs_instance, user_credentials,
                          pbi_type="CleanupTasks", pbi_id=new_pbi)
-    except requests.exceptions.HTTPError as error:
+    except requests.exceptions.RequestException as error:
         print(f'Oops.. there was an HTTP error: {error}')
         return
+    return new_pbi
 
 
 def create_cleanup_pbi_to_feature(tfs_instance, user_credentials):
@@ -123,6 +113,9 @@ def create_cleanup_pbi_to_feature(tfs_instance, user_credentials):
     except get_objects.WorkitemDoesntMatchIDError:
         print("Workitem ID doesn't match a PBI")
         return
+    except requests.exceptions.RequestException as error:
+        print('An HTTP error: {0}'.format(error))
+        return
 
     # Add the cleanup PBI
     try:
@@ -130,8 +123,8 @@ def create_cleanup_pbi_to_feature(tfs_instance, user_credentials):
                                             parent_item_id=cleanup_pbi["parent_id"],
                                             workitem_type="PBI")
         print(f'PBI {str(new_pbi)} was created successfully')
-        new_pbi_data = tfs_instance.connection.get_workitem(new_pbi)
-    except requests.exceptions.HTTPError as error:
+        new_pbi_data = tfs_instance.get_workitem(new_pbi)
+    except requests.exceptions.RequestException as error:
         print(f'Oops.. there was an HTTP error: {error}')
         return
 
@@ -145,7 +138,7 @@ def create_cleanup_pbi_to_feature(tfs_instance, user_credentials):
                           'url': relation_url + str(original_pbi_id)})
         relations.append({'rel': 'System.LinkTypes.Dependency-Reverse',
                           'url': relation_url + str(original_pbi_id)})
-        new_pbi_data.add_relations_raw(relations)
+        tfs_instance.add_relations(new_pbi_data.id, relations)
     except:
         pass
 
@@ -153,144 +146,227 @@ def create_cleanup_pbi_to_feature(tfs_instance, user_credentials):
     try:
         add_tasks_to_pbi(tfs_instance, user_credentials,
                          pbi_type="CleanupTasks", pbi_id=new_pbi)
-    except requests.exceptions.HTTPError as error:
+    except requests.exceptions.RequestException as error:
         print(f'Oops.. there was an HTTP error: {error}')
         return
 
 
-def add_task_to_pbi(tfs_instance, task, pbi_data):
+def plan_add_tasks_to_pbi(user_credentials, pbi_id, pbi_type="regular"):
     """
-    Add a new task to a specific PBI (with correct area and iteration)
-    :param tfs_instance: the TFS connection
-    :param task: a task fields dictionary
-    :param pbi_data: a PBI object
-    :return: nothing
+    Plans the tasks of a PBI (or of every PBI of a Feature), based on a given type
+    :param user_credentials: the user credentials dictionary
+    :param pbi_id: the PBI (or Feature) to add the tasks to
+    :param pbi_type: the type of tasks to add
+    :return: a planner generator (see manage_plans), of a new task per template and PBI
     """
-    task['System.AreaId'] = pbi_data['System.AreaId']  # Area Path
-    task['System.IterationId'] = pbi_data['System.IterationId']  # Iteration Path
-    try:
-        new_task = tfs_instance.add_workitem(task,
-                                             pbi_data.id,
-                                             workitem_type="Task")  # Add a new task
-    except requests.exceptions.HTTPError as error:
-        print(f'Oops.. there was an HTTP error: {error}')
-        return
-    print(f'Task {str(new_task)} was added successfully')
+
+    # Get the PBI data
+    pbi_data, = yield manage_plans.read([pbi_id], fields=get_objects.PBI_TYPE_FIELDS)
+
+    # A Feature gets the tasks in all of its PBIs
+    pbis = [pbi_data]
+    if pbi_data['System.WorkItemType'] == "Feature":
+        tree = yield manage_plans.read_tree(pbi_id, fields=get_objects.PBI_TYPE_FIELDS)
+        pbis = get_objects.get_tree_items(tree, "Product Backlog Item")
+
+    # Get tasks to add, from the compiled templates
+    templates = task_templates.REGISTRY.get_templates(pbi_type)
+    return [manage_plans.create("Task", pbi.id, template.get_patch(pbi, user_credentials['name']),
+                                done="Task {id} was added successfully",
+                                failed=f'Oops.. task "{template.title}" was not added')
+            for pbi in pbis for template in templates]
 
 
 def add_tasks_to_pbi(tfs_instance, user_credentials, pbi_id=None, pbi_type="regular"):
     """
-    Add all of the required tasks to a PBI, based on a given type
+    Add all of the required tasks to a PBI (or to every PBI of a Feature), based on a given type
     :param tfs_instance: the TFS connection
     :param user_credentials: the user credentials dictionary
-    :param pbi_id: a given PBI to add the tasks to
+    :param pbi_id: a given PBI (or Feature) to add the tasks to
     :param pbi_type: the type of tasks to add
-    :return: nothing
+    :return: a list of the new tasks IDs
     """
 
     # Ask for PBI ID
     if pbi_id is None:
         pbi_id = get_objects.get_item_id()
 
-    # Get the PBI data
-    try:
-        pbi_data = tfs_instance.connection.get_workitem(pbi_id)
-    except requests.exceptions.HTTPError as error:
-        print(f'An HTTP error: {error}')
-        return
-    except:
-        return
-
-    # Get tasks to add
-    tasks = get_objects.get_tasks(user_credentials, pbi_type=pbi_type)
+    # Add all tasks in a single batch
+    results, _ = manage_plans.run_plans([plan_add_tasks_to_pbi(user_credentials, pbi_id,
+                                                               pbi_type)], tfs_instance)
+    return manage_plans.report(results[0])
 
-    # Add tasks
-    for task in tasks:
-        add_task_to_pbi(tfs_instance, task, pbi_data)
 
+def plan_clone_pbi_tasks(source_pbi_id, target_pbi_ids):
+    """
+    Plans copies of a specific PBI tasks in other PBIs
+    :param source_pbi_id: the PBI to copy the tasks from
+    :param target_pbi_ids: a list of PBIs to copy the tasks to
+    :return: a planner generator (see manage_plans), of a new task per source task and target
+    """
 
-def clone_pbi_tasks(tfs_instance):
+    # Get the source and all of the targets at once, and then the source tasks
+    (source_pbi_data,), targets = yield [
+        manage_plans.read([source_pbi_id], expand="relations"),
+        manage_plans.read(target_pbi_ids, fields=get_objects.PBI_LOCATION_FIELDS,
+                          skip_missing=True)]
+
+    # A target that can't be read (e.g. a deleted PBI) is skipped, the others still get the copies
+    errors = [error for error in targets if isinstance(error, Exception)]
+    if len(errors) == len(targets):
+        raise errors[0]
+    for target_pbi_id, error in zip(target_pbi_ids, targets):
+        if isinstance(error, Exception):
+            print(f'Oops.. the tasks were not copied to PBI {target_pbi_id}: {error}')
+    targets = [target for target in targets if not isinstance(target, Exception)]
+    tasks = yield manage_plans.read(source_pbi_data.child_ids,
+                                    fields=get_objects.TASK_COPY_FIELDS)
+
+    # Copy all of the tasks to all of the targets
+    copies = ([])
+    for target_pbi_data in targets:
+        for task in tasks:
+            target_task = get_objects.get_task_copy(task, target_pbi_data)
+            if target_task is not None:
+                copies.append(manage_plans.create(
+                    "Task", target_pbi_data.id,
+                    [dict(op="add", path='/fields/{}'.format(name), value=value)
+                     for name, value in target_task.items()],
+                    done=f'Task {{id}} was copied to PBI {target_pbi_data.id} successfully',
+                    failed=f'Oops.. task "{target_task.get("System.Title")}" was not copied '
+                           f'to PBI {target_pbi_data.id}'))
+    return copies
+
+
+def clone_pbi_tasks(tfs_instance, source_pbi_id=None, target_pbi_id=None):
     """
     Copies a specific PBI tasks to another PBI
     :param tfs_instance: the TFS connection
-    :return: nothing
+    :param source_pbi_id: a given PBI to copy the tasks from
+    :param target_pbi_id: a given PBI to copy the tasks to
+    :return: a list of the new tasks IDs
     """
 
     # Ask for the first PBI ID
-    print("You need to specify the source PBI ID")
-    source_pbi_id = get_objects.get_item_id()
-
-    # Get the first PBI data
-    try:
-        source_pbi_data = tfs_instance.connection.get_workitem(source_pbi_id)
-    except requests.exceptions.HTTPError as error:
-        print(f'An HTTP error: {error}')
-        return
-    except:
-        return
+    if source_pbi_id is None:
+        print("You need to specify the source PBI ID")
+        source_pbi_id = get_objects.get_item_id()
 
     # Ask for the second PBI ID
-    print("You need to specify the target PBI ID")
-    target_pbi_id = get_objects.get_item_id()
-
-    # Get the second PBI data
-    try:
-        target_pbi_data = tfs_instance.connection.get_workitem(target_pbi_id)
-    except requests.exceptions.HTTPError as error:
-        print('An HTTP error: {0}'.format(error))
-        return
-    except:
-        return
+    if target_pbi_id is None:
+        print("You need to specify the target PBI ID")
+        target_pbi_id = get_objects.get_item_id()
 
     # Copy tasks
-    for task_id in source_pbi_data.child_ids:
-        task = tfs_instance.connection.get_workitem(task_id)
-        copy_task(tfs_instance, task, target_pbi_data)
+    results, _ = manage_plans.run_plans([plan_clone_pbi_tasks(source_pbi_id, [target_pbi_id])],
+                                        tfs_instance)
+    return manage_plans.report(results[0])
+
+
+def clone_pbi_tasks_to_many(tfs_instance, source_pbi_id=None, target_pbi_ids=None):
+    """
+    Copies a specific PBI tasks to many PBIs.
+    The source tasks and the targets are read once, and all of the copies are created in batches.
+    :param tfs_instance: the TFS connection
+    :param source_pbi_id: a given PBI to copy the tasks from
+    :param target_pbi_ids: a list of PBIs to copy the tasks to
+    :return: a list of the new tasks IDs
+    """
+
+    # Ask for the source PBI ID
+    if source_pbi_id is None:
+        print("You need to specify the source PBI ID")
+        source_pbi_id = get_objects.get_item_id()
 
+    # Ask for the target PBIs IDs
+    if target_pbi_ids is None:
+        print("You need to specify the target PBIs IDs")
+        target_pbi_ids = get_objects.get_item_ids()
 
-def remove_pbi_with_tasks(tfs_instance, user_credentials):
+    # Copy all of the tasks to all of the targets
+    results, _ = manage_plans.run_plans([plan_clone_pbi_tasks(source_pbi_id, target_pbi_ids)],
+                                        tfs_instance)
+    return manage_plans.report(results[0])
+
+
+def remove_pbi_with_tasks(tfs_instance, user_credentials, pbi_id=None):
     """
     The function will get a PBI number and remove it and its tasks.
+    Given a Feature number, the Feature and all of its PBIs and tasks are removed.
     Remove is changing the state, area, and iteration.
     :param tfs_instance: the TFS connection
     :param user_credentials: the user credentials
-    :return: nothing
+    :param pbi_id: a given PBI to remove
+    :return: a list of the removed work items IDs (None if some of them were not removed)
     """
 
     # Ask for the PBI ID
-    pbi_id = get_objects.get_item_id()
+    if pbi_id is None:
+        pbi_id = get_objects.get_item_id()
 
-    # Get the PBI data
+    # Get the PBI (or Feature) and everything under it
     try:
-        pbi_data = tfs_instance.connection.get_workitem(pbi_id)
-    except requests.exceptions.HTTPError as error:
+        tree = get_objects.get_tree(tfs_instance, pbi_id)
+    except requests.exceptions.RequestException as error:
         print('An HTTP error: {0}'.format(error))
         return
     except:
         return
 
-    # Remove tasks
-    for task_id in pbi_data.child_ids:
-        try:
-            remove_task(tfs_instance, user_credentials, task_id)
-        except requests.exceptions.HTTPError as error:
-            print('An HTTP error: {0}'.format(error))
-            return
-        except:
-            print('Oops.. Something went wrong. Please try again')
-            return
-
-    # Remove the PBI
-    update_data = get_objects.get_removed_task_data(user_credentials)
+    # The removed items area and iteration must exist, before any item is removed
+    classification_index = get_objects.get_classification_index(tfs_instance)
     try:
-        tfs_instance.connection.update_workitem(pbi_id, update_data)
-        print(f'PBI {pbi_id} was removed successfully')
-    except requests.exceptions.HTTPError as error:
-        print('An HTTP error: {0}'.format(error))
+        get_objects.get_removed_task_data(user_credentials,
+                                          classification_index=classification_index)
+    except get_objects.RemovedNodeDoesntExistError as error:
+        print(f'Oops.. {error}')
         return
-    except:
-        print('Oops.. Something went wrong. Please try again')
+
+    # Remove from the bottom level up, a single batch per level and a single update per item.
+    # Tasks drop all of their relations, and an item is removed only if everything under it was.
+    # A failure skips only the items above it, the rest of the tree is still removed
+    removed_ids = ([])
+    failed_ids = set()
+    for level in reversed(get_objects.get_tree_levels(tree)):
+        updates = ([])
+        for item in level:
+            if failed_ids.intersection(tree["children"][int(item.id)]):
+                print(f'{WORKITEM_TYPE_NAMES.get(item["System.WorkItemType"], "Item")} '
+                      f'{item.id} was not removed, since some of the items under it were not')
+                failed_ids.add(int(item.id))
+            elif item["System.WorkItemType"] == "Task":
+                updates.append(get_objects.get_removed_item_update(
+                    user_credentials, item, classification_index=classification_index))
+            else:
+                updates.append((int(item.id), get_objects.get_removed_task_data(
+                    user_credentials, classification_index=classification_index)))
+        items = [tree["items"][item_id] for item_id, _ in updates]
+        for item, result in zip(items, tfs_instance.update_workitems(updates)):
+            if result['error'] is None:
+                print(f'{WORKITEM_TYPE_NAMES.get(item["System.WorkItemType"], "Item")} '
+                      f'{item.id} was removed successfully')
+                removed_ids.append(int(item.id))
+            else:
+                print('An HTTP error: {0}'.format(result['error']))
+                failed_ids.add(int(item.id))
+    if failed_ids:
         return
+    return removed_ids
+
+
+def plan_remove_task(user_credentials, task_id, classification_index=None):
+    """
+    Plans the removal of a Task: a single read and a single update, that drops all of its relations
+    :param user_credentials: the user credentials
+    :param task_id: the ID of the task to be removed
+    :param classification_index: an optional ClassificationIndex (see get_removed_task_data)
+    :return: a planner generator (see manage_plans), of the task update
+    """
+    task_data, = yield manage_plans.read([task_id], expand="relations")
+    item_id, update_data = get_objects.get_removed_item_update(
+        user_credentials, task_data, classification_index=classification_index)
+    return [manage_plans.update(item_id, update_data, done="Task {id} was removed successfully",
+                                failed=f'Oops.. task {task_id} was not removed')]
 
 
 def remove_task(tfs_instance, user_credentials, task_id):
@@ -300,36 +376,33 @@ def remove_task(tfs_instance, user_credentials, task_id):
     :param tfs_instance: the TFS connection
     :param user_credentials: the user credentials
     :param task_id: the ID of the task to be removed
-    :return: nothing
+    :return: the removed task ID
     """
-    task_data = tfs_instance.connection.get_workitem(task_id)
-    relations = task_data.data.get('relations')
-    for _ in range(len(relations)):
-        update_data = get_objects.get_removed_task_data(user_credentials, rel_count=1)
-        try:
-            tfs_instance.connection.update_workitem(work_item_id=task_id, update_data=update_data)
-            print(f'Task {task_id} was removed successfully')
-        except requests.exceptions.HTTPError as error:
-            print('An HTTP error: {0}'.format(error))
-            return
-        except:
-            print('Oops.. Something went wrong. Please try again')
-
-
-def remove_task_from_pbi(tfs_instance, user_credentials):
+    results, _ = manage_plans.run_plans(
+        [plan_remove_task(user_credentials, task_id,
+                          classification_index=get_objects.get_classification_index(tfs_instance))],
+        tfs_instance)
+    if not manage_plans.report(results[0]):
+        return
+    return task_id
+
+
+def remove_task_from_pbi(tfs_instance, user_credentials, task_id=None):
     """
     The function will ask for a Task number from the user, and remove it.
     :param tfs_instance: the TFS connection
     :param user_credentials: the user credentials
-    :return: nothing
+    :param task_id: a given task to remove
+    :return: the removed task ID
     """
     # Ask for the task ID
-    task_id = get_objects.get_item_id()
+    if task_id is None:
+        task_id = get_objects.get_item_id()
 
     # Remove the task
     try:
-        remove_task(tfs_instance, user_credentials, task_id)
-    except requests.exceptions.HTTPError as error:
+        return remove_task(tfs_instance, user_credentials, task_id)
+    except requests.exceptions.RequestException as error:
         print(f'An HTTP error: {error}')
         return
     except:
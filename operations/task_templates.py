@@ -0,0 +1,106 @@
+"""
+The module is responsible for the task templates.
+The templates are loaded from task_templates.json and compiled once into JSON-patch bodies,
+so only the per-PBI fields (area, iteration and the assigned user) are added when a task is sent.
+The file is loaded again when it changes on disk.
+"""
+
+import json
+import os
+import threading
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_templates.json")
+
+# A template field value that is replaced by the user name when the task is sent
+USER_NAME_PLACEHOLDER = "{user_name}"
+
+
+class TaskTemplate:
+    """
+    A compiled task template: the fixed JSON-patch operations of the task fields
+    """
+    __slots__ = ("name", "title", "operations", "user_fields")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.title = fields.get("System.Title", name)
+        self.operations = tuple(dict(op="add", path="/fields/{}".format(field_name), value=value)
+                                for field_name, value in fields.items()
+                                if value != USER_NAME_PLACEHOLDER)
+        self.user_fields = tuple(field_name for field_name, value in fields.items()
+                                 if value == USER_NAME_PLACEHOLDER)
+
+    def get_patch(self, pbi_data, user_name):
+        """
+        Builds the JSON-patch body of a new task under a PBI.
+        The compiled operations are shared between the bodies, and must not be changed.
+        :param pbi_data: the parent PBI work item (for its area and iteration)
+        :param user_name: the user name, for the fields assigned to the user
+        :return: a list of JSON-patch operations
+        """
+        patch = list(self.operations)
+        patch.extend(dict(op="add", path="/fields/{}".format(field_name), value=user_name)
+                     for field_name in self.user_fields)
+        patch.append(dict(op="add", path="/fields/System.AreaId",  # Area Path
+                          value=pbi_data["System.AreaId"]))
+        patch.append(dict(op="add", path="/fields/System.IterationId",  # Iteration Path
+                          value=pbi_data["System.IterationId"]))
+        return patch
+
+
+class TemplateRegistry:
+    """
+    The task templates of every PBI type, compiled from a templates file
+    """
+    def __init__(self, path=TEMPLATES_PATH):
+        self.path = path
+        self._templates = {}
+        self._modified = None
+        self._lock = threading.Lock()
+
+    def get_templates(self, pbi_type):
+        """
+        Get the task templates of a PBI type (the file is loaded again if it was changed)
+        :param pbi_type: a string representing the type of tasks, e.g. "RegularTasks"
+        :return: a tuple of TaskTemplate objects (empty for an unknown type)
+        """
+        self.reload()
+        return self._templates.get(pbi_type, ())
+
+    def reload(self):
+        """
+        Loads and compiles the templates file, if it was changed since it was last loaded.
+        If the new file is not valid, the previous templates are kept.
+        :return: None
+        """
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except OSError as error:
+            print("Can't read the task templates: {0}".format(error))
+            return
+        if modified == self._modified:
+            return
+
+        with self._lock:
+            if modified == self._modified:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as file:
+                    self._templates = self.compile(json.load(file))
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                print("Invalid task templates file {0}: {1}".format(self.path, error))
+            self._modified = modified
+
+    @staticmethod
+    def compile(data):
+        """
+        Compiles the templates file content
+        :param data: a dictionary with the "tasks" fields by name, and the task names of the "types"
+        :return: a dictionary of the TaskTemplate tuples by PBI type
+        """
+        tasks = {name: TaskTemplate(name, fields) for name, fields in data["tasks"].items()}
+        return {pbi_type: tuple(tasks[name] for name in names)
+                for pbi_type, names in data["types"].items()}
+
+
+REGISTRY = TemplateRegistry()
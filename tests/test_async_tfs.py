@@ -0,0 +1,122 @@
+import asyncio
+import unittest
+import tfs_simulator
+from operations import manage_tasks
+from tfs_connect import async_tfs
+from tfs_connect import tfs
+
+LATENCY = 0.01
+
+
+class TestAsyncTFSConnection(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator(latency=LATENCY)
+        self.tfs_connection = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                                transport=self.simulator.adapter)
+        # The server limits of the rate limiter are not what these tests measure
+        self.tfs_connection.limiter.rate = self.tfs_connection.limiter.max_rate = 1000
+        self.async_connection = async_tfs.AsyncTFSConnection(self.tfs_connection,
+                                                             max_concurrency=8)
+        self.pbi_ids = [self.simulator.add_workitem("Product Backlog Item",
+                                                    {'System.Title': 'PBI {0}'.format(number)})
+                        for number in range(3)]
+        self.task_ids = [self.simulator.add_workitem("Task", {'System.Title': 'Task'},
+                                                     parent_id=self.pbi_ids[0])
+                         for _ in range(2)]
+
+    def tearDown(self):
+        self.async_connection.close()
+
+    def test_reads_fan_out_up_to_the_limit(self):
+        """
+        Tests hundreds of concurrent reads are in flight together, up to the concurrency limit,
+        and every read gets its own item
+        :return:
+        """
+
+        # arrange
+        item_ids = [self.simulator.add_workitem("Task") for _ in range(200)]
+        self.simulator.reset_stats()
+
+        async def read_all():
+            return await asyncio.gather(*[self.async_connection.get_workitem(item_id)
+                                          for item_id in item_ids])
+
+        # action
+        workitems = asyncio.run(read_all())
+
+        # assertion
+        self.assertEqual([int(workitem.id) for workitem in workitems], item_ids)
+        self.assertEqual(self.simulator.request_count, len(item_ids))
+        self.assertGreater(self.simulator.peak_in_flight, 1)
+        self.assertLessEqual(self.simulator.peak_in_flight, 8)
+
+    def test_writes_are_sent_in_concurrent_batches(self):
+        """
+        Tests the creations and the updates are sent in $batch chunks, concurrently,
+        and their results keep the given order
+        :return:
+        """
+
+        # arrange
+        creates = [("Task", self.pbi_ids[1], [dict(op="add", path="/fields/System.Title",
+                                                   value="Task {0}".format(number))])
+                   for number in range(tfs.BATCH_LIMIT + 50)]
+        updates = [(task_id, [dict(op="add", path="/fields/System.Title", value="Renamed")])
+                   for task_id in self.task_ids]
+        self.simulator.reset_stats()
+
+        # action
+        create_results, update_results = asyncio.run(
+            self.async_connection.apply_writes(creates, updates))
+
+        # assertion
+        self.assertEqual(self.simulator.request_count, 2)
+        self.assertGreater(self.simulator.peak_in_flight, 1)
+        self.assertEqual([self.simulator.workitems[result['id']]['fields']['System.Title']
+                          for result in create_results],
+                         ["Task {0}".format(number) for number in range(len(creates))])
+        self.assertEqual([result['id'] for result in update_results], self.task_ids)
+        self.assertEqual(self.simulator.workitems[self.task_ids[0]]['fields']['System.Title'],
+                         "Renamed")
+
+    def test_operations_run_on_the_facade(self):
+        """
+        Tests the task operations run on the engine through the blocking facade,
+        and the rest of the connection is passed through
+        :return:
+        """
+
+        # arrange
+        facade = async_tfs.SyncTFSConnection(self.async_connection)
+
+        # action
+        new_task_ids = manage_tasks.clone_pbi_tasks_to_many(facade, self.pbi_ids[0],
+                                                            self.pbi_ids[1:])
+        facade.close()
+
+        # assertion
+        self.assertEqual(len(new_task_ids), len(self.task_ids) * 2)
+        self.assertEqual(facade.resume(), [])
+        self.assertIs(facade.cache, self.tfs_connection.cache)
+
+    def test_facade_is_kept_per_connection(self):
+        """
+        Tests a connection gets the same facade every time, until the facades are closed
+        :return:
+        """
+
+        # action
+        facade = async_tfs.get_sync_connection(self.tfs_connection)
+        same_facade = async_tfs.get_sync_connection(self.tfs_connection)
+        async_tfs.close_sync_connections()
+        new_facade = async_tfs.get_sync_connection(self.tfs_connection)
+        async_tfs.close_sync_connections()
+
+        # assertion
+        self.assertIs(facade, same_facade)
+        self.assertIsNot(facade, new_facade)
+
+
+if __name__ == '__main__':
+    unittest.main()
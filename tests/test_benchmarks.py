@@ -0,0 +1,172 @@
+import time
+import unittest
+import tfs_simulator
+from operations import manage_tasks
+from tfs_connect import async_tfs
+from tfs_connect import tfs
+
+LATENCY = 0.01
+
+
+class OperationBenchmark(unittest.TestCase):
+    """
+    Measures the wall time and the number of requests of the task operations,
+    against a simulated server, so a regression in round-trips fails the tests
+    """
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator(latency=LATENCY, seed=1)
+        # The operations run on the asyncio engine, as the program runs them
+        self.tfs_instance = async_tfs.SyncTFSConnection(async_tfs.AsyncTFSConnection(
+            tfs.TFSConnection(tfs_simulator.CREDENTIALS, transport=self.simulator.adapter)))
+        self.feature_id = self.simulator.add_workitem(
+            "Feature", {'System.Title': 'Feature'})
+        self.pbi_id = self.simulator.add_workitem(
+            "Product Backlog Item", {'System.Title': 'PBI',
+                                     'System.IterationPath': r'theLotter\Sprint 1\Current'},
+            parent_id=self.feature_id)
+        self.task_ids = [self.simulator.add_workitem(
+            "Task", {'System.Title': 'Task {0}'.format(number),
+                     'Microsoft.VSTS.Common.BacklogPriority': '10',
+                     'Microsoft.VSTS.Common.Activity': 'Development',
+                     'System.Description': ''}, parent_id=self.pbi_id) for number in range(5)]
+
+        # The areas and iterations are read once per connection (see get_classification)
+        self.tfs_instance.get_classification()
+
+    def tearDown(self):
+        self.tfs_instance.close()
+
+    def measure(self, operation, *args, **kwargs):
+        """
+        Runs an operation and reports its wall time and number of requests
+        :return: the operation result
+        """
+        self.simulator.reset_stats()
+        start = time.perf_counter()
+        result = operation(*args, **kwargs)
+        wall_time = time.perf_counter() - start
+        print('{0}: {1} requests, {2:.3f}s'.format(self.id().split('.')[-1],
+                                                    self.simulator.request_count, wall_time))
+        return result
+
+    def test_add_tasks_to_pbi(self):
+        """
+        The PBI is read once and all of its tasks are created in a single batch
+        """
+        new_tasks = self.measure(manage_tasks.add_tasks_to_pbi, self.tfs_instance,
+                                 tfs_simulator.CREDENTIALS, pbi_id=self.pbi_id,
+                                 pbi_type="RegularTasks")
+
+        self.assertEqual(len(new_tasks), 6)
+        self.assertEqual(self.simulator.request_count, 2)
+
+    def test_clone_pbi_tasks(self):
+        """
+        The source, the target and the source tasks are read once, and the copies are
+        created in a single batch, instead of a request per task
+        """
+        target_pbi_id = self.simulator.add_workitem("Product Backlog Item")
+
+        new_tasks = self.measure(manage_tasks.clone_pbi_tasks, self.tfs_instance,
+                                 source_pbi_id=self.pbi_id, target_pbi_id=target_pbi_id)
+
+        self.assertEqual(len(new_tasks), 5)
+        self.assertEqual(self.simulator.request_count, 4)
+
+    def test_clone_pbi_tasks_to_many(self):
+        """
+        The source and the targets are read once, and all of the copies are created in a batch
+        """
+        target_pbi_ids = [self.simulator.add_workitem("Product Backlog Item")
+                          for _ in range(20)]
+
+        new_tasks = self.measure(manage_tasks.clone_pbi_tasks_to_many, self.tfs_instance,
+                                 source_pbi_id=self.pbi_id, target_pbi_ids=target_pbi_ids)
+
+        self.assertEqual(len(new_tasks), len(self.task_ids) * len(target_pbi_ids))
+        for target_pbi_id in target_pbi_ids:
+            self.assertEqual(len(self.simulator.workitems[target_pbi_id]['relations']),
+                             len(self.task_ids))
+        self.assertLessEqual(self.simulator.request_count, 4)
+
+    def test_copy_pbi_to_cleanup(self):
+        """
+        The new cleanup PBI is not read again after it was created
+        """
+        new_pbi = self.measure(manage_tasks.copy_pbi_to_cleanup, self.tfs_instance,
+                               tfs_simulator.CREDENTIALS, title_type="CreateCleanupFromFeature",
+                               original_pbi_id=self.pbi_id)
+
+        self.assertEqual(self.simulator.workitems[new_pbi]['fields']['System.Title'],
+                         'Feature: Cleanup')
+        self.assertLessEqual(self.simulator.request_count, 5)
+
+    def test_copy_feature_to_cleanup(self):
+        """
+        The Feature hierarchy is read with only the fields of the item types, not in full
+        """
+        new_pbi = self.measure(manage_tasks.copy_pbi_to_cleanup, self.tfs_instance,
+                               tfs_simulator.CREDENTIALS, title_type="CreateCleanupFromFeature",
+                               original_pbi_id=self.feature_id)
+
+        self.assertIsNotNone(new_pbi)
+        self.assertIsNone(self.tfs_instance.cache.peek(self.task_ids[0]))
+        self.assertLessEqual(self.simulator.request_count, 7)
+
+    def test_remove_pbi_with_tasks(self):
+        """
+        All of the tasks are removed in a single batch, with a single update per task
+        """
+        removed = self.measure(manage_tasks.remove_pbi_with_tasks, self.tfs_instance,
+                               tfs_simulator.CREDENTIALS, pbi_id=self.pbi_id)
+
+        self.assertEqual(len(removed), len(self.task_ids) + 1)
+        for task_id in self.task_ids:
+            self.assertEqual(self.simulator.workitems[task_id]['fields']['System.State'],
+                             'Removed')
+            self.assertEqual(self.simulator.workitems[task_id]['relations'], [])
+        self.assertLessEqual(self.simulator.request_count, 4)
+
+    def test_remove_feature_tree(self):
+        """
+        The whole Feature tree is fetched by a single link query, and removed a level at a time
+        """
+        removed = self.measure(manage_tasks.remove_pbi_with_tasks, self.tfs_instance,
+                               tfs_simulator.CREDENTIALS, pbi_id=self.feature_id)
+
+        self.assertEqual(len(removed), len(self.task_ids) + 2)
+        for item_id in [self.feature_id, self.pbi_id] + self.task_ids:
+            self.assertEqual(self.simulator.workitems[item_id]['fields']['System.State'],
+                             'Removed')
+        self.assertLessEqual(self.simulator.request_count, 5)
+
+    def test_bulk_read_chunks_are_concurrent(self):
+        """
+        The bulk read chunks of a large read are sent concurrently, not one after the other
+        """
+        item_ids = [self.simulator.add_workitem("Task") for _ in range(tfs.BULK_READ_LIMIT * 2 + 1)]
+
+        workitems = self.measure(self.tfs_instance.get_workitems, item_ids,
+                                 fields=['System.Title'])
+
+        self.assertEqual([int(workitem.id) for workitem in workitems], item_ids)
+        self.assertEqual(self.simulator.request_count, 3)
+        self.assertGreater(self.simulator.peak_in_flight, 1)
+
+    def test_add_tasks_to_feature(self):
+        """
+        The tasks of every PBI of the Feature are created in a single batch
+        """
+        self.simulator.add_workitem("Product Backlog Item", {'System.Title': 'Second PBI'},
+                                    parent_id=self.feature_id)
+
+        new_tasks = self.measure(manage_tasks.add_tasks_to_pbi, self.tfs_instance,
+                                 tfs_simulator.CREDENTIALS, pbi_id=self.feature_id,
+                                 pbi_type="RegularTasks")
+
+        self.assertEqual(len(new_tasks), 12)
+        self.assertLessEqual(self.simulator.request_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import time
+import unittest
+from tfs_connect import cache
+
+
+class Workitem:
+    """
+    A work item with the attributes the cache uses
+    """
+    def __init__(self, item_id, rev):
+        self.id = item_id  # pylint: disable=invalid-name
+        self.data = {'id': item_id, 'rev': rev}
+
+
+class TestWorkitemCache(unittest.TestCase):
+    def test_least_recently_used_item_is_evicted(self):
+        """
+        Tests a full cache evicts the item that was used last, and keeps a recently read one
+        :return:
+        """
+
+        # arrange
+        workitem_cache = cache.WorkitemCache(max_size=2)
+        workitem_cache.put(Workitem(1, 1))
+        workitem_cache.put(Workitem(2, 1))
+        workitem_cache.get(1)
+
+        # action
+        workitem_cache.put(Workitem(3, 1))
+
+        # assertion
+        self.assertIsNotNone(workitem_cache.peek(1))
+        self.assertIsNone(workitem_cache.peek(2))
+        self.assertIsNotNone(workitem_cache.peek(3))
+        self.assertEqual(workitem_cache.stats()['size'], 2)
+
+    def test_items_expire_after_the_ttl(self):
+        """
+        Tests an item is not served after the TTL, and is removed from the cache
+        :return:
+        """
+
+        # arrange
+        workitem_cache = cache.WorkitemCache(ttl=0.05)
+        workitem_cache.put(Workitem(1, 1))
+        self.assertIsNotNone(workitem_cache.get(1))
+
+        # action
+        time.sleep(0.1)
+
+        # assertion
+        self.assertIsNone(workitem_cache.get(1))
+        self.assertEqual(workitem_cache.stats()['size'], 0)
+
+    def test_older_rev_doesnt_replace_a_newer_one(self):
+        """
+        Tests an item is replaced by a newer revision, but not by an older one
+        :return:
+        """
+
+        # arrange
+        workitem_cache = cache.WorkitemCache()
+        older, newer = Workitem(1, 1), Workitem(1, 2)
+
+        # action
+        workitem_cache.put(older)
+        workitem_cache.put(newer)
+        workitem_cache.put(older)
+
+        # assertion
+        self.assertIs(workitem_cache.get(1), newer)
+
+    def test_projection_serves_only_its_fields(self):
+        """
+        Tests an item read with some fields serves the reads of those fields only,
+        and doesn't replace the full item of the same revision
+        :return:
+        """
+
+        # arrange
+        workitem_cache = cache.WorkitemCache()
+        workitem_cache.put(Workitem(1, 1), fields=['System.Title', 'System.State'])
+        full = Workitem(2, 1)
+        workitem_cache.put(full)
+
+        # action
+        workitem_cache.put(Workitem(2, 1), fields=['System.Title'])
+
+        # assertion
+        self.assertIsNotNone(workitem_cache.get(1, fields=['system.title']))
+        self.assertIsNone(workitem_cache.get(1, fields=['System.Title', 'System.Tags']))
+        self.assertIsNone(workitem_cache.get(1))
+        self.assertIs(workitem_cache.get(2, fields=['System.Title']), full)
+
+    def test_hits_and_misses_are_counted(self):
+        """
+        Tests the counters of the reads served from the cache and of the reads it can't serve
+        :return:
+        """
+
+        # arrange
+        workitem_cache = cache.WorkitemCache()
+        workitem_cache.put(Workitem(1, 1))
+
+        # action
+        workitem_cache.get(1)
+        workitem_cache.get(1)
+        workitem_cache.get(2)
+        workitem_cache.peek(1)
+
+        # assertion
+        self.assertEqual(workitem_cache.stats(), {'hits': 2, 'misses': 1, 'size': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import requests
+import tfs_simulator
+from operations import get_objects
+from operations import manage_tasks
+from tfs_connect import classification
+from tfs_connect import tfs
+
+
+class TestClassificationIndex(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.simulator.add_classification_node("iteration", "Release 1",
+                                               "2020-01-06T00:00:00Z", "2020-02-28T00:00:00Z")
+        self.simulator.add_classification_node("iteration", r"Release 1\Sprint 2",
+                                               "2020-01-20T00:00:00Z", "2020-01-31T00:00:00Z")
+        self.simulator.add_classification_node("iteration", r"Release 1\Sprint 1",
+                                               "2020-01-06T00:00:00Z", "2020-01-17T00:00:00Z")
+        self.simulator.add_classification_node("iteration", r"Release 1\Sprint 1\Current")
+        self.area_id = self.simulator.add_classification_node("area", "Optimizers")
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item")
+        self.task_id = self.simulator.add_workitem("Task", parent_id=self.pbi_id)
+
+    def test_index_is_read_once(self):
+        """
+        Tests the nodes are found by ID and by path, and the trees are read once per TTL
+        :return:
+        """
+
+        # action
+        index = self.tfs_instance.get_classification()
+        self.tfs_instance.get_classification()
+
+        # assertion
+        self.assertEqual(index.get_node(self.area_id)['path'], r'theLotter\Optimizers')
+        self.assertEqual(index.get_node_by_path(r'THELOTTER\optimizers',
+                                                classification.AREA)['id'], self.area_id)
+        self.assertIsNone(index.get_node_by_path(r'theLotter\Release 1', classification.AREA))
+        self.assertEqual(self.simulator.request_count, 1)
+
+    def test_next_iteration_by_date(self):
+        """
+        Tests the next iteration is the next one at the same level, by the iteration dates
+        :return:
+        """
+
+        # action
+        index = self.tfs_instance.get_classification()
+
+        # assertion
+        self.assertEqual(index.get_next_iteration(r'theLotter\Release 1\Sprint 1\Current')['path'],
+                         r'theLotter\Release 1\Sprint 2')
+        self.assertIsNone(index.get_next_iteration(r'theLotter\Release 1\Sprint 2'))
+        self.assertIsNone(index.get_next_iteration(r'theLotter\Unknown'))
+
+    def test_cleanup_pbi_gets_the_next_sprint(self):
+        """
+        Tests a cleanup PBI is planned to the sprint after the original PBI sprint
+        :return:
+        """
+
+        # arrange
+        pbi_id = self.simulator.add_workitem(
+            "Product Backlog Item", {'System.Title': 'PBI',
+                                    'System.IterationPath': r'theLotter\Release 1\Sprint 1'})
+
+        # action
+        cleanup_pbi = get_objects.get_cleanup_pbi(self.tfs_instance, pbi_id, "CreateCleanupFromPBI")
+
+        # assertion
+        self.assertEqual(cleanup_pbi["data"]["System.IterationPath"],
+                         r'theLotter\Release 1\Sprint 2')
+
+    def test_removed_items_area_must_exist(self):
+        """
+        Tests nothing is removed if the Optimizers iteration doesn't exist
+        :return:
+        """
+
+        # arrange
+        self.simulator.classification_nodes['iteration']['children'] = []
+
+        # action
+        removed = manage_tasks.remove_pbi_with_tasks(self.tfs_instance, tfs_simulator.CREDENTIALS,
+                                                     pbi_id=self.pbi_id)
+
+        # assertion
+        self.assertIsNone(removed)
+        self.assertEqual(self.simulator.workitems[self.task_id]['fields']['System.State'], 'New')
+        with self.assertRaises(get_objects.RemovedNodeDoesntExistError):
+            get_objects.get_removed_task_data(
+                tfs_simulator.CREDENTIALS,
+                classification_index=self.tfs_instance.get_classification())
+
+    def test_removal_without_the_index(self):
+        """
+        Tests the items are still removed if the areas and iterations can't be read
+        :return:
+        """
+
+        # arrange
+        def get_classification():
+            raise requests.exceptions.HTTPError("403 Client Error: Forbidden")
+        self.tfs_instance.get_classification = get_classification
+
+        # action
+        removed = manage_tasks.remove_pbi_with_tasks(self.tfs_instance, tfs_simulator.CREDENTIALS,
+                                                     pbi_id=self.pbi_id)
+
+        # assertion
+        self.assertEqual(sorted(removed), sorted([self.pbi_id, self.task_id]))
+        self.assertEqual(self.simulator.workitems[self.task_id]['fields']['System.AreaPath'],
+                         r'theLotter\Optimizers')
+
+if __name__ == '__main__':
+    unittest.main()
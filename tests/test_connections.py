@@ -0,0 +1,53 @@
+import unittest
+import tfs_simulator
+from tfs_connect import tfs
+
+
+class TestKeptConnections(unittest.TestCase):
+    def setUp(self):
+        tfs.close_connections()
+
+    def tearDown(self):
+        tfs.close_connections()
+
+    def test_connection_is_kept_per_credentials(self):
+        """
+        Tests the same credentials get the same connection, and other credentials get their own
+        :return:
+        """
+
+        # arrange
+        other_credentials = dict(tfs_simulator.CREDENTIALS, userName="another@net-bet.net")
+
+        # action
+        connection = tfs.get_connection(tfs_simulator.CREDENTIALS)
+        same_connection = tfs.get_connection(dict(tfs_simulator.CREDENTIALS))
+        other_connection = tfs.get_connection(other_credentials)
+
+        # assertion
+        self.assertIs(connection, same_connection)
+        self.assertIsNot(connection, other_connection)
+        self.assertTrue(tfs.has_connection(tfs_simulator.CREDENTIALS))
+
+    def test_closed_connection_is_created_again(self):
+        """
+        Tests a new connection is created after the kept connections are closed
+        :return:
+        """
+
+        # arrange
+        connection = tfs.get_connection(tfs_simulator.CREDENTIALS)
+
+        # action
+        tfs.close_connections()
+        has_connection = tfs.has_connection(tfs_simulator.CREDENTIALS)
+        new_connection = tfs.get_connection(tfs_simulator.CREDENTIALS)
+
+        # assertion
+        self.assertFalse(has_connection)
+        self.assertIsNot(connection, new_connection)
+        self.assertTrue(tfs.has_connection(tfs_simulator.CREDENTIALS))
+
+
+if __name__ == '__main__':
+    unittest.main()
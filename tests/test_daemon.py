@@ -0,0 +1,114 @@
+import http.client
+import json
+import os
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+import tfs_simulator
+from operations import manage_daemon
+from tfs_connect import tfs
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item")
+        self.directory = tempfile.mkdtemp()
+        self.token_path = os.path.join(self.directory, "tfs_daemon.token")
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def start(self, **kwargs):
+        self.server = manage_daemon.create_server(self.tfs_instance, tfs_simulator.CREDENTIALS,
+                                                  token_path=self.token_path, **kwargs)
+        threading.Thread(target=manage_daemon.serve, args=(self.server,), daemon=True).start()
+
+    def post(self, body, headers=None):
+        if headers is None:
+            with open(self.token_path) as token_file:
+                headers = {"Content-Type": "application/json",
+                           manage_daemon.TOKEN_HEADER: token_file.read()}
+        connection = http.client.HTTPConnection(*self.server.server_address)
+        connection.request("POST", "/operations", body=json.dumps(body), headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_operation_request(self):
+        """
+        Tests single and list operation requests run on the warm connection
+        :return:
+        """
+
+        # arrange
+        self.start(port=0)
+
+        # action
+        status, result = self.post({"operation": "E2ETasks", "pbi_id": self.pbi_id})
+        _, results = self.post([{"operation": "E2ETasks", "pbi_id": self.pbi_id},
+                                {"operation": "Unknown"}])
+
+        # assertion
+        self.assertEqual(status, 200)
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(len(result["result"]), 3)
+        self.assertEqual([result["status"] for result in results], ["ok", "error"])
+        self.assertEqual(len(self.simulator.workitems[self.pbi_id]['relations']), 6)
+
+    def test_requests_need_the_token(self):
+        """
+        Tests a request without the token, a JSON content type, or with an Origin is rejected
+        :return:
+        """
+
+        # arrange
+        self.start(port=0)
+        record = {"operation": "E2ETasks", "pbi_id": self.pbi_id}
+        with open(self.token_path) as token_file:
+            token = token_file.read()
+
+        # action
+        statuses = [self.post(record, headers=headers)[0] for headers in [
+            {"Content-Type": "application/json"},
+            {"Content-Type": "application/json", manage_daemon.TOKEN_HEADER: token + "x"},
+            {"Content-Type": "text/plain", manage_daemon.TOKEN_HEADER: token},
+            {"Content-Type": "application/json", manage_daemon.TOKEN_HEADER: token,
+             "Origin": "https://example.com"}]]
+
+        # assertion
+        self.assertEqual(statuses, [401, 401, 415, 403])
+        self.assertFalse(self.simulator.workitems[self.pbi_id].get('relations'))
+        if os.name == "posix":
+            self.assertEqual(stat.S_IMODE(os.stat(self.token_path).st_mode), 0o600)
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets are not supported")
+    def test_unix_socket_request(self):
+        """
+        Tests a JSONL record on the Unix socket gets a JSONL result
+        :return:
+        """
+
+        # arrange
+        socket_path = os.path.join(tempfile.mkdtemp(), "tfs.sock")
+        self.start(socket_path=socket_path)
+
+        # action
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall((json.dumps({"operation": "E2ETasks", "pbi_id": self.pbi_id}) +
+                            "\n").encode("utf-8"))
+            result = json.loads(client.makefile("r").readline())
+
+        # assertion
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(stat.S_IMODE(os.stat(socket_path).st_mode), 0o600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import contextlib
+import io
+import threading
+import time
+import unittest
+from executor import executor
+
+
+class TestExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = executor.Executor(max_workers=4)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.finished = []
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def handle(self, item):
+        """
+        Handles an item: the later items are faster, so they finish first
+        :return: the item result
+        """
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        print(f"Item {item} started")
+        time.sleep(0.02 * (8 - item))
+        print(f"Item {item} finished")
+        with self.lock:
+            self.running -= 1
+            self.finished.append(item)
+        if item == 5:
+            raise ValueError("Item 5 failed")
+        return item * 10
+
+    def test_results_and_output_keep_the_item_order(self):
+        """
+        Tests the results and the output are in the items order, though the items finish
+        out of order
+        :return:
+        """
+
+        # arrange
+        output = io.StringIO()
+
+        # action
+        with contextlib.redirect_stdout(output):
+            results = self.executor.run(self.handle, range(8))
+
+        # assertion
+        self.assertNotEqual(self.finished, sorted(self.finished))
+        self.assertEqual([result["item"] for result in results], list(range(8)))
+        self.assertEqual([result["result"] for result in results],
+                         [item * 10 if item != 5 else None for item in range(8)])
+        self.assertIsInstance(results[5]["error"], ValueError)
+        self.assertEqual(output.getvalue().splitlines(),
+                         [line for item in range(8) for line in
+                          (f"Item {item} started", f"Item {item} finished")])
+
+    def test_items_run_in_parallel_up_to_the_limit(self):
+        """
+        Tests more than one worker runs at a time, and no more than the workers limit
+        :return:
+        """
+
+        # action
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.executor.run(self.handle, range(8))
+
+        # assertion
+        self.assertGreater(self.peak, 1)
+        self.assertLessEqual(self.peak, 4)
+
+    def test_nested_runs_are_serial(self):
+        """
+        Tests a run inside a worker runs its items in the worker (without waiting for the pool)
+        :return:
+        """
+
+        # arrange
+        def handle_group(group):
+            return [result["result"] for result in self.executor.run(lambda item: item + 1,
+                                                                      group)]
+
+        # action
+        results = self.executor.run(handle_group, [[1, 2], [3, 4], [5, 6], [7, 8], [9, 10]])
+
+        # assertion
+        self.assertEqual([result["result"] for result in results],
+                         [[2, 3], [4, 5], [6, 7], [8, 9], [10, 11]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+import tfs_simulator
+from operations import manage_tasks
+from tfs_connect import instrumentation
+from tfs_connect import tfs
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item")
+        instrumentation.INSTRUMENTATION.reset()
+
+    def test_calls_are_tagged_by_operation_and_endpoint(self):
+        """
+        Tests the calls of an operation are counted per endpoint, including the executor calls
+        :return:
+        """
+
+        # action
+        with instrumentation.operation("E2ETasks"):
+            manage_tasks.add_tasks_to_pbi(self.tfs_instance, tfs_simulator.CREDENTIALS,
+                                          pbi_id=self.pbi_id, pbi_type="E2ETasks")
+
+        # assertion
+        metrics = json.loads(instrumentation.INSTRUMENTATION.to_json())
+        calls = {(metric["operation"], metric["method"], metric["endpoint"]): metric["count"]
+                 for metric in metrics}
+        self.assertEqual(calls, {("E2ETasks", "GET", "wit/workitems"): 1,
+                                 ("E2ETasks", "POST", "wit/$batch"): 1})
+
+    def test_prometheus_export(self):
+        """
+        Tests the Prometheus export has a complete histogram per call type
+        :return:
+        """
+
+        # action
+        self.tfs_instance.get_workitem(self.pbi_id)
+        exported = instrumentation.INSTRUMENTATION.to_prometheus()
+
+        # assertion
+        self.assertIn('tfs_http_requests_total{operation="none",method="GET",'
+                      'endpoint="wit/workitems"} 1', exported)
+        self.assertIn('le="+Inf"} 1', exported)
+        self.assertIn('tfs_http_request_duration_seconds_count{operation="none"', exported)
+
+    def test_cache_lookups_are_exported(self):
+        """
+        Tests the hits and misses of the work item cache are in the summary and the
+        Prometheus export
+        :return:
+        """
+
+        # action
+        self.tfs_instance.get_workitem(self.pbi_id)
+        self.tfs_instance.get_workitem(self.pbi_id)
+        exported = instrumentation.INSTRUMENTATION.to_prometheus()
+
+        # assertion
+        self.assertIn('tfs_cache_hits_total 1\n', exported)
+        self.assertIn('tfs_cache_misses_total 1\n', exported)
+        self.assertIn('Work item cache: 1 hits, 1 misses',
+                      instrumentation.INSTRUMENTATION.get_summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
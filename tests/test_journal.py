@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+import tfs_simulator
+from operations import get_objects
+from tfs_connect import journal
+from tfs_connect import tfs
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "journal.jsonl")
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = self.get_connection()
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item")
+        self.task_ids = [self.simulator.add_workitem("Task", parent_id=self.pbi_id)
+                         for _ in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_connection(self):
+        """
+        :return: a new connection (as of a new run) with a journal in the test directory
+        """
+        return tfs.TFSConnection(tfs_simulator.CREDENTIALS, transport=self.simulator.adapter,
+                                 write_journal=journal.Journal(self.path))
+
+    def remove_tasks(self):
+        return self.tfs_instance.update_workitems(
+            [(task_id, get_objects.get_removed_task_data(tfs_simulator.CREDENTIALS))
+             for task_id in self.task_ids])
+
+    def test_done_writes_empty_the_journal(self):
+        """
+        Tests a run that finished all of its writes leaves nothing to resume
+        :return:
+        """
+
+        # action
+        self.remove_tasks()
+
+        # assertion
+        self.assertEqual(self.tfs_instance.journal.get_pending(), [])
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_resume_sends_only_the_failed_writes(self):
+        """
+        Tests a resume sends only the writes that failed, in a single request
+        :return:
+        """
+
+        # arrange
+        self.simulator.fail_ids = {self.task_ids[-1]}
+        self.simulator.fail_status = 503
+        results = self.remove_tasks()
+        self.assertIsNotNone(results[-1]['error'])
+        self.simulator.fail_ids = set()
+
+        # action
+        self.simulator.reset_stats()
+        results = self.get_connection().resume()
+
+        # assertion
+        self.assertEqual(results, [{'id': self.task_ids[-1], 'error': None}])
+        self.assertEqual(self.simulator.request_count, 1)
+        self.assertEqual(self.simulator.workitems[self.task_ids[-1]]['fields']['System.State'],
+                         'Removed')
+        self.assertEqual(journal.Journal(self.path).get_pending(), [])
+
+    def test_resume_after_a_crash(self):
+        """
+        Tests writes that were planned but never sent (the process died) are resumed
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.journal.plan([{
+            'method': 'PATCH',
+            'uri': '/_apis/wit/workitems/{0}?api-version=4.1'.format(self.task_ids[0]),
+            'headers': {'Content-Type': 'application/json-patch+json'},
+            'body': [dict(op="add", path="/fields/System.Title", value="Resumed")]}])
+
+        # action
+        new_run = self.get_connection()
+        self.assertEqual(new_run.journal.get_pending_count(), 1)
+        new_run.resume()
+
+        # assertion
+        self.assertEqual(self.simulator.workitems[self.task_ids[0]]['fields']['System.Title'],
+                         'Resumed')
+        self.assertEqual(new_run.journal.get_pending_count(), 0)
+
+    def test_rejected_writes_are_not_resumed(self):
+        """
+        Tests a write the server rejected (a deleted work item) is resolved as failed,
+        so it is not sent again and the journal is emptied
+        :return:
+        """
+
+        # arrange
+        results = self.tfs_instance.update_workitems(
+            [(999999, [dict(op="add", path="/fields/System.Title", value="Deleted")]),
+             (self.task_ids[0], [dict(op="add", path="/fields/System.Title", value="Title")])])
+        self.assertEqual(results[0]['status'], 404)
+
+        # action
+        self.simulator.reset_stats()
+        new_run = self.get_connection()
+        pending_count = new_run.journal.get_pending_count()
+        results = new_run.resume()
+
+        # assertion
+        self.assertEqual(pending_count, 0)
+        self.assertEqual(results, [])
+        self.assertEqual(self.simulator.request_count, 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+import tfs_simulator
+from operations import get_objects
+from tfs_connect import mirror
+from tfs_connect import tfs
+
+
+class TestWorkitemMirror(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.feature_id = self.simulator.add_workitem("Feature", {'System.Title': 'Feature'})
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item",
+                                                  {'System.Title': 'PBI'},
+                                                  parent_id=self.feature_id)
+        self.task_ids = [self.simulator.add_workitem("Task", parent_id=self.pbi_id)
+                         for _ in range(3)]
+        self.mirror = mirror.WorkitemMirror(os.path.join(self.directory.name, "mirror.sqlite"))
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter,
+                                              workitem_mirror=self.mirror)
+
+    def tearDown(self):
+        self.mirror.close()
+        self.directory.cleanup()
+
+    def test_reads_are_served_by_the_mirror(self):
+        """
+        Tests a synced mirror serves the item reads and the hierarchy walks
+        :return:
+        """
+
+        # arrange
+        self.assertEqual(self.tfs_instance.sync_mirror(), 5)
+        self.simulator.reset_stats()
+
+        # action
+        feature_data = self.tfs_instance.get_workitem(self.feature_id, fields=['System.Title'])
+        tree = get_objects.get_tree(self.tfs_instance, self.feature_id)
+
+        # assertion
+        self.assertEqual(feature_data['System.Title'], 'Feature')
+        self.assertEqual(sorted(tree["items"]), sorted([self.feature_id, self.pbi_id] +
+                                                       self.task_ids))
+        self.assertEqual(self.simulator.request_count, 0)
+
+    def test_sync_reads_only_the_changes(self):
+        """
+        Tests a second sync reads only the items that changed since the first one
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.sync_mirror()
+        new_task_id = self.simulator.add_workitem("Task", parent_id=self.pbi_id)
+
+        # action
+        count = self.tfs_instance.sync_mirror()
+
+        # assertion
+        self.assertEqual(count, 2)  # the new task and its parent
+        self.assertIn(new_task_id, self.mirror.get_descendants(self.pbi_id)[self.pbi_id])
+
+    def test_writes_are_not_read_from_the_mirror(self):
+        """
+        Tests the written items are read from the server until the next sync
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.sync_mirror()
+        self.tfs_instance.update_workitem(self.pbi_id, [dict(op="add", path="/fields/System.Title",
+                                                             value="New title")])
+        self.tfs_instance.cache.clear()
+
+        # action
+        pbi_data = self.tfs_instance.get_workitem(self.pbi_id)
+
+        # assertion
+        self.assertEqual(pbi_data['System.Title'], 'New title')
+        self.assertEqual(self.mirror.get_count(), 4)
+
+    def test_stale_mirror_is_not_used(self):
+        """
+        Tests a mirror that was not synced for max_age seconds doesn't serve reads
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.sync_mirror()
+        self.mirror.max_age = -1
+        self.simulator.reset_stats()
+
+        # action
+        self.tfs_instance.get_workitem(self.pbi_id)
+
+        # assertion
+        self.assertEqual(self.simulator.request_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import contextlib
+import io
+import json
+import unittest
+import tfs_simulator
+from operations import manage_batch
+from operations import manage_plans
+from operations import manage_tasks
+from tfs_connect import tfs
+
+
+class TestOperationPlans(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.pbi_ids = [self.simulator.add_workitem("Product Backlog Item",
+                                                    {'System.Title': 'PBI'}) for _ in range(2)]
+        self.task_ids = [self.simulator.add_workitem("Task", {'System.Title': 'Task'},
+                                                     parent_id=self.pbi_ids[0])
+                         for _ in range(3)]
+
+    def run_batch(self, records, dry_run=False):
+        """
+        Runs operation records as a batch
+        :return: a tuple of the JSONL results and the number of failed records
+        """
+        output_stream = io.StringIO()
+        failed = manage_batch.run_batch(io.StringIO("\n".join(json.dumps(record)
+                                                              for record in records)),
+                                        output_stream, self.tfs_instance,
+                                        tfs_simulator.CREDENTIALS, dry_run=dry_run)
+        return [json.loads(line) for line in output_stream.getvalue().splitlines()], failed
+
+    def test_records_share_reads_and_batches(self):
+        """
+        Tests the task operations of a batch are read in bulk once and written in a single batch
+        :return:
+        """
+
+        # action
+        results, failed = self.run_batch(
+            [{"operation": "RegularTasks", "pbi_id": pbi_id} for pbi_id in self.pbi_ids])
+
+        # assertion
+        self.assertEqual(failed, 0)
+        self.assertEqual([len(result["result"]) for result in results], [6, 6])
+        self.assertEqual(self.simulator.request_count, 2)
+
+    def test_writes_of_an_item_are_merged(self):
+        """
+        Tests an update and a relation edit of the same item are sent as a single update
+        :return:
+        """
+
+        # arrange
+        def planner(title):
+            yield manage_plans.read([self.pbi_ids[0]])
+            return [manage_plans.update(self.pbi_ids[0],
+                                        [dict(op="add", path="/fields/System.Title", value=title)],
+                                        done="PBI {id} was renamed", failed="Not renamed"),
+                    manage_plans.update(self.pbi_ids[0],
+                                        [dict(op="add", path="/relations/-",
+                                              value={'rel': 'System.LinkTypes.Related',
+                                                     'url': tfs.WORKITEMS_URL +
+                                                     str(self.pbi_ids[1])})],
+                                        done="PBI {id} was related", failed="Not related")]
+
+        # action
+        results, summary = manage_plans.run_plans([planner("First"), planner("Second")],
+                                                  self.tfs_instance)
+
+        # assertion
+        self.assertEqual(summary["writes"], 4)
+        self.assertEqual(summary["merged_writes"], 1)
+        self.assertEqual(self.simulator.request_count, 2)
+        self.assertTrue(all(result["error"] is None and write_result["error"] is None
+                            for result in results for _, write_result in result["writes"]))
+        workitem = self.simulator.workitems[self.pbi_ids[0]]
+        self.assertEqual(workitem['fields']['System.Title'], 'Second')
+        self.assertEqual(len([relation for relation in workitem['relations']
+                              if relation['rel'] == 'System.LinkTypes.Related']), 1)
+
+    def test_relation_removals_are_not_added_up(self):
+        """
+        Tests two writes that remove the relations of the same item are merged to the removals
+        of the last one, after the revision test
+        :return:
+        """
+
+        # arrange
+        def get_removal(rel_count):
+            return manage_plans.update(
+                self.pbi_ids[0], [{"op": "test", "path": "/rev", "value": 3}] +
+                [{"op": "remove", "path": "/relations/{0}".format(index)}
+                 for index in range(rel_count)] +
+                [dict(op="add", path="/fields/System.State", value="Removed")],
+                done="PBI {id} was removed", failed="Not removed")
+
+        # action
+        optimized = manage_plans.optimize({"writes": [[get_removal(2)], [get_removal(2)]],
+                                           "errors": [None, None], "read_requests": 1})
+
+        # assertion
+        self.assertEqual(optimized["updates"], [(self.pbi_ids[0], [
+            {"op": "test", "path": "/rev", "value": 3},
+            {"op": "remove", "path": "/relations/1"},
+            {"op": "remove", "path": "/relations/0"},
+            dict(op="add", path="/fields/System.State", value="Removed")])])
+
+    def test_dry_run_doesnt_write(self):
+        """
+        Tests a dry run only plans the task operations, and skips the others
+        :return:
+        """
+
+        # action
+        results, failed = self.run_batch(
+            [{"operation": "CloneTasks", "source_id": self.pbi_ids[0],
+              "target_id": self.pbi_ids[1]},
+             {"operation": "RemovePBITasks", "pbi_id": self.pbi_ids[0]}], dry_run=True)
+
+        # assertion
+        self.assertEqual(failed, 0)
+        self.assertEqual([result["status"] for result in results], ["planned", "skipped"])
+        self.assertEqual(results[0]["result"], len(self.task_ids))
+        self.assertEqual(len(self.simulator.workitems), 5)
+        self.assertFalse(self.simulator.workitems[self.pbi_ids[1]].get('relations'))
+
+    def test_invalid_id_fails_its_record_only(self):
+        """
+        Tests a missing work item fails only the operation that reads it
+        :return:
+        """
+
+        # action
+        results, failed = self.run_batch(
+            [{"operation": "CloneTasks", "source_id": self.pbi_ids[0],
+              "target_id": self.pbi_ids[1]},
+             {"operation": "CloneTasks", "source_id": self.pbi_ids[0], "target_id": 999}])
+
+        # assertion
+        self.assertEqual(failed, 1)
+        self.assertEqual([result["status"] for result in results], ["ok", "error"])
+        self.assertEqual(len(results[0]["result"]), len(self.task_ids))
+
+    def test_invalid_target_is_skipped(self):
+        """
+        Tests a target that can't be read doesn't stop the copies to the other targets
+        :return:
+        """
+
+        # action
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            new_task_ids = manage_tasks.clone_pbi_tasks_to_many(
+                self.tfs_instance, self.pbi_ids[0], [self.pbi_ids[1], 999999])
+
+        # assertion
+        self.assertEqual(len(new_task_ids), len(self.task_ids))
+        self.assertIn('not copied to PBI 999999', output.getvalue())
+        self.assertEqual(len([relation for relation in
+                              self.simulator.workitems[self.pbi_ids[1]]['relations']
+                              if relation['rel'] == 'System.LinkTypes.Hierarchy-Forward']),
+                         len(self.task_ids))
+
+    def test_non_object_record_fails_its_record_only(self):
+        """
+        Tests a JSON record that is not an object has an error result, and the batch goes on
+        :return:
+        """
+
+        # action
+        results, failed = self.run_batch(
+            [{"operation": "RegularTasks", "pbi_id": self.pbi_ids[0]}, [1, 2], "x",
+             {"operation": "RegularTasks", "pbi_id": self.pbi_ids[1]}])
+
+        # assertion
+        self.assertEqual(failed, 2)
+        self.assertEqual([result["status"] for result in results], ["ok", "error", "error", "ok"])
+
+    def test_records_run_in_their_order(self):
+        """
+        Tests a record that can't be planned runs before the planned records after it
+        :return:
+        """
+
+        # action
+        results, failed = self.run_batch(
+            [{"operation": "RemovePBITasks", "pbi_id": self.pbi_ids[0]},
+             {"operation": "CloneTasks", "source_id": self.pbi_ids[0],
+              "target_id": self.pbi_ids[1]}])
+
+        # assertion
+        self.assertEqual(failed, 0)
+        self.assertEqual(results[1]["result"], [])  # the tasks were removed from the source
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import tfs_simulator
+from tfs_connect import tfs
+
+FIELDS = ['System.Title', 'System.AreaId']
+
+
+class TestFieldsProjection(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.pbi_id = self.simulator.add_workitem(
+            "Product Backlog Item", {'System.Title': 'PBI',
+                                     'System.Description': '<p>' + 'x' * 1000 + '</p>'})
+        self.task_id = self.simulator.add_workitem("Task", parent_id=self.pbi_id)
+
+    def test_projection_reads_only_the_fields(self):
+        """
+        Tests a projected read gets only the given fields, without the relations
+        :return:
+        """
+
+        # action
+        pbi_data = self.tfs_instance.get_workitem(self.pbi_id, fields=FIELDS)
+
+        # assertion
+        self.assertEqual(pbi_data['System.Title'], 'PBI')
+        self.assertNotIn('System.Description', pbi_data.fields)
+        self.assertNotIn('relations', pbi_data.data)
+
+    def test_projection_is_served_from_the_cache(self):
+        """
+        Tests a cached projection serves the reads of its fields, but not the full reads
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.get_workitem(self.pbi_id, fields=FIELDS)
+        self.simulator.reset_stats()
+
+        # action
+        self.tfs_instance.get_workitem(self.pbi_id, fields=['system.title'])
+        projected_requests = self.simulator.request_count
+        pbi_data = self.tfs_instance.get_workitem(self.pbi_id)
+
+        # assertion
+        self.assertEqual(projected_requests, 0)
+        self.assertEqual(self.simulator.request_count, 1)
+        self.assertEqual(pbi_data.child_ids, [self.task_id])
+
+    def test_full_item_serves_projections(self):
+        """
+        Tests a cached full item serves any projection, and is not replaced by it
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.get_workitem(self.pbi_id)
+        self.simulator.reset_stats()
+
+        # action
+        self.tfs_instance.get_workitem(self.pbi_id, fields=FIELDS)
+        pbi_data = self.tfs_instance.get_workitem(self.pbi_id, expand="relations")
+
+        # assertion
+        self.assertEqual(self.simulator.request_count, 0)
+        self.assertEqual(pbi_data.child_ids, [self.task_id])
+
+    def test_fields_and_expand_are_rejected(self):
+        """
+        Tests a read with both fields and expand is rejected before any request
+        :return:
+        """
+
+        # action and assertion
+        with self.assertRaises(ValueError):
+            self.tfs_instance.get_workitem(self.pbi_id, fields=FIELDS, expand="relations")
+        self.assertEqual(self.simulator.request_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
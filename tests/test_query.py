@@ -0,0 +1,91 @@
+import unittest
+import tfs_simulator
+from operations import get_objects
+from tfs_connect import tfs
+
+QUERY = "SELECT [System.Id] FROM WorkItems WHERE [System.WorkItemType] = 'Product Backlog Item'"
+
+
+class TestQueryWorkitems(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.pbi_ids = [self.simulator.add_workitem(
+            "Product Backlog Item", {'System.Title': 'PBI {0}'.format(number),
+                                     'System.Description': '<p>' + 'x' * 100 + '</p>'})
+            for number in range(450)]
+        self.simulator.add_workitem("Task")
+
+    def test_items_are_read_in_pages(self):
+        """
+        Tests the query items are yielded in the query order, a bulk read per page
+        :return:
+        """
+
+        # arrange
+        self.simulator.reset_stats()
+
+        # action
+        workitems = list(get_objects.query_workitems(self.tfs_instance, QUERY))
+
+        # assertion
+        self.assertEqual([int(workitem.id) for workitem in workitems], self.pbi_ids)
+        self.assertEqual(self.simulator.request_count, 1 + 3)
+
+    def test_pages_are_read_lazily(self):
+        """
+        Tests only the pages that were reached (and the prefetched one) are read
+        :return:
+        """
+
+        # arrange
+        self.simulator.reset_stats()
+        workitems = get_objects.query_workitems(self.tfs_instance, QUERY, page_size=50)
+
+        # action
+        first = next(workitems)
+        workitems.close()
+
+        # assertion
+        self.assertEqual(int(first.id), self.pbi_ids[0])
+        self.assertLessEqual(self.simulator.request_count, 1 + 2)
+
+    def test_query_is_paged_past_the_wiql_limit(self):
+        """
+        Tests a query of more items than the WIQL limit is run a page of IDs at a time
+        :return:
+        """
+
+        # arrange
+        self.simulator.wiql_limit = 300
+        self.simulator.reset_stats()
+
+        # action
+        workitems = list(get_objects.query_workitems(self.tfs_instance, QUERY,
+                                                     query_page_size=100))
+
+        # assertion
+        self.assertEqual([int(workitem.id) for workitem in workitems], self.pbi_ids)
+        self.assertEqual(len([path for _, path in self.simulator.requests
+                              if path.startswith('wit/wiql')]), 5)
+        self.assertEqual(self.simulator.request_count, 5 + 5)
+
+    def test_fields_projection(self):
+        """
+        Tests the items are read with only the given fields
+        :return:
+        """
+
+        # action
+        workitems = list(get_objects.query_workitems(self.tfs_instance, QUERY,
+                                                     fields=['System.Title'], prefetch=False))
+
+        # assertion
+        self.assertEqual(len(workitems), len(self.pbi_ids))
+        self.assertEqual(workitems[0]['System.Title'], 'PBI 0')
+        self.assertNotIn('System.Description', workitems[0].fields)
+
+
+if __name__ == '__main__':
+    unittest.main()
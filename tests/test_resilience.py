@@ -0,0 +1,128 @@
+import unittest
+import tfs_simulator
+from operations import get_objects
+from operations import manage_tasks
+from tfs_connect import resilience
+from tfs_connect import tfs
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        self.simulator = tfs_simulator.TFSSimulator()
+        self.tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS,
+                                              transport=self.simulator.adapter)
+        self.tfs_instance.retry_policy.base_delay = 0.001
+        self.tfs_instance.limiter.backoff = 0
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item")
+        self.task_ids = [self.simulator.add_workitem("Task", parent_id=self.pbi_id)
+                         for _ in range(3)]
+
+    def test_idempotent_call_is_retried(self):
+        """
+        Tests a read goes through transient server errors
+        :return:
+        """
+
+        # arrange
+        self.simulator.fail_next(2)
+
+        # action
+        workitem = self.tfs_instance.get_workitem(self.pbi_id)
+
+        # assertion
+        self.assertEqual(workitem.id, self.pbi_id)
+        self.assertEqual(self.simulator.request_count, 3)
+
+    def test_write_is_retried_only_when_it_was_not_processed(self):
+        """
+        Tests a $batch write is not sent again after a 500, but is after a 429
+        :return:
+        """
+
+        # arrange
+        updates = [(task_id, get_objects.get_removed_task_data(tfs_simulator.CREDENTIALS))
+                   for task_id in self.task_ids]
+
+        # action
+        self.simulator.fail_next(1, status=500)
+        failed_results = self.tfs_instance.update_workitems(updates)
+        self.simulator.fail_next(1, status=429)
+        results = self.tfs_instance.update_workitems(updates)
+
+        # assertion
+        self.assertTrue(all(result['error'] is not None for result in failed_results))
+        self.assertTrue(all(result['error'] is None for result in results))
+        self.assertEqual(self.simulator.request_count, 3)
+
+    def test_open_circuit_fails_fast(self):
+        """
+        Tests calls are not sent while the server is down
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.breaker.failure_threshold = 2
+        self.simulator.fail_next(100)
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.tfs_instance.get_workitem(self.pbi_id)
+        sent = self.simulator.request_count
+
+        # action
+        with self.assertRaises(resilience.CircuitOpenError):
+            self.tfs_instance.get_workitem(self.task_ids[0])
+
+        # assertion
+        self.assertEqual(sent, 2)
+        self.assertEqual(self.simulator.request_count, sent)
+        self.assertEqual(self.tfs_instance.breaker.state, "open")
+
+    def test_failed_item_does_not_stop_the_removal(self):
+        """
+        Tests a task that can't be removed leaves only its PBI, and the other tasks are removed
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.get_workitems(self.task_ids + [self.pbi_id])
+        self.simulator.fail_ids = {self.task_ids[0]}
+
+        # action
+        removed = manage_tasks.remove_pbi_with_tasks(self.tfs_instance,
+                                                     tfs_simulator.CREDENTIALS, pbi_id=self.pbi_id)
+
+        # assertion
+        self.assertIsNone(removed)
+        states = {item_id: self.simulator.workitems[item_id]['fields']['System.State']
+                  for item_id in self.task_ids + [self.pbi_id]}
+        self.assertEqual(states, {self.task_ids[0]: 'New', self.task_ids[1]: 'Removed',
+                                  self.task_ids[2]: 'Removed', self.pbi_id: 'New'})
+
+    def test_stale_relations_are_not_removed(self):
+        """
+        Tests a task whose relations changed since it was cached is not updated,
+        instead of removing its relations by stale indexes
+        :return:
+        """
+
+        # arrange
+        self.tfs_instance.get_workitem(self.task_ids[0], expand="relations")
+        other_pbi_id = self.simulator.add_workitem("Product Backlog Item")
+        with self.simulator._lock:  # pylint: disable=protected-access
+            task = self.simulator.workitems[self.task_ids[0]]
+            task['relations'].insert(0, {'rel': 'System.LinkTypes.Related',
+                                         'url': self.simulator.get_url(other_pbi_id)})
+            task['rev'] += 1
+
+        # action
+        removed = manage_tasks.remove_task(self.tfs_instance, tfs_simulator.CREDENTIALS,
+                                           self.task_ids[0])
+
+        # assertion
+        self.assertIsNone(removed)
+        self.assertEqual(len(self.simulator.workitems[self.task_ids[0]]['relations']), 2)
+        self.assertEqual(self.simulator.workitems[self.task_ids[0]]['fields']['System.State'],
+                         'New')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import time
+import unittest
+import requests
+import tfs_simulator
+from tfs_connect import scheduler
+from tfs_connect import tfs
+
+
+def get_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+class TestScheduler(unittest.TestCase):
+    def test_throttling_halves_the_limits_and_pauses(self):
+        """
+        Tests a 429 response cuts the limits by half, and no request is sent before Retry-After
+        :return:
+        """
+
+        # arrange
+        limiter = scheduler.RateLimiter(rate=10, concurrency=8)
+        limiter.acquire()
+
+        # action
+        limiter.release(0.01, get_response(429, {'Retry-After': '0.2'}))
+        start = time.monotonic()
+        limiter.acquire()
+
+        # assertion
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(limiter.get_state(), {"rate": 5, "concurrency": 4, "throttled": 1})
+
+    def test_fast_responses_grow_the_limits(self):
+        """
+        Tests the limits grow additively while the responses are fast, up to the maximum
+        :return:
+        """
+
+        # arrange
+        limiter = scheduler.RateLimiter(rate=50, concurrency=2, max_concurrency=4)
+
+        # action
+        for _ in range(25):
+            limiter.acquire()
+            limiter.release(0.01, get_response(200))
+
+        # assertion
+        self.assertEqual(limiter.get_state()["concurrency"], 4)
+        self.assertGreater(limiter.get_state()["rate"], 50)
+
+    def test_slow_responses_keep_the_limits(self):
+        """
+        Tests responses slower than the target latency don't grow the limits
+        :return:
+        """
+
+        # arrange
+        limiter = scheduler.RateLimiter(rate=10, concurrency=2, target_latency=0.5)
+
+        # action
+        limiter.acquire()
+        limiter.release(2.0, get_response(200))
+
+        # assertion
+        self.assertEqual(limiter.get_state(), {"rate": 10, "concurrency": 2, "throttled": 0})
+
+    def test_connection_requests_are_scheduled(self):
+        """
+        Tests the connection requests go through its limiter, which sees the server throttling
+        :return:
+        """
+
+        # arrange
+        simulator = tfs_simulator.TFSSimulator(throttle_rate=1, retry_after=0)
+        tfs_instance = tfs.TFSConnection(tfs_simulator.CREDENTIALS, transport=simulator.adapter)
+        tfs_instance.retry_policy.max_attempts = 1
+        pbi_id = simulator.add_workitem("Product Backlog Item")
+        tfs_instance.get_workitem(pbi_id)
+        tfs_instance.cache.clear()
+
+        # action
+        with self.assertRaises(requests.exceptions.HTTPError):
+            tfs_instance.get_workitem(pbi_id)
+
+        # assertion
+        self.assertEqual(tfs_instance.limiter.get_state()["throttled"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
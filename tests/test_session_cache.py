@@ -0,0 +1,101 @@
+import os
+import stat
+import tempfile
+import unittest
+import tfs_simulator
+from tfs_connect import session_cache
+from tfs_connect import tfs
+
+
+class TestSessionCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "session.json")
+        self.simulator = tfs_simulator.TFSSimulator(session_cookie="TFS-Session=abc")
+        self.pbi_id = self.simulator.add_workitem("Product Backlog Item")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_connection(self):
+        """
+        :return: a new connection (as of a new process) with the session cache
+        """
+        return tfs.TFSConnection(tfs_simulator.CREDENTIALS, transport=self.simulator.adapter,
+                                 session_cache=session_cache.SessionCache(self.path))
+
+    def test_new_process_reuses_the_session(self):
+        """
+        Tests a second process sends the saved cookie and skips the handshake
+        :return:
+        """
+
+        # arrange
+        self.get_connection().get_workitem(self.pbi_id)
+        self.assertEqual(self.simulator.handshakes, 1)
+
+        # action
+        self.get_connection().get_workitem(self.pbi_id)
+
+        # assertion
+        self.assertEqual(self.simulator.handshakes, 1)
+        if os.name == "posix":
+            self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_session_of_another_user_is_not_used(self):
+        """
+        Tests the saved cookies are sent only for the server and user they were issued to
+        :return:
+        """
+
+        # arrange
+        self.get_connection().get_workitem(self.pbi_id)
+
+        # action
+        cookies = session_cache.SessionCache(self.path).load(
+            {"uri": tfs_simulator.BASE_URI, "user": "another@net-bet.net"})
+
+        # assertion
+        self.assertEqual(cookies, [])
+
+    def test_session_is_not_saved_unrestricted(self):
+        """
+        Tests the session is not saved if its file can't be restricted to the user
+        :return:
+        """
+
+        # arrange
+        def fail_restriction(path):
+            raise OSError("Can't restrict {0}".format(path))
+        restrict_file = session_cache.restrict_file
+        session_cache.restrict_file = fail_restriction
+
+        # action
+        try:
+            self.get_connection().get_workitem(self.pbi_id)
+        finally:
+            session_cache.restrict_file = restrict_file
+
+        # assertion
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_rejected_session_is_dropped(self):
+        """
+        Tests the saved session is removed once the server rejects it
+        :return:
+        """
+
+        # arrange
+        self.get_connection().get_workitem(self.pbi_id)
+        self.simulator.fail_next(1, status=401)
+
+        # action
+        with self.assertRaises(Exception):
+            self.get_connection().get_workitem(self.pbi_id)
+
+        # assertion
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules that only the network operations need
+HEAVY_MODULES = ["requests", "requests_ntlm", "tfs", "tfs_connect.tfs", "operations.manage_tasks"]
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import tfs_access
+print(json.dumps({"seconds": time.perf_counter() - start,
+                  "loaded": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+class StartupBenchmark(unittest.TestCase):
+    """
+    Measures the cold-start import time of the program, so a slow startup fails the tests
+    """
+    def test_startup_defers_the_network_modules(self):
+        """
+        Tests importing the program doesn't load the network modules
+        :return:
+        """
+
+        # action
+        with tempfile.TemporaryDirectory() as profile_path:
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT], cwd=ROOT_PATH, check=True,
+                stdout=subprocess.PIPE, env=dict(os.environ, USERPROFILE=profile_path)).stdout
+        startup = json.loads(output.decode().strip().splitlines()[-1])
+        print('test_startup_defers_the_network_modules: {0:.3f}s'.format(startup["seconds"]))
+
+        # assertion
+        self.assertEqual(startup["loaded"], [])
+        self.assertLess(startup["seconds"], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from operations import task_templates
+
+
+class TestTaskTemplates(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "task_templates.json")
+        self.write_templates({"tasks": {"ReviewTests": {"System.Title": "Review Tests",
+                                                        "System.AssignedTo": "{user_name}"}},
+                              "types": {"E2ETasks": ["ReviewTests"]}})
+        self.registry = task_templates.TemplateRegistry(self.path)
+        self.pbi = {"System.AreaId": 7, "System.IterationId": 8}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_templates(self, data, modified=None):
+        with open(self.path, "w") as file:
+            json.dump(data, file)
+        if modified is not None:
+            os.utime(self.path, ns=(modified, modified))
+
+    def test_patch_has_the_per_pbi_fields(self):
+        """
+        Tests the compiled patch is completed with the PBI area, iteration and the user name
+        :return:
+        """
+
+        # action
+        template, = self.registry.get_templates("E2ETasks")
+        patch = template.get_patch(self.pbi, "Test User")
+
+        # assertion
+        fields = {operation["path"]: operation["value"] for operation in patch}
+        self.assertEqual(fields, {"/fields/System.Title": "Review Tests",
+                                  "/fields/System.AssignedTo": "Test User",
+                                  "/fields/System.AreaId": 7,
+                                  "/fields/System.IterationId": 8})
+        self.assertEqual(len(template.operations), 1)
+
+    def test_changed_file_is_reloaded(self):
+        """
+        Tests the templates are compiled once, and again only after the file changed
+        :return:
+        """
+
+        # arrange
+        templates = self.registry.get_templates("E2ETasks")
+
+        # action
+        self.assertIs(self.registry.get_templates("E2ETasks"), templates)
+        self.write_templates({"tasks": {"Notify": {"System.Title": "Notify ..."}},
+                              "types": {"E2ETasks": ["Notify"]}},
+                             modified=os.stat(self.path).st_mtime_ns + 10 ** 9)
+
+        # assertion
+        self.assertEqual([template.title for template in self.registry.get_templates("E2ETasks")],
+                         ["Notify ..."])
+
+    def test_invalid_file_keeps_the_templates(self):
+        """
+        Tests a broken templates file doesn't drop the loaded templates
+        :return:
+        """
+
+        # arrange
+        templates = self.registry.get_templates("E2ETasks")
+
+        # action
+        with open(self.path, "w") as file:
+            file.write("{")
+        os.utime(self.path, ns=(1, 1))
+
+        # assertion
+        self.assertIs(self.registry.get_templates("E2ETasks"), templates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+from executor import executor
+from watchdog import watchdog
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self):
+        self.expired = threading.Event()
+        self.watch_dog = watchdog.Watchdog()
+        self.watch_dog._timeout = 0.1  # pylint: disable=protected-access
+        self.watch_dog.do_expire = self.expired.set
+
+    def tearDown(self):
+        self.watch_dog.stop()
+        watchdog._ACTIVE_WATCHDOG = None  # pylint: disable=protected-access
+
+    def test_refresh_pushes_the_deadline_without_new_threads(self):
+        """
+        Tests refreshes keep the watchdog alive, using a single monitor thread
+        :return:
+        """
+
+        # arrange
+        self.watch_dog.start()
+        threads = threading.active_count()
+
+        # action
+        for _ in range(10):
+            time.sleep(0.03)
+            self.watch_dog.refresh()
+
+        # assertion
+        self.assertFalse(self.expired.is_set())
+        self.assertEqual(threading.active_count(), threads)
+        self.assertTrue(self.expired.wait(1))
+
+    def test_expiry_cancels_a_running_operation_at_an_item_boundary(self):
+        """
+        Tests an expiry during an operation stops its remaining items, and closes the program
+        after the operation
+        :return:
+        """
+
+        # arrange
+        self.watch_dog.start()
+
+        def handle_item(item):
+            time.sleep(0.2 if item == 0 else 0)  # a stalled item, with no heartbeat
+            return item
+
+        # action
+        with self.watch_dog.busy():
+            results = executor.Executor(max_workers=1).run(handle_item, range(3))
+            self.assertFalse(self.expired.is_set())
+
+        # assertion
+        self.assertEqual(results[0]['result'], 0)
+        self.assertIsInstance(results[1]['error'], watchdog.OperationCancelledError)
+        self.assertIsInstance(results[2]['error'], watchdog.OperationCancelledError)
+        self.assertTrue(self.expired.is_set())
+
+    def test_items_are_heartbeats(self):
+        """
+        Tests a long operation doesn't expire while its items keep finishing
+        :return:
+        """
+
+        # arrange
+        self.watch_dog.start()
+
+        # action
+        with self.watch_dog.busy():
+            results = executor.Executor(max_workers=1).run(lambda item: time.sleep(0.03),
+                                                           range(10))
+
+        # assertion
+        self.assertTrue(all(result['error'] is None for result in results))
+        self.assertFalse(self.expired.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,449 @@
+"""
+An in-process stand-in for the TFS work item REST API.
+It is mounted as the transport of a TFSConnection, so the whole client stack
+(TFSAPI, the requests session, the auth hooks) runs as it does against the server.
+It supports configurable latency, jitter, error injection, throttling and session cookies,
+and counts every request.
+"""
+
+import io
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlparse
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+BASE_URI = "https://tfs.test/tfs/DefaultCollection/"
+CREDENTIALS = {'uri': BASE_URI,
+               'userName': 'tester@net-bet.net',
+               'password': 'secret',
+               'project': 'theLotter',
+               'name': 'Test User<NET-BET\\TesterU>'}
+
+# The maximal number of ids in a bulk read, and of requests in a $batch
+SERVER_LIMIT = 200
+
+# The maximal number of results of a WIQL query
+WIQL_LIMIT = 20000
+
+REVERSE_LINKS = {'System.LinkTypes.Hierarchy-Reverse': 'System.LinkTypes.Hierarchy-Forward',
+                 'System.LinkTypes.Hierarchy-Forward': 'System.LinkTypes.Hierarchy-Reverse',
+                 'System.LinkTypes.Dependency-Reverse': 'System.LinkTypes.Dependency-Forward',
+                 'System.LinkTypes.Dependency-Forward': 'System.LinkTypes.Dependency-Reverse',
+                 'System.LinkTypes.Related': 'System.LinkTypes.Related'}
+
+
+class SimulatorError(Exception):
+    """
+    An error the simulator returns as an HTTP error response
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class TFSSimulator:
+    """
+    A simulated TFS server with an in-memory work item store
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None,
+                 throttle_rate=None, retry_after=1, session_cookie=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.throttled = 0
+        self.session_cookie = session_cookie
+        self.handshakes = 0
+        self._recent = []
+        self._failures = []
+        self.fail_ids = set()
+        self.fail_status = 400
+        self.wiql_limit = WIQL_LIMIT
+        self.workitems = {}
+        self.requests = []
+        # The current and the peak number of requests handled at once
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._next_id = 1000
+        self._clock = datetime(2020, 1, 1)
+        # The project roots, and the area and iteration of the removed work items
+        self.classification_nodes = {
+            'area': {'id': 1, 'name': CREDENTIALS['project'], 'structureType': 'area',
+                     'hasChildren': True,
+                     'children': [{'id': 3, 'name': 'Optimizers', 'structureType': 'area'}]},
+            'iteration': {'id': 2, 'name': CREDENTIALS['project'], 'structureType': 'iteration',
+                          'hasChildren': True,
+                          'children': [{'id': 4, 'name': 'Optimizers',
+                                        'structureType': 'iteration'}]}}
+        self._next_node_id = 4
+        self._lock = threading.RLock()
+        self.adapter = SimulatorAdapter(self)
+
+    @property
+    def request_count(self):
+        """
+        :return: the number of HTTP requests the simulator got
+        """
+        return len(self.requests)
+
+    def reset_stats(self):
+        """
+        Forgets the requests the simulator got so far (and their peak concurrency)
+        :return: None
+        """
+        with self._lock:
+            self.requests = []
+            self.peak_in_flight = self.in_flight
+
+    def fail_next(self, count, status=503):
+        """
+        Makes the next requests fail, as a server outage
+        :param count: the number of requests to fail
+        :param status: the HTTP status of the failures
+        :return: None
+        """
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def add_workitem(self, workitem_type, fields=None, parent_id=None):
+        """
+        Adds a work item directly to the store (without a request)
+        :param workitem_type: the work item type
+        :param fields: the work item fields
+        :param parent_id: an optional parent work item ID
+        :return: the new work item ID
+        """
+        with self._lock:
+            item_id = self._create(workitem_type, fields or {})
+            if parent_id is not None:
+                self._add_relation(item_id, {'rel': 'System.LinkTypes.Hierarchy-Reverse',
+                                             'url': self.get_url(parent_id)})
+            return item_id
+
+    def add_classification_node(self, structure_type, path, start_date=None, finish_date=None):
+        """
+        Adds an area or an iteration (and its missing parents)
+        :param structure_type: "area" or "iteration"
+        :param path: the node path under the project, e.g. "Sprint 1\\Current"
+        :param start_date: an optional iteration start date, e.g. "2020-01-06T00:00:00Z"
+        :param finish_date: an optional iteration finish date
+        :return: the node ID
+        """
+        with self._lock:
+            node = self.classification_nodes[structure_type]
+            for name in path.split('\\'):
+                child = next((child for child in node.get('children', [])
+                              if child['name'] == name), None)
+                if child is None:
+                    self._next_node_id += 1
+                    child = {'id': self._next_node_id, 'name': name,
+                             'structureType': structure_type}
+                    node.setdefault('children', []).append(child)
+                    node['hasChildren'] = True
+                node = child
+            if start_date is not None:
+                node['attributes'] = {'startDate': start_date, 'finishDate': finish_date}
+            return node['id']
+
+    @staticmethod
+    def get_url(item_id):
+        """
+        :param item_id: a work item ID
+        :return: the work item URL
+        """
+        return BASE_URI + "_apis/wit/workItems/" + str(item_id)
+
+    def handle(self, method, url, body, headers=None):
+        """
+        Handles a single HTTP request.
+        With a session cookie, a request without the cookie counts as an authentication handshake,
+        and its response sets the cookie.
+        :param method: the HTTP method
+        :param url: the request URL
+        :param body: the request body (bytes or None)
+        :param headers: the request headers
+        :return: a tuple of the status code, the response JSON and extra headers
+        """
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            status, response_body, response_headers = self._handle(method, url, body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if self.session_cookie is not None and \
+                self.session_cookie not in (headers or {}).get('Cookie', ''):
+            with self._lock:
+                self.handshakes += 1
+            response_headers = dict(response_headers, **{'Set-Cookie': self.session_cookie +
+                                                         '; Path=/; Secure; HttpOnly'})
+        return status, response_body, response_headers
+
+    def _handle(self, method, url, body):
+        with self._lock:
+            self.requests.append((method, urlparse(url).path.split('/_apis/', 1)[-1]))
+            if self._failures:
+                return self._failures.pop(0), {'message': 'Server error (injected)'}, {}
+            if self.throttle_rate is not None:
+                # Allow throttle_rate requests in every second
+                now = time.monotonic()
+                self._recent = [sent for sent in self._recent if now - sent < 1.0]
+                if len(self._recent) >= self.throttle_rate:
+                    self.throttled += 1
+                    return 429, {'message': 'Too Many Requests (throttled)'}, \
+                        {'Retry-After': str(self.retry_after)}
+                self._recent.append(now)
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 503, {'message': 'Service Unavailable (injected)'}, {}
+
+        data = json.loads(body) if body else None
+        try:
+            if re.search(r'_apis/wit/\$batch$', urlparse(url).path, re.IGNORECASE):
+                return 200, self._handle_batch(data), {}
+            return 200, self._route(method, url, data), {}
+        except SimulatorError as error:
+            return error.status, {'message': error.message}, {}
+
+    def _handle_batch(self, batch_requests):
+        if len(batch_requests) > SERVER_LIMIT:
+            raise SimulatorError(400, 'Too many requests in a batch')
+        results = ([])
+        for batch_request in batch_requests:
+            try:
+                body = self._route(batch_request['method'], batch_request['uri'],
+                                   batch_request.get('body'))
+                results.append({'code': 200, 'headers': {}, 'body': json.dumps(body)})
+            except SimulatorError as error:
+                results.append({'code': error.status, 'headers': {},
+                                'body': json.dumps({'value': {'Message': error.message}})})
+        return {'count': len(results), 'value': results}
+
+    def _route(self, method, url, data):
+        parsed_url = urlparse(url)
+        path = unquote(parsed_url.path)
+        query = {key: values[0] for key, values in parse_qs(parsed_url.query).items()}
+        with self._lock:
+            match = re.search(r'_apis/wit/workitems/(\d+)$', path, re.IGNORECASE)
+            if match and method == 'GET':
+                return self._render(self._get(int(match.group(1))), query)
+            if match and method == 'PATCH':
+                return self._render(self._update(int(match.group(1)), data), {})
+            match = re.search(r'_apis/wit/workitems/\$(.+)$', path, re.IGNORECASE)
+            if match and method in ('POST', 'PATCH'):
+                item_id = self._create(match.group(1), {})
+                return self._render(self._update(item_id, data, new=True), {})
+            if re.search(r'_apis/wit/classificationnodes$', path, re.IGNORECASE) and \
+                    method == 'GET':
+                nodes = [self.classification_nodes['area'],
+                         self.classification_nodes['iteration']]
+                return {'count': len(nodes), 'value': json.loads(json.dumps(nodes))}
+            if re.search(r'_apis/wit/wiql$', path, re.IGNORECASE) and method == 'POST':
+                return self._query(data['query'], query)
+            if re.search(r'_apis/wit/workitems$', path, re.IGNORECASE) and method == 'GET':
+                item_ids = [int(item_id) for item_id in query['ids'].split(',')]
+                if len(item_ids) > SERVER_LIMIT:
+                    raise SimulatorError(400, 'Too many ids in a bulk read')
+                workitems = [self._render(self._get(item_id), query) for item_id in item_ids]
+                return {'count': len(workitems), 'value': workitems}
+        raise SimulatorError(404, 'Unknown resource: {0} {1}'.format(method, path))
+
+    def _query(self, query, params):
+        """
+        Runs the WIQL queries the client uses
+        """
+        match = re.search(r'FROM WorkItemLinks WHERE \[Source\]\.\[System\.Id\] = (\d+)', query,
+                          re.IGNORECASE)
+        if match:
+            root_id = int(match.group(1))
+            self._get(root_id)
+            relations = [{'rel': None, 'source': None,
+                          'target': {'id': root_id, 'url': self.get_url(root_id)}}]
+            level = [root_id]
+            while level:
+                next_level = ([])
+                for source_id in level:
+                    for relation in self.workitems[source_id]['relations']:
+                        if relation['rel'] == 'System.LinkTypes.Hierarchy-Forward':
+                            target_id = int(relation['url'].split('/')[-1])
+                            relations.append({'rel': relation['rel'],
+                                              'source': {'id': source_id,
+                                                         'url': self.get_url(source_id)},
+                                              'target': {'id': target_id,
+                                                         'url': self.get_url(target_id)}})
+                            next_level.append(target_id)
+                level = next_level
+            return {'queryType': 'tree', 'workItemRelations': relations}
+        if re.search(r'FROM WorkItems\b', query, re.IGNORECASE):
+            # Flat queries of [Field] = 'value', [System.ChangedDate] >= 'date' and
+            # [System.Id] > id conditions, in the ID order (or in the change order)
+            conditions = re.findall(r"\[([\w.]+)\]\s*=\s*'([^']*)'", query)
+            changed_since = re.search(r"\[System\.ChangedDate\]\s*>=\s*'([^']*)'", query)
+            after_id = re.search(r"\[System\.Id\]\s*>\s*(\d+)", query)
+            item_ids = [item_id for item_id, workitem in sorted(self.workitems.items())
+                        if all(str(workitem['fields'].get(name)) == value
+                               for name, value in conditions) and
+                        (changed_since is None or
+                         workitem['fields']['System.ChangedDate'] >= changed_since.group(1)) and
+                        (after_id is None or item_id > int(after_id.group(1)))]
+            if re.search(r'ORDER BY \[System\.ChangedDate\]', query, re.IGNORECASE):
+                item_ids.sort(key=lambda item_id:
+                              self.workitems[item_id]['fields']['System.ChangedDate'])
+            if '$top' in params:
+                item_ids = item_ids[:int(params['$top'])]
+            if len(item_ids) > self.wiql_limit:
+                raise SimulatorError(400, 'The query exceeds the size limit of '
+                                          '{0} results'.format(self.wiql_limit))
+            return {'queryType': 'flat',
+                    'workItems': [{'id': item_id, 'url': self.get_url(item_id)}
+                                  for item_id in item_ids]}
+        raise SimulatorError(400, 'Unsupported query: {0}'.format(query))
+
+    def _get(self, item_id):
+        if item_id not in self.workitems:
+            raise SimulatorError(404, 'Work item {0} does not exist'.format(item_id))
+        if item_id in self.fail_ids:
+            raise SimulatorError(self.fail_status,
+                                 'Work item {0} failed (injected)'.format(item_id))
+        return self.workitems[item_id]
+
+    def _create(self, workitem_type, fields):
+        self._next_id += 1
+        item_id = self._next_id
+        self.workitems[item_id] = {
+            'id': item_id,
+            'rev': 1,
+            'fields': dict({'System.Id': item_id,
+                            'System.WorkItemType': workitem_type,
+                            'System.TeamProject': CREDENTIALS['project'],
+                            'System.State': 'New',
+                            'System.AreaId': 1,
+                            'System.IterationId': 2}, **fields),
+            'relations': []}
+        self._touch(self.workitems[item_id])
+        return item_id
+
+    def _touch(self, workitem):
+        """
+        Sets the change date of a changed work item, a millisecond after the last change
+        """
+        self._clock += timedelta(milliseconds=1)
+        workitem['fields']['System.ChangedDate'] = \
+            self._clock.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+    def _update(self, item_id, operations, new=False):
+        workitem = self._get(item_id)
+        for operation in operations:
+            if operation['op'] == 'test' and operation['path'] == '/rev' and \
+                    operation['value'] != workitem['rev']:
+                raise SimulatorError(412, 'Work item {0} was changed (rev {1})'.format(
+                    item_id, workitem['rev']))
+        for operation in operations:
+            if operation['op'] == 'test':
+                continue
+            target = operation['path'].split('/')
+            if target[1] == 'fields' and operation['op'] in ('add', 'replace'):
+                workitem['fields'][target[2]] = operation['value']
+            elif target[1] == 'fields' and operation['op'] == 'remove':
+                workitem['fields'].pop(target[2], None)
+            elif target[1] == 'relations' and operation['op'] == 'add':
+                self._add_relation(item_id, operation['value'])
+            elif target[1] == 'relations' and operation['op'] == 'remove':
+                self._remove_relation(item_id, int(target[2]))
+            else:
+                raise SimulatorError(400, 'Unsupported operation {0}'.format(operation))
+        if not new:
+            workitem['rev'] += 1
+        self._touch(workitem)
+        return workitem
+
+    def _add_relation(self, item_id, relation):
+        target_id = int(relation['url'].rstrip('/').split('/')[-1])
+        target = self._get(target_id)
+        self.workitems[item_id]['relations'].append({'rel': relation['rel'],
+                                                     'url': self.get_url(target_id)})
+        if relation['rel'] in REVERSE_LINKS:
+            target['relations'].append({'rel': REVERSE_LINKS[relation['rel']],
+                                        'url': self.get_url(item_id)})
+            target['rev'] += 1
+            self._touch(target)
+
+    def _remove_relation(self, item_id, index):
+        relations = self.workitems[item_id]['relations']
+        if index >= len(relations):
+            raise SimulatorError(400, 'Relation {0} does not exist'.format(index))
+        relation = relations.pop(index)
+        target = self.workitems.get(int(relation['url'].split('/')[-1]))
+        if target is not None and relation['rel'] in REVERSE_LINKS:
+            reverse = {'rel': REVERSE_LINKS[relation['rel']], 'url': self.get_url(item_id)}
+            if reverse in target['relations']:
+                target['relations'].remove(reverse)
+                target['rev'] += 1
+                self._touch(target)
+
+    def _render(self, workitem, query):
+        """
+        Builds the JSON of a work item, with the fields and expand options of the request
+        """
+        fields = query.get('fields')
+        expand = query.get('$expand', 'none').lower()
+        if fields and expand != 'none':
+            raise SimulatorError(400, 'The expand parameter can not be used with the fields '
+                                      'parameter')
+        raw = {'id': workitem['id'],
+               'rev': workitem['rev'],
+               'fields': dict(workitem['fields']),
+               'url': self.get_url(workitem['id'])}
+        if fields:
+            raw['fields'] = {name: value for name, value in workitem['fields'].items()
+                             if name in fields.split(',')}
+        if workitem['relations'] and (expand in ('all', 'relations') or not query):
+            raw['relations'] = [dict(relation) for relation in workitem['relations']]
+        return json.loads(json.dumps(raw))
+
+
+class SimulatorAdapter(BaseAdapter):
+    """
+    A requests transport adapter that sends the requests to a TFSSimulator
+    """
+    def __init__(self, simulator):
+        super().__init__()
+        self.simulator = simulator
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        status, body, headers = self.simulator.handle(request.method, request.url, request.body,
+                                                      request.headers)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = 'OK' if status < 400 else 'Error'
+        response.headers = CaseInsensitiveDict(
+            dict({'Content-Type': 'application/json; charset=utf-8; api-version=4.1'},
+                 **headers))
+        response._content = json.dumps(body).encode('utf-8')  # pylint: disable=protected-access
+        response.raw = io.BytesIO(response.content)
+        response.encoding = 'utf-8'
+        response.url = request.url
+        if 'Set-Cookie' in headers:
+            name, value = headers['Set-Cookie'].split(';')[0].split('=', 1)
+            response.cookies.set(name, value, domain=urlparse(request.url).hostname, path='/')
+        response.request = request
+        return response
+
+    def close(self):
+        pass
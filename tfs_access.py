@@ -3,15 +3,75 @@ The program handles managing work items in TFS.
 It uses Dohq package(https://devopshq.github.io/tfs/examples.html)
 """
 
+import argparse
 import os
 import signal
+import sys
 from time import sleep
-from tfs_connect import tfs
+from tfs_connect import instrumentation
+from tfs_connect import journal
 from credentials import handle_credentials
-from operations import manage_tasks
 from operations import manage_operations
 from watchdog import watchdog
 
+# The modules that use the network (tfs_connect.tfs, tfs_connect.async_tfs,
+# operations.manage_tasks and operations.manage_batch) import requests, requests_ntlm
+# and the TFS package, so they are imported only by the first operation that needs them
+
+# The operations that add the tasks of a PBI type
+TASK_OPERATIONS = ("RegularTasks", "CleanupTasks", "GoingLiveTasks", "E2ETasks",
+                   "ExploratoryTasks")
+
+# The operations that only ask the user (and don't run against the server)
+USER_OPERATIONS = ("UpdateCredentials", "EndProgram")
+
+# Read the work items from a local mirror (see --mirror)
+USE_MIRROR = False
+
+# Save the authenticated session for the next runs (see --session-cache)
+USE_SESSION_CACHE = False
+
+
+def get_connection(user_credentials):
+    """
+    The function gets the TFS connection of the credentials.
+    With the session cache, the session saved by an earlier run is reused.
+    With the mirror, the mirror is synced first if it is not fresh.
+    The operations run on the asyncio engine, through its blocking facade.
+    :param user_credentials: the credentials
+    :return: a SyncTFSConnection object (with the TFSConnection interface)
+    """
+    from tfs_connect import tfs  # pylint: disable=import-outside-toplevel
+    from tfs_connect import async_tfs  # pylint: disable=import-outside-toplevel
+    from tfs_connect import session_cache  # pylint: disable=import-outside-toplevel
+    from tfs_connect import mirror  # pylint: disable=import-outside-toplevel
+
+    workitem_mirror = None
+    if USE_MIRROR and not tfs.has_connection(user_credentials):
+        workitem_mirror = mirror.WorkitemMirror(mirror.MIRROR_PATH)
+    saved_session = None
+    if USE_SESSION_CACHE:
+        saved_session = session_cache.SessionCache(handle_credentials.CREDENTIALS_PATH['session'])
+    tfs_instance = tfs.get_connection(user_credentials, session_cache=saved_session,
+                                      workitem_mirror=workitem_mirror)
+
+    if tfs_instance.mirror is not None and not tfs_instance.mirror.is_fresh():
+        try:
+            count = tfs_instance.sync_mirror()
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"Can't sync the mirror, reading from the server: {error}", file=sys.stderr)
+        else:
+            print(f"The mirror was synced ({count} changed work items)", file=sys.stderr)
+    return async_tfs.get_sync_connection(tfs_instance)
+
+
+def is_interactive():
+    """
+    The function checks if the program is used by a user (and not by a script)
+    :return: True/False
+    """
+    return sys.stdin.isatty() and sys.stdout.isatty()
+
 
 def continue_program():
     """
@@ -47,9 +107,11 @@ def get_operation(operations):
 
 def print_welcome_message():
     """
-    The function prints the welcome message
+    The function prints the welcome message (only to a user)
     :return: None
     """
+    if not is_interactive():
+        return
     print()
     print("Hello! And welcome to the...")
     sleep(0.5)
@@ -63,52 +125,253 @@ def print_welcome_message():
     print(r"                                                                                    ")
 
 
-def activate_operation(selected_operation, tfs_instance, user_credentials):
+def get_operation_arguments(selected_operation):
+    """
+    The function asks the user for the work items of an operation, before the operation runs,
+    so the watchdog still closes the program while a prompt is idle
+    :param selected_operation: an object of operation
+    :return: a dictionary of the operation arguments (the work item IDs)
+    """
+    from operations import get_objects  # pylint: disable=import-outside-toplevel
+
+    if selected_operation.name in TASK_OPERATIONS or selected_operation.name == "RemovePBITasks":
+        return {"pbi_id": get_objects.get_item_id()}
+    if selected_operation.name in ("CloneTasks", "CloneTasksToMany"):
+        print("You need to specify the source PBI ID")
+        source_pbi_id = get_objects.get_item_id()
+        if selected_operation.name == "CloneTasks":
+            print("You need to specify the target PBI ID")
+            return {"source_pbi_id": source_pbi_id, "target_pbi_id": get_objects.get_item_id()}
+        print("You need to specify the target PBIs IDs")
+        return {"source_pbi_id": source_pbi_id, "target_pbi_ids": get_objects.get_item_ids()}
+    if selected_operation.name in ("CreateCleanupFromPBI", "CreateCleanupFromFeature"):
+        print("Please enter the original PBI ID")
+        return {"original_pbi_id": get_objects.get_item_id()}
+    if selected_operation.name == "RemoveTask":
+        return {"task_id": get_objects.get_item_id()}
+    return {}
+
+
+def activate_operation(selected_operation, tfs_instance, user_credentials, arguments=None):
     """
     The function activated an operation based on "selected operation"
     :param selected_operation: an object of operation
     :param tfs_instance: the tfs instance
     :param user_credentials: the credentials
+    :param arguments: the operation arguments (see get_operation_arguments)
+    :return:
+    """
+    with instrumentation.operation(selected_operation.name):
+        run_operation(selected_operation, tfs_instance, user_credentials, arguments)
+
+
+def run_operation(selected_operation, tfs_instance, user_credentials, arguments=None):
+    """
+    The function runs the operation of "selected operation"
+    :param selected_operation: an object of operation
+    :param tfs_instance: the tfs instance
+    :param user_credentials: the credentials
+    :param arguments: the operation arguments (see get_operation_arguments),
+                      the operation asks for the missing ones
     :return:
     """
-    if selected_operation.name == "RegularTasks" \
-            or selected_operation.name == "CleanupTasks" \
-            or selected_operation.name == "GoingLiveTasks" \
-            or selected_operation.name == "E2ETasks" \
-            or selected_operation.name == "ExploratoryTasks":
+    from operations import manage_tasks  # pylint: disable=import-outside-toplevel
+
+    arguments = arguments or {}
+    if selected_operation.name in TASK_OPERATIONS:
         manage_tasks.add_tasks_to_pbi(tfs_instance, user_credentials,
-                                      pbi_type=selected_operation.name)
+                                      pbi_type=selected_operation.name, **arguments)
     elif selected_operation.name == "CloneTasks":
-        manage_tasks.clone_pbi_tasks(tfs_instance)
+        manage_tasks.clone_pbi_tasks(tfs_instance, **arguments)
+    elif selected_operation.name == "CloneTasksToMany":
+        manage_tasks.clone_pbi_tasks_to_many(tfs_instance, **arguments)
     elif selected_operation.name == "CreateCleanupFromPBI" \
             or selected_operation.name == "CreateCleanupFromFeature":
         manage_tasks.copy_pbi_to_cleanup(tfs_instance, user_credentials,
-                                         title_type=selected_operation.name)
+                                         title_type=selected_operation.name, **arguments)
     elif selected_operation.name == "RemovePBITasks":
-        manage_tasks.remove_pbi_with_tasks(tfs_instance, user_credentials)
+        manage_tasks.remove_pbi_with_tasks(tfs_instance, user_credentials, **arguments)
     elif selected_operation.name == "RemoveTask":
-        manage_tasks.remove_task_from_pbi(tfs_instance, user_credentials)
+        manage_tasks.remove_task_from_pbi(tfs_instance, user_credentials, **arguments)
     elif selected_operation.name == "UpdateCredentials":
         handle_credentials.add_new_credentials()
+        if "tfs_connect.async_tfs" in sys.modules:
+            sys.modules["tfs_connect.async_tfs"].close_sync_connections()
+        if "tfs_connect.tfs" in sys.modules:
+            sys.modules["tfs_connect.tfs"].close_connections()
     elif selected_operation.name == "EndProgram":
-        os.kill(os.getpid(), signal.SIGTERM)
+        end_program()
+
+
+def end_program():
+    """
+    The function reports the HTTP calls of the session and closes the program
+    :return: None
+    """
+    instrumentation.INSTRUMENTATION.report(sys.stderr)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def get_saved_credentials():
+    """
+    The function gets the saved credentials, without asking the user
+    :return: the credentials, or None if there are no valid saved credentials
+    """
+    try:
+        user_credentials = handle_credentials.get_credentials_from_file()
+    except handle_credentials.CredentialsError:
+        user_credentials = None
+    if user_credentials is None:
+        print("No valid credentials were found. Run the program interactively first",
+              file=sys.stderr)
+    return user_credentials
+
+
+def run_batch_mode(batch_path, dry_run=False):
+    """
+    The function runs the operations in a batch file without any user interaction
+    :param batch_path: a JSONL/CSV file path, or "-" for stdin
+    :param dry_run: plan the operations and print the number of requests, without writing
+    :return: the program exit code
+    """
+    from operations import manage_batch  # pylint: disable=import-outside-toplevel
+
+    user_credentials = get_saved_credentials()
+    if user_credentials is None:
+        return 2
+
+    tfs_instance = get_connection(user_credentials)
+    if batch_path == "-":
+        failed = manage_batch.run_batch(sys.stdin, sys.stdout, tfs_instance, user_credentials,
+                                        dry_run=dry_run)
+    else:
+        with open(batch_path, "r") as batch_file:
+            failed = manage_batch.run_batch(batch_file, sys.stdout,
+                                            tfs_instance, user_credentials, dry_run=dry_run)
+    return 1 if failed else 0
+
+
+def run_resume_mode():
+    """
+    The function sends again only the writes the journal has as unfinished (by a run that died)
+    :return: the program exit code
+    """
+    user_credentials = get_saved_credentials()
+    if user_credentials is None:
+        return 2
+
+    tfs_instance = get_connection(user_credentials)
+    with instrumentation.operation("Resume"):
+        results = tfs_instance.resume()
+    failed = [result for result in results if result['error'] is not None]
+    for result in failed:
+        print(f'Oops.. a write failed again: {result["error"]}', file=sys.stderr)
+    print(f'{len(results) - len(failed)} of {len(results)} unfinished writes were resumed',
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+def run_daemon_mode(port=None, socket_path=None):
+    """
+    The function serves operations to local tools until the program is interrupted
+    :param port: a localhost TCP port for HTTP requests
+    :param socket_path: a Unix socket path for JSONL requests (instead of the port)
+    :return: the program exit code
+    """
+    from operations import manage_daemon  # pylint: disable=import-outside-toplevel
+
+    user_credentials = get_saved_credentials()
+    if user_credentials is None:
+        return 2
+
+    tfs_instance = get_connection(user_credentials)
+    try:
+        server = manage_daemon.create_server(tfs_instance, user_credentials,
+                                             port=port, socket_path=socket_path)
+    except OSError as error:
+        print(f"Can't start the server: {error}", file=sys.stderr)
+        return 2
+    print(f"Serving operations on {socket_path or 'http://{0}:{1}'.format(*server.server_address)}"
+          f" (Ctrl+C to stop)", file=sys.stderr)
+    if server.token_path is not None:
+        print(f"The requests need the {manage_daemon.TOKEN_HEADER} header, "
+              f"with the token in {server.token_path}", file=sys.stderr)
+    manage_daemon.serve(server)
+    return 0
+
+
+def parse_arguments(arguments=None):
+    """
+    The function parses the command line arguments
+    :param arguments: a list of arguments, the program arguments by default
+    :return: the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Manage work items in TFS")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the operations in a JSONL/CSV file ('-' for stdin) "
+                             "and write a JSONL result per operation")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="with --batch, plan the task operations and print the number "
+                             "of requests they need, without writing")
+    parser.add_argument("--resume", action="store_true",
+                        help="send again only the unfinished writes of a run that died, "
+                             "as recorded in the journal")
+    parser.add_argument("--serve", metavar="PORT", type=int,
+                        help="serve operations as HTTP requests on a localhost port")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="serve operations as JSONL requests on a Unix socket")
+    parser.add_argument("--mirror", action="store_true",
+                        help="read the work items from a local mirror of the project, "
+                             "synced with the changes since the last run")
+    parser.add_argument("--session-cache", action="store_true",
+                        help="save the authenticated session next to the credentials, "
+                             "so the next runs skip the authentication handshake")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="export the HTTP metrics at exit, as JSON (.json) "
+                             "or as Prometheus text (any other extension)")
+    return parser.parse_args(arguments)
 
 
 def main():
     """
     The main program function
     """
+    global USE_MIRROR, USE_SESSION_CACHE  # pylint: disable=global-statement
+    arguments = parse_arguments()
+    instrumentation.INSTRUMENTATION.export_path = arguments.metrics
+    USE_MIRROR = arguments.mirror
+    USE_SESSION_CACHE = arguments.session_cache
+    if arguments.batch:
+        exit_code = run_batch_mode(arguments.batch, dry_run=arguments.dry_run)
+        instrumentation.INSTRUMENTATION.report(sys.stderr)
+        sys.exit(exit_code)
+    if arguments.serve is not None or arguments.socket:
+        exit_code = run_daemon_mode(port=arguments.serve, socket_path=arguments.socket)
+        instrumentation.INSTRUMENTATION.report(sys.stderr)
+        sys.exit(exit_code)
+    if arguments.resume:
+        exit_code = run_resume_mode()
+        instrumentation.INSTRUMENTATION.report(sys.stderr)
+        sys.exit(exit_code)
+
     # Initialize variables
     retry = True
     user_credentials = ""
     operations = ""
     watch_dog = watchdog.Watchdog()
-    watch_dog.start()
+    interactive = is_interactive()
+    if interactive:
+        watch_dog.start()
 
     print_welcome_message()
 
+    pending_count = journal.JOURNAL.get_pending_count()
+    if pending_count:
+        print(f"The last run has {pending_count} unfinished writes. Run with --resume to send them")
+
     while retry:
-        sleep(1)
+        if interactive:
+            sleep(1)
         print("What would you like to do?")
         print()
 
@@ -127,8 +390,17 @@ def main():
         selected_operation_id = get_operation(operations)
         watch_dog.refresh()
 
-        tfs_instance = tfs.TFSConnection(user_credentials)
-        activate_operation(selected_operation_id, tfs_instance, user_credentials)
+        # The prompts come before the operation runs, so an idle prompt still expires
+        arguments = get_operation_arguments(selected_operation_id)
+        watch_dog.refresh()
+
+        tfs_instance = get_connection(user_credentials)
+        if selected_operation_id.name in USER_OPERATIONS:
+            activate_operation(selected_operation_id, tfs_instance, user_credentials)
+        else:
+            with watch_dog.busy():
+                activate_operation(selected_operation_id, tfs_instance, user_credentials,
+                                   arguments)
 
         # check if need to continue
         if continue_program():
@@ -138,7 +410,7 @@ def main():
             retry = False
             watch_dog.refresh()
             continue
-    os.kill(os.getpid(), signal.SIGTERM)
+    end_program()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,281 @@
+"""
+The module provides an asyncio counterpart of the TFS connection.
+Coroutines can be fanned out freely (e.g. a read per work item, or a request per chunk),
+while the blocking HTTP calls are multiplexed over a bounded pool of threads:
+the dohq client and NTLM block, and NTLM authenticates a single keep-alive connection,
+which the available asyncio HTTP clients can't guarantee. So the requests in flight are
+bounded by the keep-alive pool of the connection (see tfs.POOL_SIZE), and not by a thread
+per coroutine.
+The program runs the operations through SyncTFSConnection, a blocking facade with the
+TFSConnection interface, so manage_tasks (and the interactive menu) run on the engine as is.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tfs_connect import tfs
+
+# The maximal number of blocking HTTP calls in flight at once
+DEFAULT_MAX_CONCURRENCY = tfs.POOL_SIZE
+
+
+class AsyncTFSConnection:
+    """
+    this class represents an asyncio TFS connection.
+    It wraps a TFSConnection and exposes its work item operations as coroutines
+    """
+    def __init__(self, tfs_connection, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.tfs_connection = tfs_connection
+        self.max_concurrency = max_concurrency
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency,
+                                        thread_name_prefix="tfs-async")
+        self._semaphores = {}
+
+    async def get_workitem(self, item_id, fields=None, expand=None):
+        """
+        The function gets a single work item
+        :param item_id: the work item ID
+        :param fields: an optional list of the field names to read
+        :param expand: an optional expand mode (see TFSConnection.get_workitems)
+        :return: a TFS work item object
+        """
+        return (await self.get_workitems([item_id], fields=fields, expand=expand))[0]
+
+    async def get_workitems(self, item_ids, fields=None, expand=None):
+        """
+        The function gets several work items, the bulk read chunks are read concurrently
+        :param item_ids: a list of work item IDs
+        :param fields: an optional list of the field names to read
+        :param expand: an optional expand mode (see TFSConnection.get_workitems)
+        :return: a list of TFS work item objects, in the given order
+        """
+        item_ids = list(item_ids)
+        chunks = await asyncio.gather(*[
+            self._call(self.tfs_connection.get_workitems,
+                       item_ids[start:start + tfs.BULK_READ_LIMIT], fields=fields, expand=expand)
+            for start in range(0, len(item_ids), tfs.BULK_READ_LIMIT)])
+        return [workitem for chunk in chunks for workitem in chunk]
+
+    async def add_workitem(self, item_fields, parent_item_id=None, workitem_type="Task"):
+        """
+        The function adds a work item
+        :param item_fields: the item fields, a dictionary
+        :param parent_item_id: indicates if the item should be the child of a parent item
+        :param workitem_type: Task or PBI
+        :return: the new work item ID
+        """
+        return await self._call(self.tfs_connection.add_workitem, item_fields,
+                                parent_item_id=parent_item_id, workitem_type=workitem_type)
+
+    async def update_workitem(self, item_id, update_data):
+        """
+        The function updates a work item with a JSON-patch
+        :param item_id: the work item ID
+        :param update_data: a list of JSON-patch operations
+        :return: the raw updated work item
+        """
+        return await self._call(self.tfs_connection.update_workitem, item_id, update_data)
+
+    async def add_relations(self, item_id, relations):
+        """
+        The function adds relations to a work item
+        :param item_id: the work item ID
+        :param relations: a list of relation dictionaries (rel, url)
+        :return: the raw updated work item
+        """
+        return await self._call(self.tfs_connection.add_relations, item_id, relations)
+
+    async def update_workitems(self, updates):
+        """
+        The function updates several work items, the $batch chunks are sent concurrently
+        :param updates: a list of (work item ID, list of JSON-patch operations) tuples
+        :return: a list with a result dictionary per update, in the given order
+        """
+        _, results = await self.apply_writes([], updates)
+        return results
+
+    async def apply_writes(self, creates, updates):
+        """
+        The function sends work item creations and updates together,
+        the $batch chunks are sent concurrently
+        :param creates: a list of (work item type, parent item ID or None, JSON-patch) tuples
+        :param updates: a list of (work item ID, JSON-patch) tuples, a single update per item
+        :return: a tuple of the creations results and the updates results, in the given orders
+        """
+        writes = [(True, create) for create in creates] + [(False, update) for update in updates]
+        chunks = [writes[start:start + tfs.BATCH_LIMIT]
+                  for start in range(0, len(writes), tfs.BATCH_LIMIT)]
+        chunk_results = await asyncio.gather(*[
+            self._call(self.tfs_connection.apply_writes,
+                       [write for is_create, write in chunk if is_create],
+                       [write for is_create, write in chunk if not is_create])
+            for chunk in chunks])
+        create_results = [result for chunk_creates, _ in chunk_results for result in chunk_creates]
+        update_results = [result for _, chunk_updates in chunk_results for result in chunk_updates]
+        return create_results, update_results
+
+    async def run_wiql(self, query, top=None):
+        """
+        The function runs a WIQL query
+        :param query: the WIQL query
+        :param top: an optional maximal number of results
+        :return: the raw query result
+        """
+        return await self._call(self.tfs_connection.run_wiql, query, top=top)
+
+    async def get_classification(self):
+        """
+        The function gets the index of the project areas and iterations
+        :return: a ClassificationIndex object
+        """
+        return await self._call(self.tfs_connection.get_classification)
+
+    async def _call(self, func, *args, **kwargs):
+        """
+        Runs a blocking TFS call without blocking the event loop
+        :return: the call result
+        """
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(
+                contextvars.copy_context().run, func, *args, **kwargs))
+
+    def _get_semaphore(self):
+        """
+        A semaphore is bound to its event loop, so every loop gets its own
+        :return: the semaphore of the running loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    def close(self):
+        """
+        Stops the worker threads
+        :return: None
+        """
+        self._pool.shutdown(wait=True)
+
+
+class SyncTFSConnection:
+    """
+    A blocking facade over an AsyncTFSConnection.
+    It has the same interface as TFSConnection, so the operations in manage_tasks
+    (and the interactive menu) run on the asyncio engine as is.
+    The rest of the TFSConnection attributes (e.g. resume, sync_mirror) are passed through.
+    """
+    def __init__(self, async_connection):
+        self.async_connection = async_connection
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name="tfs-event-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the facade event loop and waits for its result
+        :param coroutine: the coroutine to run
+        :return: the coroutine result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def get_workitem(self, item_id, fields=None, expand=None):
+        """
+        See AsyncTFSConnection.get_workitem
+        """
+        return self.run(self.async_connection.get_workitem(item_id, fields=fields, expand=expand))
+
+    def get_workitems(self, item_ids, fields=None, expand=None):
+        """
+        See AsyncTFSConnection.get_workitems
+        """
+        return self.run(self.async_connection.get_workitems(item_ids, fields=fields,
+                                                            expand=expand))
+
+    def add_workitem(self, item_fields, parent_item_id=None, workitem_type="Task"):
+        """
+        See AsyncTFSConnection.add_workitem
+        """
+        return self.run(self.async_connection.add_workitem(item_fields, parent_item_id,
+                                                           workitem_type))
+
+    def update_workitem(self, item_id, update_data):
+        """
+        See AsyncTFSConnection.update_workitem
+        """
+        return self.run(self.async_connection.update_workitem(item_id, update_data))
+
+    def add_relations(self, item_id, relations):
+        """
+        See AsyncTFSConnection.add_relations
+        """
+        return self.run(self.async_connection.add_relations(item_id, relations))
+
+    def update_workitems(self, updates):
+        """
+        See AsyncTFSConnection.update_workitems
+        """
+        return self.run(self.async_connection.update_workitems(updates))
+
+    def apply_writes(self, creates, updates):
+        """
+        See AsyncTFSConnection.apply_writes
+        """
+        return self.run(self.async_connection.apply_writes(creates, updates))
+
+    def run_wiql(self, query, top=None):
+        """
+        See AsyncTFSConnection.run_wiql
+        """
+        return self.run(self.async_connection.run_wiql(query, top=top))
+
+    def get_classification(self):
+        """
+        See AsyncTFSConnection.get_classification
+        """
+        return self.run(self.async_connection.get_classification())
+
+    def close(self):
+        """
+        Stops the facade event loop and the engine threads
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self.async_connection.close()
+
+    def __getattr__(self, name):
+        return getattr(self.async_connection.tfs_connection, name)
+
+
+_FACADES = {}
+_FACADES_LOCK = threading.Lock()
+
+
+def get_sync_connection(tfs_connection):
+    """
+    Get the facade of a connection over the asyncio engine.
+    The facade (and its event loop) is created once per connection.
+    :param tfs_connection: a TFSConnection object
+    :return: a SyncTFSConnection object
+    """
+    with _FACADES_LOCK:
+        facade = _FACADES.get(id(tfs_connection))
+        if facade is None or facade.async_connection.tfs_connection is not tfs_connection:
+            facade = SyncTFSConnection(AsyncTFSConnection(tfs_connection))
+            _FACADES[id(tfs_connection)] = facade
+        return facade
+
+
+def close_sync_connections():
+    """
+    Closes all of the facades (the connections themselves are closed by tfs.close_connections)
+    :return: None
+    """
+    with _FACADES_LOCK:
+        for facade in _FACADES.values():
+            facade.close()
+        _FACADES.clear()
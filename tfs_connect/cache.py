@@ -0,0 +1,134 @@
+"""
+The module keeps recently read work items, so repeated reads don't go to the server.
+A full item (all of its fields and relations) serves any read of it, and an item read with
+a fields projection serves the reads of the same fields (or some of them).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_TTL = 300
+
+
+class WorkitemCache:
+    """
+    A bounded LRU cache of work items, keyed by ID and tagged with the item revision
+    and its fields projection.
+    Entries expire after ttl seconds, and an entry is never replaced by an older revision
+    (or by a narrower projection of the same revision).
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, item_id, fields=None):
+        """
+        Get a cached work item
+        :param item_id: the work item ID
+        :param fields: the field names the read needs, or None for the full item
+        :return: the work item, or None if it is not cached (or expired, or missing some fields)
+        """
+        item_id = int(item_id)
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if entry is None or time.monotonic() - entry['time'] > self.ttl:
+                self._entries.pop(item_id, None)
+                self.misses += 1
+                return None
+            if not _covers(entry['fields'], fields):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(item_id)
+            self.hits += 1
+            return entry['workitem']
+
+    def put(self, workitem, fields=None):
+        """
+        Caches a work item, unless a newer revision of it (or a wider projection) is cached
+        :param workitem: a TFS work item object
+        :param fields: the field names the item was read with, or None for a full item
+        :return: None
+        """
+        item_id = int(workitem.id)
+        rev = workitem.data.get('rev', 0)
+        fields = _get_field_set(fields)
+        with self._lock:
+            entry = self._entries.get(item_id)
+            if entry is not None and (entry['rev'] > rev or
+                                      entry['rev'] == rev and _covers(entry['fields'], fields)):
+                return
+            self._entries[item_id] = {'workitem': workitem, 'rev': rev, 'fields': fields,
+                                      'time': time.monotonic()}
+            self._entries.move_to_end(item_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def peek(self, item_id):
+        """
+        Get a cached full work item without counting a hit or a miss
+        :param item_id: the work item ID
+        :return: the work item, or None if it is not cached (or cached only as a projection)
+        """
+        with self._lock:
+            entry = self._entries.get(int(item_id))
+            return entry['workitem'] if entry is not None and entry['fields'] is None else None
+
+    def invalidate(self, *item_ids):
+        """
+        Removes work items from the cache
+        :param item_ids: the work item IDs
+        :return: None
+        """
+        with self._lock:
+            for item_id in item_ids:
+                self._entries.pop(int(item_id), None)
+
+    def clear(self):
+        """
+        Removes all of the work items from the cache
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def reset_stats(self):
+        """
+        Resets the hits and misses counters
+        :return: None
+        """
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return: a dictionary with the cache hits, misses and size
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+def _get_field_set(fields):
+    """
+    :param fields: a list of field names, or None
+    :return: a frozenset of the lower case field names (TFS field names are case insensitive),
+             or None
+    """
+    return None if fields is None else frozenset(field.lower() for field in fields)
+
+
+def _covers(cached_fields, fields):
+    """
+    :param cached_fields: the field names of a cached item (a set), or None for a full item
+    :param fields: the field names a read needs, or None for the full item
+    :return: True if the cached item has all of the fields the read needs
+    """
+    if cached_fields is None:
+        return True
+    return fields is not None and _get_field_set(fields) <= cached_fields
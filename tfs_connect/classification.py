@@ -0,0 +1,108 @@
+"""
+The module keeps an index of the project classification nodes: the area and the iteration trees.
+The trees are read by a single request, and read again once they are older than the TTL.
+A node is found by its ID or by its path in O(1), and the iterations are ordered by their dates,
+so the next iteration of a work item is the one that starts after its own.
+"""
+
+import threading
+import time
+from tfs_connect import mirror
+
+DEFAULT_TTL = 3600
+
+# The depth of the trees that are read (the project root is at depth 0)
+DEPTH = 20
+
+AREA = "area"
+ITERATION = "iteration"
+
+
+class ClassificationIndex:
+    """
+    The area and iteration nodes of a project, by ID and by path.
+    A node is a dictionary with its "id", "name", "path", "type" ("area" or "iteration"),
+    "parent_id", and the "start_date" and "finish_date" of an iteration (None if not set)
+    """
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._nodes = {}
+        self._paths = {}
+        self._iterations = []
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_expired(self):
+        """
+        :return: True if the index was never loaded, or it is older than the TTL
+        """
+        with self._lock:
+            return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def load(self, raw_nodes):
+        """
+        Replaces the index with the given trees
+        :param raw_nodes: a list of the raw root nodes, with their children
+                          (the classificationnodes response value)
+        :return: None
+        """
+        nodes = {}
+        pending = [(raw_node, None, None) for raw_node in raw_nodes]
+        while pending:
+            raw_node, parent_id, parent_path = pending.pop()
+            path = raw_node['name'] if parent_path is None else \
+                parent_path + "\\" + raw_node['name']
+            attributes = raw_node.get('attributes') or {}
+            node = {'id': raw_node['id'],
+                    'name': raw_node['name'],
+                    'path': path,
+                    'type': raw_node['structureType'].lower(),
+                    'parent_id': parent_id,
+                    'start_date': mirror.parse_date(attributes.get('startDate')),
+                    'finish_date': mirror.parse_date(attributes.get('finishDate'))}
+            nodes[node['id']] = node
+            pending.extend((child, node['id'], path) for child in raw_node.get('children') or [])
+
+        iterations = sorted((node for node in nodes.values()
+                             if node['type'] == ITERATION and node['start_date'] is not None),
+                            key=lambda node: (node['start_date'], node['path']))
+        with self._lock:
+            self._nodes = nodes
+            self._paths = {(node['type'], node['path'].lower()): node for node in nodes.values()}
+            self._iterations = iterations
+            self._loaded_at = time.monotonic()
+
+    def get_node(self, node_id):
+        """
+        :param node_id: a node ID (e.g. a System.AreaId or a System.IterationId)
+        :return: the node, or None if it doesn't exist
+        """
+        return self._nodes.get(int(node_id))
+
+    def get_node_by_path(self, path, structure_type):
+        """
+        :param path: a node path (e.g. a System.AreaPath), case insensitive
+        :param structure_type: AREA or ITERATION
+        :return: the node, or None if it doesn't exist
+        """
+        return self._paths.get((structure_type, path.strip("\\").lower()))
+
+    def get_next_iteration(self, path):
+        """
+        Get the iteration that starts after a given iteration, at the same level if there is one
+        (e.g. the next sprint of a sprint, rather than the release that starts with it).
+        An iteration without dates is dated by its nearest dated parent.
+        :param path: an iteration path (e.g. a System.IterationPath)
+        :return: the next iteration node, or None if the iteration (or its dates) is unknown,
+                 or there is no later iteration
+        """
+        node = self.get_node_by_path(path, ITERATION)
+        while node is not None and node['start_date'] is None:
+            node = self._nodes.get(node['parent_id'])
+        if node is None:
+            return None
+        later = [iteration for iteration in self._iterations
+                 if iteration['start_date'] > node['start_date']]
+        depth = node['path'].count("\\")
+        return next((iteration for iteration in later if iteration['path'].count("\\") == depth),
+                    later[0] if later else None)
@@ -0,0 +1,277 @@
+"""
+The module records every HTTP call to the TFS server: the count, the bytes and a latency histogram
+per operation (the OperationType name) and endpoint.
+The hits and misses of the work item caches are reported with them, so the round-trips
+the cache saves can be measured.
+The metrics can be printed as a summary, or exported as Prometheus text or JSON.
+"""
+
+import contextlib
+import contextvars
+import json
+import re
+import threading
+import weakref
+from urllib.parse import unquote
+from urllib.parse import urlparse
+
+# The latency histogram buckets upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_OPERATION = contextvars.ContextVar("operation", default="none")
+
+
+@contextlib.contextmanager
+def operation(name):
+    """
+    Tags all of the HTTP calls made inside the context (and by its executor workers)
+    with an operation name
+    :param name: the operation name
+    """
+    token = _OPERATION.set(name)
+    try:
+        yield
+    finally:
+        _OPERATION.reset(token)
+
+
+def get_endpoint(url):
+    """
+    Translates a request URL to its endpoint, without the IDs and the query
+    :param url: the request URL
+    :return: the endpoint, e.g. "wit/workitems/{id}"
+    """
+    path = unquote(urlparse(url).path)
+    path = path.split("/_apis/", 1)[-1]
+    path = re.sub(r"/\d+(?=/|$)", "/{id}", path.lower())
+    return re.sub(r"workitems/\$[^/]+$", "workitems/${type}", path)
+
+
+class CallMetrics:
+    """
+    The metrics of a single (operation, method, endpoint) combination
+    """
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, latency, request_bytes, response_bytes, error):
+        """
+        Adds a single call to the metrics
+        :return: None
+        """
+        self.count += 1
+        self.errors += int(error)
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.latency_sum += latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def get_percentile(self, percentile):
+        """
+        Estimates a latency percentile by the histogram bucket it falls in
+        :param percentile: a number between 0 and 100
+        :return: the bucket upper bound in seconds (None for the +Inf bucket)
+        """
+        rank = self.count * percentile / 100.0
+        total = 0
+        for index, bucket_count in enumerate(self.buckets):
+            total += bucket_count
+            if total >= rank and bucket_count:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+        return None
+
+    def to_dict(self):
+        """
+        :return: the metrics as a dictionary
+        """
+        return {"count": self.count,
+                "errors": self.errors,
+                "request_bytes": self.request_bytes,
+                "response_bytes": self.response_bytes,
+                "latency_seconds_sum": round(self.latency_sum, 6),
+                "latency_buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                                            self.buckets))}
+
+
+class Instrumentation:
+    """
+    Collects the metrics of the HTTP calls of all of the TFS connections it is installed on
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.export_path = None
+        self._caches = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        """
+        Starts recording the calls of a requests session
+        :param session: a requests session
+        :return: None
+        """
+        if self.record_response not in session.hooks["response"]:
+            session.hooks["response"].append(self.record_response)
+
+    def install_cache(self, workitem_cache):
+        """
+        Starts reporting the hits and misses of a work item cache
+        :param workitem_cache: a WorkitemCache object
+        :return: None
+        """
+        with self._lock:
+            self._caches.add(workitem_cache)
+
+    def get_cache_stats(self):
+        """
+        :return: a dictionary of the hits, misses and size of all of the installed caches
+        """
+        with self._lock:
+            caches = list(self._caches)
+        total = {"hits": 0, "misses": 0, "size": 0}
+        for workitem_cache in caches:
+            for key, value in workitem_cache.stats().items():
+                total[key] += value
+        return total
+
+    def record_response(self, response, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        A requests response hook that records the call of the response
+        :param response: a requests response
+        :return: None (the response is not changed)
+        """
+        request = response.request
+        key = (_OPERATION.get(), request.method, get_endpoint(request.url))
+        request_bytes = len(request.body or b"")
+        response_bytes = len(response.content or b"")
+        with self._lock:
+            if key not in self.metrics:
+                self.metrics[key] = CallMetrics()
+            self.metrics[key].record(response.elapsed.total_seconds(), request_bytes,
+                                     response_bytes, response.status_code >= 400)
+
+    def reset(self):
+        """
+        Forgets all of the recorded calls and cache lookups
+        :return: None
+        """
+        with self._lock:
+            self.metrics = {}
+            caches = list(self._caches)
+        for workitem_cache in caches:
+            workitem_cache.reset_stats()
+
+    def get_summary(self):
+        """
+        :return: a printable summary table of the recorded calls
+        """
+        lines = ["{0:<26}{1:<7}{2:<32}{3:>6}{4:>7}{5:>11}{6:>10}{7:>10}".format(
+            "Operation", "Method", "Endpoint", "Calls", "Errors", "Bytes", "Avg (ms)", "p95 (ms)")]
+        with self._lock:
+            items = sorted(self.metrics.items())
+        for (operation_name, method, endpoint), metrics in items:
+            p95 = metrics.get_percentile(95)
+            lines.append("{0:<26}{1:<7}{2:<32}{3:>6}{4:>7}{5:>11}{6:>10.1f}{7:>10}".format(
+                operation_name, method, endpoint, metrics.count, metrics.errors,
+                metrics.request_bytes + metrics.response_bytes,
+                1000 * metrics.latency_sum / metrics.count,
+                "inf" if p95 is None else "<={0:g}".format(1000 * p95)))
+        cache_stats = self.get_cache_stats()
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        if lookups:
+            lines.append("Work item cache: {0} hits, {1} misses ({2:.0%} of the item reads "
+                         "were served without a request)".format(
+                             cache_stats["hits"], cache_stats["misses"],
+                             cache_stats["hits"] / lookups))
+        return "\n".join(lines)
+
+    def to_json(self):
+        """
+        :return: the recorded metrics as a JSON string
+        """
+        with self._lock:
+            items = sorted(self.metrics.items())
+        return json.dumps([dict({"operation": operation_name, "method": method,
+                                 "endpoint": endpoint}, **metrics.to_dict())
+                           for (operation_name, method, endpoint), metrics in items], indent=2)
+
+    def to_prometheus(self):
+        """
+        :return: the recorded metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            items = sorted(self.metrics.items())
+        labeled_items = [('operation="{0}",method="{1}",endpoint="{2}"'.format(*key), metrics)
+                         for key, metrics in items]
+
+        lines = ([])
+        counters = [("tfs_http_requests_total", "TFS HTTP requests", "count"),
+                    ("tfs_http_errors_total", "TFS HTTP requests that failed", "errors"),
+                    ("tfs_http_request_bytes_total", "TFS HTTP request body bytes",
+                     "request_bytes"),
+                    ("tfs_http_response_bytes_total", "TFS HTTP response body bytes",
+                     "response_bytes")]
+        for name, description, attribute in counters:
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} counter".format(name))
+            for labels, metrics in labeled_items:
+                lines.append("{0}{{{1}}} {2}".format(name, labels, getattr(metrics, attribute)))
+
+        name = "tfs_http_request_duration_seconds"
+        lines.append("# HELP {0} TFS HTTP request latency".format(name))
+        lines.append("# TYPE {0} histogram".format(name))
+        for labels, metrics in labeled_items:
+            cumulative = 0
+            for bound, bucket_count in zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                                           metrics.buckets):
+                cumulative += bucket_count
+                lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, bound,
+                                                                   cumulative))
+            lines.append("{0}_sum{{{1}}} {2}".format(name, labels, metrics.latency_sum))
+            lines.append("{0}_count{{{1}}} {2}".format(name, labels, metrics.count))
+
+        cache_stats = self.get_cache_stats()
+        for name, description, metric_type, key in [
+                ("tfs_cache_hits_total", "Work item reads served from the cache", "counter",
+                 "hits"),
+                ("tfs_cache_misses_total", "Work item reads the cache couldn't serve", "counter",
+                 "misses"),
+                ("tfs_cache_entries", "Work items in the cache", "gauge", "size")]:
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            lines.append("{0} {1}".format(name, cache_stats[key]))
+        return "\n".join(lines) + "\n"
+
+    def export(self, file_path):
+        """
+        Writes the recorded metrics to a file, as JSON (.json) or as Prometheus text (otherwise)
+        :param file_path: the file path
+        :return: None
+        """
+        with open(file_path, "w") as file:
+            file.write(self.to_json() if file_path.endswith(".json") else self.to_prometheus())
+
+    def report(self, stream):
+        """
+        Prints the summary of the recorded calls, and exports them to export_path (if set)
+        :param stream: a text stream for the summary
+        :return: None
+        """
+        cache_stats = self.get_cache_stats()
+        if not self.metrics and not cache_stats["hits"] + cache_stats["misses"]:
+            return
+        print(self.get_summary(), file=stream)
+        if self.export_path:
+            self.export(self.export_path)
+
+
+INSTRUMENTATION = Instrumentation()
@@ -0,0 +1,163 @@
+"""
+The module keeps a write-ahead journal of the work item writes.
+Every write is appended to the journal before it is sent and marked as done after it succeeded,
+so a run that died halfway can be resumed by sending only the unfinished writes.
+A write the server rejected (e.g. of a deleted work item) is marked as failed, since sending it
+again would fail again; only the writes that were never sent or failed transiently are resumed.
+The journal is an append-only JSONL file, and it is emptied once all of its writes are resolved.
+"""
+
+import json
+import os
+import threading
+import uuid
+
+JOURNAL_PATH = "./tfs_journal.jsonl"
+
+RESOLVED_STATES = ("done", "failed")
+
+# The client errors that may succeed if the write is sent again
+RETRYABLE_STATUSES = (408, 409, 429)
+
+
+def is_rejected(result):
+    """
+    :param result: a write result dictionary, with an "error" and the HTTP "status" of a failure
+                   (None if the write wasn't answered, e.g. a connection error)
+    :return: True if the server rejected the write, so sending it again would fail again
+    """
+    status = result.get("status")
+    return result["error"] is not None and status is not None and \
+        400 <= status < 500 and status not in RETRYABLE_STATUSES
+
+
+class Journal:
+    """
+    A write-ahead journal of $batch requests.
+    A "planned" line holds the request, and a "done" or a "failed" line resolves it.
+    """
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._open_entries = set()
+        self._stale = None
+        self._lock = threading.Lock()
+
+    def plan(self, batch_requests):
+        """
+        Records writes before they are sent
+        :param batch_requests: a list of $batch request dictionaries (method, uri, headers, body)
+        :return: a list of the journal entry IDs, in the given order
+        """
+        entry_ids = [uuid.uuid4().hex for _ in batch_requests]
+        with self._lock:
+            self._check_stale()
+            self._append([{"entry": entry_id, "state": "planned", "request": batch_request}
+                          for entry_id, batch_request in zip(entry_ids, batch_requests)])
+            self._open_entries.update(entry_ids)
+        return entry_ids
+
+    def complete(self, entry_ids, results=None):
+        """
+        Marks the successful writes as done, and the writes the server rejected as failed.
+        The writes that failed transiently stay in the journal, to be sent again by a resume.
+        :param entry_ids: a list of journal entry IDs
+        :param results: a result dictionary per entry (with an "error", None on success,
+                        and the HTTP "status" of a failure), or None if all of the writes succeeded
+        :return: None
+        """
+        if results is None:
+            results = [{"id": None, "error": None} for _ in entry_ids]
+        lines = ([])
+        for entry_id, result in zip(entry_ids, results):
+            if result["error"] is None:
+                lines.append({"entry": entry_id, "state": "done"})
+            elif is_rejected(result):
+                lines.append({"entry": entry_id, "state": "failed", "error": result["error"]})
+        with self._lock:
+            self._append(lines)
+            self._open_entries.difference_update(line["entry"] for line in lines)
+            if not self._open_entries and not self._check_stale():
+                self._truncate()
+
+    def get_pending(self):
+        """
+        Get the writes that were planned and not resolved (by this run or by an earlier one)
+        :return: a list of (journal entry ID, $batch request dictionary) tuples, in planned order
+        """
+        pending = {}
+        with self._lock:
+            for line in self._read_lines():
+                if line.get("state") == "planned":
+                    pending[line["entry"]] = line["request"]
+                elif line.get("state") in RESOLVED_STATES:
+                    pending.pop(line["entry"], None)
+        return list(pending.items())
+
+    def resolve_stale(self):
+        """
+        Forgets that the journal had unfinished writes of an earlier run (after they were resumed),
+        so the journal is emptied once the writes of this run are done
+        :return: None
+        """
+        with self._lock:
+            self._stale = False
+            if not self._open_entries and not self.get_pending_count():
+                self._truncate()
+
+    def get_pending_count(self):
+        """
+        :return: the number of unfinished writes in the journal file
+        """
+        pending = set()
+        for line in self._read_lines():
+            if line.get("state") == "planned":
+                pending.add(line["entry"])
+            elif line.get("state") in RESOLVED_STATES:
+                pending.discard(line["entry"])
+        return len(pending)
+
+    def clear(self):
+        """
+        Drops all of the journal entries, including the unfinished ones
+        :return: None
+        """
+        with self._lock:
+            self._open_entries.clear()
+            self._stale = False
+            self._truncate()
+
+    def _check_stale(self):
+        """
+        :return: True if the journal had unfinished writes of an earlier run
+        """
+        if self._stale is None:
+            self._stale = self.get_pending_count() > 0
+        return self._stale
+
+    def _read_lines(self):
+        if not os.path.exists(self.path):
+            return []
+        lines = ([])
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    lines.append(json.loads(line))
+                except ValueError:
+                    # A line cut by a crash in the middle of a write
+                    continue
+        return lines
+
+    def _append(self, lines):
+        if not lines:
+            return
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("".join(json.dumps(line) + "\n" for line in lines))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _truncate(self):
+        if os.path.exists(self.path):
+            open(self.path, "w").close()
+
+
+JOURNAL = Journal()
@@ -0,0 +1,218 @@
+"""
+The module keeps a local SQLite mirror of the project work items and their links,
+so repeated reads and hierarchy walks don't go to the server.
+The mirror is synced incrementally: only the items changed since the latest System.ChangedDate
+it has (its watermark) are read again, and an item is never replaced by an older revision.
+It serves reads only while its last sync is more recent than max_age seconds,
+and the items the program writes are dropped from it until the next sync.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+MIRROR_PATH = "./tfs_mirror.sqlite"
+
+# The time (in seconds) the mirror serves reads after a sync
+DEFAULT_MAX_AGE = 600
+
+HIERARCHY_FORWARD = 'System.LinkTypes.Hierarchy-Forward'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workitems (id INTEGER PRIMARY KEY, rev INTEGER NOT NULL,
+                                      changed_date TEXT, raw TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS links (source_id INTEGER NOT NULL, target_id INTEGER NOT NULL,
+                                  rel TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS links_source ON links (source_id, rel);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def parse_date(value):
+    """
+    :param value: a TFS date, e.g. "2019-05-21T10:32:08.25Z" (with 0-7 fraction digits)
+    :return: a datetime object, or None if the value is not a date
+    """
+    match = re.match(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?', value or '')
+    if match is None:
+        return None
+    fraction = (match.group(2) or '0')[:6].ljust(6, '0')
+    return datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(
+        microsecond=int(fraction))
+
+
+class WorkitemMirror:
+    """
+    The work items of a single project, in an SQLite file
+    """
+    def __init__(self, path=MIRROR_PATH, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._database = sqlite3.connect(path, check_same_thread=False)
+        self._database.executescript(SCHEMA)
+
+    def get_watermark(self, key):
+        """
+        Get the latest change the mirror has of a project.
+        A mirror of another project is cleared.
+        :param key: the project key (the server URI and the project name)
+        :return: the latest System.ChangedDate in the mirror, or None if it is empty
+        """
+        with self._lock, self._database:
+            state = self._get_state()
+            if state.get('key') != key:
+                self._clear()
+                self._set_state(key=key)
+                return None
+            return state.get('watermark')
+
+    def store(self, raws):
+        """
+        Stores work items and their links, unless the mirror has a newer revision of them
+        :param raws: a list of raw work item dictionaries (read with all of their relations)
+        :return: the latest System.ChangedDate of the items (None if there are no items)
+        """
+        watermark = None
+        with self._lock, self._database:
+            for raw in raws:
+                changed_date = raw.get('fields', {}).get('System.ChangedDate')
+                if parse_date(changed_date) and (watermark is None or
+                                                 parse_date(changed_date) > parse_date(watermark)):
+                    watermark = changed_date
+                stored = self._database.execute(
+                    "INSERT INTO workitems (id, rev, changed_date, raw) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET rev = excluded.rev, "
+                    "changed_date = excluded.changed_date, raw = excluded.raw "
+                    "WHERE excluded.rev >= workitems.rev",
+                    (int(raw['id']), raw.get('rev', 0), changed_date, json.dumps(raw))).rowcount
+                if stored:
+                    self._database.execute("DELETE FROM links WHERE source_id = ?",
+                                           (int(raw['id']),))
+                    self._database.executemany(
+                        "INSERT INTO links (source_id, target_id, rel) VALUES (?, ?, ?)",
+                        [(int(raw['id']), int(relation['url'].rstrip('/').split('/')[-1]),
+                          relation['rel']) for relation in raw.get('relations') or []
+                         if relation['url'].rstrip('/').split('/')[-1].isdigit()])
+        return watermark
+
+    def mark_synced(self, watermark):
+        """
+        Records a finished sync, and its watermark
+        :param watermark: the latest System.ChangedDate of the synced items (None if unchanged)
+        :return: None
+        """
+        with self._lock, self._database:
+            state = self._get_state()
+            if watermark is not None and (state.get('watermark') is None or parse_date(
+                    watermark) > parse_date(state['watermark'])):
+                self._set_state(watermark=watermark)
+            self._set_state(synced_at=str(time.time()))
+
+    def is_fresh(self):
+        """
+        :return: True if the mirror was synced in the last max_age seconds
+        """
+        with self._lock:
+            synced_at = float(self._get_state().get('synced_at') or 0)
+        return time.time() - synced_at <= self.max_age
+
+    def get_many(self, item_ids):
+        """
+        :param item_ids: a list of work item IDs
+        :return: a dictionary of the raw work items the mirror has, by ID
+        """
+        item_ids = [int(item_id) for item_id in item_ids]
+        raws = {}
+        with self._lock:
+            for start in range(0, len(item_ids), 500):
+                chunk = item_ids[start:start + 500]
+                rows = self._database.execute(
+                    "SELECT id, raw FROM workitems WHERE id IN ({0})".format(
+                        ",".join("?" * len(chunk))), chunk)
+                raws.update((item_id, json.loads(raw)) for item_id, raw in rows)
+        return raws
+
+    def get_descendants(self, root_id):
+        """
+        Get the hierarchy under a work item, from the mirrored links
+        :param root_id: the top work item ID
+        :return: a dictionary of the children IDs of every item in the hierarchy,
+                 or None if the mirror is missing any of the items
+        """
+        children = {}
+        level = [int(root_id)]
+        with self._lock:
+            while level:
+                found = self._database.execute(
+                    "SELECT COUNT(*) FROM workitems WHERE id IN ({0})".format(
+                        ",".join("?" * len(level))), level).fetchone()[0]
+                if found < len(set(level)):
+                    return None
+                next_level = ([])
+                for item_id in level:
+                    children[item_id] = [target_id for target_id, in self._database.execute(
+                        "SELECT target_id FROM links WHERE source_id = ? AND rel = ?",
+                        (item_id, HIERARCHY_FORWARD))]
+                    next_level.extend(target_id for target_id in children[item_id]
+                                      if target_id not in children)
+                level = next_level
+        return children
+
+    def invalidate(self, *item_ids):
+        """
+        Removes work items from the mirror (until the next sync reads them again)
+        :param item_ids: the work item IDs
+        :return: None
+        """
+        with self._lock, self._database:
+            for item_id in item_ids:
+                self._database.execute("DELETE FROM workitems WHERE id = ?", (int(item_id),))
+                self._database.execute("DELETE FROM links WHERE source_id = ?", (int(item_id),))
+
+    def expire(self):
+        """
+        Stops serving reads until the next sync
+        :return: None
+        """
+        with self._lock, self._database:
+            self._set_state(synced_at='0')
+
+    def clear(self):
+        """
+        Removes all of the work items from the mirror
+        :return: None
+        """
+        with self._lock:
+            self._clear()
+
+    def get_count(self):
+        """
+        :return: the number of work items in the mirror
+        """
+        with self._lock:
+            return self._database.execute("SELECT COUNT(*) FROM workitems").fetchone()[0]
+
+    def close(self):
+        """
+        Closes the SQLite file
+        :return: None
+        """
+        with self._lock:
+            self._database.close()
+
+    def _clear(self):
+        with self._database:
+            self._database.execute("DELETE FROM workitems")
+            self._database.execute("DELETE FROM links")
+            self._database.execute("DELETE FROM state")
+
+    def _get_state(self):
+        return dict(self._database.execute("SELECT key, value FROM state"))
+
+    def _set_state(self, **values):
+        self._database.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                                   values.items())
@@ -0,0 +1,199 @@
+"""
+The module keeps a long run going through transient TFS errors.
+Failed calls are classified: a call the server didn't process (429, a refused connection)
+is retried for any method, and a call that may have been processed (5xx, a reset connection)
+is retried only if it is idempotent. The retries wait a jittered exponential backoff.
+A circuit breaker fails the calls fast while the server is down, instead of waiting on each one.
+"""
+
+import random
+import threading
+import time
+import requests
+from requests.adapters import BaseAdapter
+from tfs_connect import scheduler
+
+# The number of attempts of a call (the first one and its retries)
+MAX_ATTEMPTS = 4
+
+# The backoff of the first retry, and the maximal backoff (in seconds)
+BASE_DELAY = 0.5
+MAX_DELAY = 10.0
+
+# The number of consecutive failures that opens the circuit, and how long it stays open
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+SERVER_ERROR_STATUS_CODES = (500, 502, 503, 504)
+RETRY_STATUS_CODES = (408,) + SERVER_ERROR_STATUS_CODES
+
+# Exceptions of calls that never reached the server
+NOT_SENT_ERRORS = (requests.exceptions.ConnectTimeout, requests.exceptions.ProxyError)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    An exception that represents a call that was not sent, since the server is down
+    """
+
+
+def is_idempotent(request):
+    """
+    :param request: a prepared request
+    :return: True if sending the request twice has the same effect as sending it once
+    """
+    if request.method in IDEMPOTENT_METHODS:
+        return True
+
+    # A WIQL query is a POST, but it only reads
+    return request.method == "POST" and "/_apis/wit/wiql" in request.url.lower()
+
+
+class RetryPolicy:
+    """
+    Decides which failed calls are retried, and how long to wait before each retry
+    """
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def should_retry(request, response=None, error=None):
+        """
+        :param request: the prepared request
+        :param response: the response, or None if the call raised an error
+        :param error: the raised error, or None if there is a response
+        :return: True if the call may be sent again
+        """
+        if error is not None:
+            if isinstance(error, CircuitOpenError):
+                return False
+            if isinstance(error, NOT_SENT_ERRORS):
+                return True
+            return isinstance(error, (requests.exceptions.ConnectionError,
+                                      requests.exceptions.Timeout)) and is_idempotent(request)
+
+        # Throttled calls were not processed
+        if response.status_code == 429 or (response.status_code == 503 and
+                                           scheduler.get_retry_after(response.headers)):
+            return True
+        return response.status_code in RETRY_STATUS_CODES and is_idempotent(request)
+
+    def get_delay(self, attempt, response=None):
+        """
+        :param attempt: the number of the failed attempt (starting at 1)
+        :param response: the failed response, if any (for its Retry-After header)
+        :return: the time to wait before the next attempt, in seconds
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if response is not None:
+            delay = max(delay, scheduler.get_retry_after(response.headers) or 0)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Counts the consecutive server failures.
+    After failure_threshold failures the circuit opens and the calls fail fast.
+    After reset_timeout seconds a single trial call is let through:
+    its success closes the circuit, and its failure opens it again.
+    """
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        :return: "closed", "open" or "half-open"
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def before_call(self):
+        """
+        Checks a call may be sent
+        :raises CircuitOpenError: if the circuit is open
+        :return: None
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenError("The TFS server is not responding, calls are paused for up to "
+                               "{0:g} seconds".format(self.reset_timeout))
+
+    def record_success(self):
+        """
+        Closes the circuit after a call the server answered
+        :return: None
+        """
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Counts a server failure, and opens the circuit after failure_threshold failures
+        :return: None
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class ResilientAdapter(BaseAdapter):
+    """
+    A requests transport adapter that retries the failed calls of another adapter,
+    through a circuit breaker
+    """
+    def __init__(self, adapter, retry_policy, breaker):
+        super().__init__()
+        self.adapter = adapter
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            try:
+                response = self.adapter.send(request, **kwargs)
+            except requests.exceptions.RequestException as error:
+                self.breaker.record_failure()
+                if attempt >= self.retry_policy.max_attempts or \
+                        not self.retry_policy.should_retry(request, error=error):
+                    raise
+                time.sleep(self.retry_policy.get_delay(attempt))
+                continue
+
+            # A throttling 503 (with a Retry-After) means the server is up
+            if response.status_code in SERVER_ERROR_STATUS_CODES and \
+                    not scheduler.get_retry_after(response.headers):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if attempt >= self.retry_policy.max_attempts or \
+                    not self.retry_policy.should_retry(request, response=response):
+                return response
+            response.close()
+            time.sleep(self.retry_policy.get_delay(attempt, response))
+
+    def close(self):
+        self.adapter.close()
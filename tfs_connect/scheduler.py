@@ -0,0 +1,182 @@
+"""
+The module schedules the HTTP calls to the TFS server, so a large run gets the most throughput
+the server allows without being throttled.
+A token bucket limits the request rate, and an adaptive (AIMD) limit caps the concurrent requests:
+both are cut by half on a throttling signal (429/503, Retry-After, X-RateLimit-* headers),
+and grow slowly back while the responses are fast.
+"""
+
+import email.utils
+import threading
+import time
+from requests.adapters import BaseAdapter
+
+# The initial, minimal and maximal request rates (requests per second)
+DEFAULT_RATE = 20.0
+MIN_RATE = 1.0
+MAX_RATE = 100.0
+
+# The number of requests that may be sent at once after an idle period
+BURST = 20
+
+# The initial and maximal number of concurrent requests
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# A response slower than this (in seconds) doesn't grow the limits
+TARGET_LATENCY = 1.0
+
+# The pause (in seconds) after a throttling response without a Retry-After header
+DEFAULT_BACKOFF = 1.0
+
+THROTTLING_STATUS_CODES = (429, 503)
+
+
+def get_retry_after(headers):
+    """
+    Get the time the server asked to wait before the next request
+    :param headers: the response headers
+    :return: the wait time in seconds, or None if the server didn't ask to wait
+    """
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                return max(email.utils.parsedate_to_datetime(retry_after).timestamp() -
+                           time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+    if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+        try:
+            return max(float(headers["X-RateLimit-Reset"]) - time.time(), 0.0)
+        except ValueError:
+            pass
+    return None
+
+
+def is_throttled(response):
+    """
+    :param response: a requests response
+    :return: True if the response is a throttling signal
+    """
+    if response.status_code in THROTTLING_STATUS_CODES:
+        return True
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        return True
+    try:
+        return float(response.headers.get("X-RateLimit-Delay") or 0) > 0
+    except ValueError:
+        return False
+
+
+class RateLimiter:
+    """
+    A token bucket with an adaptive concurrency limit
+    """
+    def __init__(self, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY,
+                 max_rate=MAX_RATE, max_concurrency=MAX_CONCURRENCY,
+                 target_latency=TARGET_LATENCY, backoff=DEFAULT_BACKOFF):
+        self.rate = rate
+        self.concurrency = float(concurrency)
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.throttled = 0
+        self._tokens = float(BURST)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits until a request may be sent: the server didn't ask to pause,
+        there is a free concurrency slot and a token
+        :return: None
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0 and self._in_flight < int(self.concurrency):
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                self._condition.wait(wait if wait > 0 else None)
+
+    def release(self, latency, response):
+        """
+        Frees the slot of a sent request, and adapts the limits to its response
+        :param latency: the request latency in seconds
+        :param response: the requests response, or None if the request failed without a response
+        :return: None
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if response is not None and is_throttled(response):
+                self._decrease(get_retry_after(response.headers), response.status_code)
+            elif response is not None and latency <= self.target_latency:
+                self.concurrency = min(self.max_concurrency,
+                                       self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + 1 / self.concurrency)
+            self._condition.notify_all()
+
+    def get_state(self):
+        """
+        :return: a dictionary of the current limits and the number of throttling responses
+        """
+        with self._condition:
+            return {"rate": round(self.rate, 2),
+                    "concurrency": int(self.concurrency),
+                    "throttled": self.throttled}
+
+    def _decrease(self, retry_after, status_code):
+        now = time.monotonic()
+        self.throttled += 1
+
+        # The responses of requests that were sent together cut the limits once
+        if now - self._last_decrease > self.target_latency:
+            self.concurrency = max(1.0, self.concurrency / 2)
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._last_decrease = now
+
+        if retry_after is None and status_code in THROTTLING_STATUS_CODES:
+            retry_after = self.backoff
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+            self._tokens = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(float(BURST), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+class ScheduledAdapter(BaseAdapter):
+    """
+    A requests transport adapter that sends the requests of another adapter through a RateLimiter
+    """
+    def __init__(self, adapter, limiter):
+        super().__init__()
+        self.adapter = adapter
+        self.limiter = limiter
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        self.limiter.acquire()
+        start = time.monotonic()
+        response = None
+        try:
+            response = self.adapter.send(request, **kwargs)
+            return response
+        finally:
+            self.limiter.release(time.monotonic() - start, response)
+
+    def close(self):
+        self.adapter.close()
@@ -0,0 +1,130 @@
+"""
+The module keeps the authenticated session state (the cookies the server issued) on disk,
+so a new process can send them with its first request and skip the authentication handshake
+for as long as the server accepts them.
+The file is readable only by its owner (on Windows, by an ACL of the user only),
+and it is dropped once the server rejects the session.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import requests
+
+
+class SessionCache:
+    """
+    The server cookies of a single server and user, in a JSON file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._saved = None
+        self._lock = threading.Lock()
+
+    def install(self, session, uri, user_name):
+        """
+        Loads the saved cookies into a requests session, and keeps the file updated
+        with the cookies the server sends
+        :param session: a requests session
+        :param uri: the server URI
+        :param user_name: the user name the session belongs to
+        :return: None
+        """
+        key = {"uri": uri, "user": user_name}
+        for cookie in self.load(key):
+            session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+
+        def update_cache(response, *args, **kwargs):  # pylint: disable=unused-argument
+            if response.status_code == 401:
+                self.clear()
+            elif response.headers.get("Set-Cookie"):
+                # The hooks run before the session stores the response cookies
+                session.cookies.update(response.cookies)
+                self.save(key, session.cookies)
+        session.hooks["response"].append(update_cache)
+
+    def load(self, key):
+        """
+        :param key: a dictionary of the server URI and the user name
+        :return: a list of the saved cookies (keyword dictionaries) of the key,
+                 without the expired ones
+        """
+        try:
+            with open(self.path, "r") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return []
+        if saved.get("key") != key:
+            return []
+        cookies = [cookie for cookie in saved.get("cookies", [])
+                   if not requests.cookies.create_cookie(**cookie).is_expired()]
+        self._saved = cookies
+        return cookies
+
+    def save(self, key, cookie_jar):
+        """
+        Writes the cookies of a session, if they changed.
+        The file is created readable and writable only by its owner.
+        :param key: a dictionary of the server URI and the user name
+        :param cookie_jar: the session cookie jar
+        :return: None
+        """
+        cookies = [{"name": cookie.name, "value": cookie.value, "domain": cookie.domain,
+                    "path": cookie.path, "secure": cookie.secure, "expires": cookie.expires}
+                   for cookie in cookie_jar if not cookie.is_expired()]
+        with self._lock:
+            if cookies == self._saved:
+                return
+            temp_path = self.path + ".tmp"
+            try:
+                # The file is restricted before the cookies are written to it
+                descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                try:
+                    restrict_file(temp_path)
+                except OSError:
+                    os.close(descriptor)
+                    os.remove(temp_path)
+                    raise
+                with os.fdopen(descriptor, "w") as file:
+                    json.dump({"key": key, "cookies": cookies}, file)
+                os.replace(temp_path, self.path)
+            except OSError as error:
+                print("Can't save the session: {0}".format(error))
+                return
+            self._saved = cookies
+
+    def clear(self):
+        """
+        Drops the saved session
+        :return: None
+        """
+        with self._lock:
+            self._saved = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def restrict_file(path):
+    """
+    Makes a file readable and writable only by the current user.
+    Windows ignores the file mode, so there the file ACL is replaced by a single entry
+    of the user (without the inherited entries of the folder)
+    :param path: the file path
+    :raises OSError: if the file can't be restricted
+    :return: None
+    """
+    if os.name != "nt":
+        os.chmod(path, 0o600)
+        return
+    user_name = os.environ.get("USERNAME")
+    if not user_name:
+        raise OSError("The current user is unknown")
+    if os.environ.get("USERDOMAIN"):
+        user_name = os.environ["USERDOMAIN"] + "\\" + user_name
+    result = subprocess.run(["icacls", path, "/inheritance:r", "/grant:r",
+                             "{0}:F".format(user_name)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=False)
+    if result.returncode != 0:
+        output = result.stdout.decode(errors="replace").strip()
+        raise OSError("Can't restrict {0}: {1}".format(path, output))
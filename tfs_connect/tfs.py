@@ -2,8 +2,53 @@
 The module manages the connection to the TFS server
 """
 
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
 from requests_ntlm import HttpNtlmAuth
 from tfs import TFSAPI
+from tfs import Workitem
+from executor import executor
+from tfs_connect import cache
+from tfs_connect import classification
+from tfs_connect import instrumentation
+from tfs_connect import journal
+from tfs_connect import mirror
+from tfs_connect import resilience
+from tfs_connect import scheduler
+
+WORKITEMS_URL = 'https://tfs2018.net-bet.net/tfs/DefaultCollection/' \
+                '154f45b9-7e72-44b9-bd28-225c488dfde2/' \
+                '_apis/wit/workItems/'
+
+# The maximal number of operations TFS accepts in a single $batch request
+BATCH_LIMIT = 200
+BATCH_API_VERSION = '4.1'
+
+# The number of keep-alive connections kept open to the server
+POOL_SIZE = 16
+
+# The maximal number of work items TFS returns in a single workitems?ids= request
+BULK_READ_LIMIT = 200
+
+# The WIQL query of the work items of a project that changed since a given time
+SYNC_QUERY = "SELECT [System.Id] FROM WorkItems WHERE [System.TeamProject] = @project{0} " \
+             "ORDER BY [System.ChangedDate]"
+SYNC_WATERMARK_CONDITION = " AND [System.ChangedDate] >= '{0}'"
+
+# The maximal number of results of a WIQL query
+WIQL_LIMIT = 20000
+
+# The maximal number of work items a single sync query returns
+SYNC_QUERY_LIMIT = 10000
+
+# The API version of the requests that need a newer version than the TFS package uses
+REST_API_VERSION = '4.1'
+
+# The $expand modes of a work item read. "all" and "relations" read the full item
+EXPAND_MODES = ("all", "relations", "fields", "links", "none")
+FULL_EXPAND_MODES = ("all", "relations")
 
 
 class TFSConnection:
@@ -11,12 +56,23 @@ class TFSConnection:
     this class represents a TFS connection.
     Once initialized and connected properly, it can be used to retrieve/update data from TFS
     """
-    def __init__(self, credentials):
+    def __init__(self, credentials, transport=None, write_journal=None, session_cache=None,
+                 workitem_mirror=None):
         self.uri = credentials['uri']
         self.username = credentials['userName']
         self.password = credentials['password']
         self.project = credentials['project']
+        self.transport = transport
+        self.journal = write_journal
+        self.session_cache = session_cache
+        self.mirror = workitem_mirror
+        self.limiter = scheduler.RateLimiter()
+        self.retry_policy = resilience.RetryPolicy()
+        self.breaker = resilience.CircuitBreaker()
         self.connection = self.connect_to_tfs()
+        self.cache = cache.WorkitemCache()
+        instrumentation.INSTRUMENTATION.install_cache(self.cache)
+        self.classification = classification.ClassificationIndex()
 
     """
     def __enter__(self):
@@ -28,6 +84,97 @@ class TFSConnection:
 
     """
 
+    def get_workitem(self, item_id, fields=None, expand=None):
+        """
+        The function gets a single work item
+        :param item_id: the work item ID
+        :param fields: an optional list of the field names to read (see get_workitems)
+        :param expand: an optional expand mode (see get_workitems)
+        :return: a TFS work item object
+        """
+        return self.get_workitems([item_id], fields=fields, expand=expand)[0]
+
+    def get_workitems(self, item_ids, fields=None, expand=None):
+        """
+        The function gets several work items using bulk workitems?ids= requests.
+        The IDs are sent in chunks of BULK_READ_LIMIT
+        (see async_tfs for reading the chunks concurrently).
+        A read gets either a fields projection (without the relations) or an expand mode,
+        since TFS rejects the two together. By default, the full items are read.
+        :param item_ids: a list of work item IDs
+        :param fields: an optional list of the field names to read
+        :param expand: an optional expand mode, one of EXPAND_MODES (default "all")
+        :raises ValueError: if both fields and expand are given, or the expand mode is unknown
+        :return: a list of TFS work item objects, in the given order
+        """
+        if fields and expand is not None:
+            raise ValueError("A work item read can't have both fields and expand")
+        if expand is not None and expand.lower() not in EXPAND_MODES:
+            raise ValueError("Unknown expand mode: {0}".format(expand))
+        fields = list(fields) if fields else None
+        expand = None if fields else (expand or "all").lower()
+
+        # Only the full items and the projections are cached (and a full item serves any read)
+        cached = fields is not None or expand in FULL_EXPAND_MODES
+        item_ids = [int(item_id) for item_id in item_ids]
+        workitems = {item_id: self.cache.get(item_id, fields=fields) if cached else
+                     self.cache.peek(item_id) for item_id in set(item_ids)}
+        missing_ids = [item_id for item_id, workitem in workitems.items() if workitem is None]
+
+        # The mirror has the full items
+        if missing_ids and cached and self.mirror is not None and self.mirror.is_fresh():
+            for item_id, raw in self.mirror.get_many(missing_ids).items():
+                workitems[item_id] = Workitem(self.connection, raw)
+                self.cache.put(workitems[item_id])
+            missing_ids = [item_id for item_id in missing_ids if workitems[item_id] is None]
+        if missing_ids:
+            for workitem in self.connection.get_workitems(missing_ids, fields=fields,
+                                                          batch_size=BULK_READ_LIMIT,
+                                                          expand=expand):
+                if cached:
+                    self.cache.put(workitem, fields=fields)
+                workitems[int(workitem.id)] = workitem
+        return [workitems[item_id] for item_id in item_ids]
+
+    def update_workitem(self, item_id, update_data):
+        """
+        The function updates a work item with a JSON-patch
+        :param item_id: the work item ID
+        :param update_data: a list of JSON-patch operations
+        :return: the raw updated work item
+        """
+        # Relation changes update the linked items as well
+        linked_ids = ([])
+        if any(operation['path'].startswith('/relations') for operation in update_data):
+            linked_ids = self._get_linked_ids(self.cache.peek(item_id))
+
+        entry_ids = self._plan([self._get_update_request(item_id, update_data)])
+        try:
+            raw = self.connection.update_workitem(work_item_id=item_id, update_data=update_data)
+        except Exception as error:
+            self._complete(entry_ids, [get_error_result(error)])
+            self._invalidate(item_id)
+            raise
+        self._complete(entry_ids)
+        if self.mirror is not None:
+            self.mirror.invalidate(item_id)
+        self.cache.put(Workitem(self.connection, raw))
+        self._invalidate(*linked_ids)
+        return raw
+
+    def add_relations(self, item_id, relations):
+        """
+        The function adds relations to a work item
+        :param item_id: the work item ID
+        :param relations: a list of relation dictionaries (rel, url)
+        :return: the raw updated work item
+        """
+        update_data = [dict(op="add", path="/relations/-", value=relation)
+                       for relation in relations]
+        raw = self.update_workitem(item_id, update_data)
+        self._invalidate(*get_relation_ids(relations))
+        return raw
+
     def add_workitem(self, item_fields, parent_item_id=None, workitem_type="Task"):
         """
         The function adds a work item in the given TFS connection
@@ -40,27 +187,392 @@ class TFSConnection:
         if workitem_type == "PBI":
             workitem_type = "Product Backlog Item"
 
-        if parent_item_id is not None:
-            relation_url = """https://tfs2018.net-bet.net/tfs/DefaultCollection/
-                154f45b9-7e72-44b9-bd28-225c488dfde2/_apis/wit/workItems/"""
-            relations = [{'rel': 'System.LinkTypes.Hierarchy-Reverse',  # parent
-                          'url': relation_url + str(parent_item_id)
-                          }
-                         ]
-            new_workitem = self.connection.create_workitem(workitem_type,
-                                                           fields=item_fields,
-                                                           relations_raw=relations)
-        else:
-            new_workitem = self.connection.create_workitem(workitem_type, fields=item_fields)
+        entry_ids = self._plan([self._get_create_request(
+            workitem_type, parent_item_id, [dict(op="add", path='/fields/{}'.format(name),
+                                                 value=value)
+                                            for name, value in item_fields.items()])])
+        try:
+            if parent_item_id is not None:
+                relations = [{'rel': 'System.LinkTypes.Hierarchy-Reverse',  # parent
+                              'url': WORKITEMS_URL + str(parent_item_id)
+                              }
+                             ]
+                new_workitem = self.connection.create_workitem(workitem_type,
+                                                               fields=item_fields,
+                                                               relations_raw=relations)
+            else:
+                new_workitem = self.connection.create_workitem(workitem_type, fields=item_fields)
+        except Exception as error:
+            self._complete(entry_ids, [get_error_result(error)])
+            raise
+        self._complete(entry_ids)
 
+        # The parent got a new child relation
+        if parent_item_id is not None:
+            self._invalidate(parent_item_id)
+        self.cache.put(new_workitem)
         return new_workitem.id
 
+    def update_workitems(self, updates):
+        """
+        The function updates several work items using the TFS $batch endpoint,
+        with a single JSON-patch per work item (see apply_writes)
+        :param updates: a list of (work item ID, list of JSON-patch operations) tuples
+        :return: a list with a result dictionary per update, in the given order.
+                 Each result has the item "id" and an "error" (None on success)
+        """
+        _, results = self.apply_writes([], updates)
+        return results
+
+    def apply_writes(self, creates, updates):
+        """
+        The function sends work item creations and updates together through the $batch endpoint
+        (in chunks of BATCH_LIMIT), so the number of requests depends only on the number of writes
+        :param creates: a list of (work item type, parent item ID or None, JSON-patch) tuples
+        :param updates: a list of (work item ID, JSON-patch) tuples, a single update per item
+        :return: a tuple of the creations results and the updates results, in the given orders.
+                 Each result has the item "id" and an "error" (None on success)
+        """
+        changed_ids = [parent_item_id for _, parent_item_id, _ in creates
+                       if parent_item_id is not None]
+        batch_requests = [self._get_create_request(
+            "Product Backlog Item" if workitem_type == "PBI" else workitem_type,
+            parent_item_id, patch) for workitem_type, parent_item_id, patch in creates]
+        for item_id, update_data in updates:
+            relation_operations = [operation for operation in update_data
+                                   if operation['path'].startswith('/relations')]
+            if relation_operations:
+                changed_ids.extend(self._get_linked_ids(self.cache.peek(item_id)))
+                changed_ids.extend(get_relation_ids([operation['value']
+                                                     for operation in relation_operations
+                                                     if operation['op'] == 'add']))
+            changed_ids.append(item_id)
+            batch_requests.append(self._get_update_request(item_id, update_data))
+
+        results = self.send_batch(batch_requests)
+
+        self._invalidate(*set(changed_ids))
+        return results[:len(creates)], results[len(creates):]
+
+    def run_wiql(self, query, top=None):
+        """
+        The function runs a WIQL query
+        :param query: the WIQL query
+        :param top: an optional maximal number of results (the WIQL limit is WIQL_LIMIT)
+        :return: the raw query result ("workItems" for flat queries,
+                 "workItemRelations" for link queries)
+        """
+        if top is None:
+            return self.connection.run_wiql(query).data
+        return self.connection.run_wiql(query, params={"$top": top,
+                                                       "api-version": REST_API_VERSION}).data
+
+    def get_classification(self):
+        """
+        The function gets the index of the project areas and iterations.
+        The trees are read by a single request, once per the index TTL.
+        :return: a ClassificationIndex object
+        """
+        if self.classification.is_expired():
+            raw = self.connection.rest_client.send_get(
+                "wit/classificationnodes",
+                payload={"$depth": classification.DEPTH, "api-version": REST_API_VERSION},
+                project=True)
+            self.classification.load(raw.get('value', []))
+        return self.classification
+
+    def resume(self):
+        """
+        The function sends the writes the journal has as unfinished (e.g. by a run that died),
+        and only them
+        :return: a list with a result dictionary per write, in the journal order.
+                 Each result has the item "id" and an "error" (None on success)
+        """
+        if self.journal is None:
+            return []
+        pending = self.journal.get_pending()
+        results = self._send_batch_chunks([batch_request for _, batch_request in pending])
+        self.journal.complete([entry_id for entry_id, _ in pending], results)
+        if not any(result['error'] is not None and not journal.is_rejected(result)
+                   for result in results):
+            self.journal.resolve_stale()
+
+        # The resumed writes may have changed any of the cached (or mirrored) items
+        self.cache.clear()
+        if self.mirror is not None:
+            self.mirror.expire()
+        return results
+
+    def sync_mirror(self):
+        """
+        The function reads the project work items that changed since the last sync
+        into the mirror (all of them on the first sync), a bulk read per BULK_READ_LIMIT items
+        :return: the number of the read work items
+        """
+        key = "{0}|{1}".format(self.uri, self.project)
+        watermark = self.mirror.get_watermark(key)
+        count = 0
+        while True:
+            condition = SYNC_WATERMARK_CONDITION.format(watermark) if watermark else ""
+            query_result = self.connection.run_wiql(
+                SYNC_QUERY.format(condition),
+                params={"timePrecision": "true", "$top": SYNC_QUERY_LIMIT,
+                        "api-version": REST_API_VERSION}).data
+            item_ids = [workitem['id'] for workitem in query_result.get('workItems', [])]
+            changed_dates = ([])
+            for start in range(0, len(item_ids), BULK_READ_LIMIT):
+                workitems = self.connection.get_workitems(item_ids[start:start + BULK_READ_LIMIT],
+                                                          batch_size=BULK_READ_LIMIT)
+                changed_dates.append(self.mirror.store([workitem.data for workitem in workitems]))
+            latest = max(filter(None, changed_dates), key=mirror.parse_date, default=None)
+            count += len(item_ids)
+
+            # A full result may have more changes after its latest one
+            if len(item_ids) < SYNC_QUERY_LIMIT or latest is None or latest == watermark:
+                self.mirror.mark_synced(latest or watermark)
+                return count
+            watermark = latest
+
+    def send_batch(self, batch_requests):
+        """
+        The function sends a list of work item requests through the $batch endpoint.
+        The requests are recorded in the journal (if any) before they are sent.
+        :param batch_requests: a list of $batch request dictionaries (method, uri, headers, body)
+        :return: a list with a result dictionary per request, in the given order.
+                 Each result has the item "id" and an "error" (None on success)
+        """
+        entry_ids = self._plan(batch_requests)
+        results = self._send_batch_chunks(batch_requests)
+        self._complete(entry_ids, results)
+        return results
+
+    def _send_batch_chunks(self, batch_requests):
+        """
+        Sends the $batch requests in chunks of BATCH_LIMIT
+        :param batch_requests: a list of $batch request dictionaries
+        :return: a list with a result dictionary per request, in the given order
+        """
+        chunks = [batch_requests[start:start + BATCH_LIMIT]
+                  for start in range(0, len(batch_requests), BATCH_LIMIT)]
+        results = ([])
+        for chunk_result in executor.get_executor().run(self._send_batch_chunk, chunks):
+            if chunk_result['error'] is not None:
+                results.extend(get_error_result(chunk_result['error'])
+                               for _ in chunk_result['item'])
+            else:
+                results.extend(chunk_result['result'])
+        return results
+
+    def _send_batch_chunk(self, chunk):
+        """
+        Sends a single $batch request of up to BATCH_LIMIT requests
+        :param chunk: a list of $batch request dictionaries
+        :return: a list with a result dictionary per request
+        """
+        batch_url = self.uri.rstrip('/') + '/_apis/wit/$batch'
+        try:
+            response = self.connection.rest_client.send_post(
+                batch_url, data=chunk, payload={'api-version': BATCH_API_VERSION})
+        except requests.exceptions.RequestException as error:
+            # The whole chunk failed, but the other chunks may still succeed
+            return [get_error_result(error) for _ in chunk]
+        return [parse_batch_result(item) for item in response['value']]
+
+    def _plan(self, batch_requests):
+        """
+        Records writes in the journal (if any) before they are sent
+        :param batch_requests: a list of $batch request dictionaries
+        :return: a list of the journal entry IDs (None without a journal)
+        """
+        if self.journal is None:
+            return None
+        return self.journal.plan(batch_requests)
+
+    def _complete(self, entry_ids, results=None):
+        """
+        Marks the successful writes as done in the journal (if any)
+        :param entry_ids: the journal entry IDs of the writes (see _plan)
+        :param results: a result dictionary per write, or None if all of them succeeded
+        :return: None
+        """
+        if entry_ids is not None:
+            self.journal.complete(entry_ids, results)
+
+    def _get_create_request(self, workitem_type, parent_item_id, patch):
+        """
+        :param workitem_type: the full work item type, e.g. "Product Backlog Item"
+        :param parent_item_id: a parent item ID or None
+        :param patch: a list of JSON-patch operations of the item fields
+        :return: a $batch request dictionary that creates the work item
+        """
+        body = list(patch)
+        if parent_item_id is not None:
+            body.append(dict(op="add", path="/relations/-",
+                             value={'rel': 'System.LinkTypes.Hierarchy-Reverse',  # parent
+                                    'url': WORKITEMS_URL + str(parent_item_id)}))
+        return {'method': 'PATCH',
+                'uri': '/{0}/_apis/wit/workitems/${1}?api-version={2}'.format(
+                    self.project, workitem_type, BATCH_API_VERSION),
+                'headers': {'Content-Type': 'application/json-patch+json'},
+                'body': body}
+
+    @staticmethod
+    def _get_update_request(item_id, update_data):
+        """
+        :param item_id: the work item ID
+        :param update_data: a list of JSON-patch operations
+        :return: a $batch request dictionary that updates the work item
+        """
+        return {'method': 'PATCH',
+                'uri': '/_apis/wit/workitems/{0}?api-version={1}'.format(item_id,
+                                                                         BATCH_API_VERSION),
+                'headers': {'Content-Type': 'application/json-patch+json'},
+                'body': update_data}
+
     def connect_to_tfs(self):
         """
-        Creates a TFS server connection and assign it to the object
+        Creates a TFS server connection and assign it to the object.
+        The connection session keeps up to POOL_SIZE authenticated connections alive,
+        unless another transport (a requests adapter) was given.
+        All of the requests are scheduled by the connection rate limiter,
+        and the transient failures are retried (see resilience).
+        With a session cache, the saved server cookies are sent with the first request,
+        so the authentication handshake is skipped while the server accepts them.
         :return: None
         """
-        return TFSAPI(
+        connection = TFSAPI(
             self.uri, project=self.project,
             user=self.username, password=self.password, auth_type=HttpNtlmAuth, connect_timeout=10
         )
+        adapter = self.transport
+        if adapter is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        adapter = resilience.ResilientAdapter(scheduler.ScheduledAdapter(adapter, self.limiter),
+                                              self.retry_policy, self.breaker)
+        connection.rest_client.http_session.mount('https://', adapter)
+        connection.rest_client.http_session.mount('http://', adapter)
+        instrumentation.INSTRUMENTATION.install(connection.rest_client.http_session)
+        if self.session_cache is not None:
+            self.session_cache.install(connection.rest_client.http_session,
+                                       self.uri, self.username)
+        return connection
+
+    def _invalidate(self, *item_ids):
+        """
+        Removes changed work items from the cache and the mirror
+        :param item_ids: the work item IDs
+        :return: None
+        """
+        self.cache.invalidate(*item_ids)
+        if self.mirror is not None:
+            self.mirror.invalidate(*item_ids)
+
+    @staticmethod
+    def _get_linked_ids(workitem):
+        """
+        :param workitem: a TFS work item object (or None)
+        :return: the IDs of the work items linked to the work item
+        """
+        if workitem is None:
+            return []
+        return get_relation_ids(workitem.data.get('relations') or [])
+
+    def close(self):
+        """
+        Closes all of the open connections to the server (and the mirror)
+        :return: None
+        """
+        self.connection.rest_client.http_session.close()
+        if self.mirror is not None:
+            self.mirror.close()
+
+
+_CONNECTIONS = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
+
+def get_connection(credentials, session_cache=None, workitem_mirror=None):
+    """
+    Get the connection of the given credentials.
+    The connection is created once and is kept alive for the whole process,
+    so its TCP, TLS and NTLM setup is paid only by the first operation.
+    :param credentials: a credentials dictionary
+    :param session_cache: an optional SessionCache, to reuse the session of an earlier process
+    :param workitem_mirror: an optional WorkitemMirror, to read the work items from
+    :return: a TFSConnection object
+    """
+    key = _get_connection_key(credentials)
+    with _CONNECTIONS_LOCK:
+        if key not in _CONNECTIONS:
+            _CONNECTIONS[key] = TFSConnection(credentials, write_journal=journal.JOURNAL,
+                                              session_cache=session_cache,
+                                              workitem_mirror=workitem_mirror)
+        return _CONNECTIONS[key]
+
+
+def has_connection(credentials):
+    """
+    :param credentials: a credentials dictionary
+    :return: True if the connection of the credentials was already created
+    """
+    with _CONNECTIONS_LOCK:
+        return _get_connection_key(credentials) in _CONNECTIONS
+
+
+def close_connections():
+    """
+    Closes all of the kept connections, so the next get_connection creates a new one
+    :return: None
+    """
+    with _CONNECTIONS_LOCK:
+        for connection in _CONNECTIONS.values():
+            connection.close()
+        _CONNECTIONS.clear()
+
+
+def _get_connection_key(credentials):
+    return (credentials['uri'], credentials['project'],
+            credentials['userName'], credentials['password'])
+
+
+def get_relation_ids(relations):
+    """
+    :param relations: a list of relation dictionaries (rel, url)
+    :return: the IDs of the work items the relations point to
+    """
+    return [int(relation['url'].rstrip('/').split('/')[-1]) for relation in relations
+            if relation['url'].rstrip('/').split('/')[-1].isdigit()]
+
+
+def parse_batch_result(batch_item):
+    """
+    Translates a single $batch response item to a result dictionary
+    :param batch_item: a $batch response item (code, headers, body)
+    :return: a dictionary with the item "id" and an "error" (None on success),
+             and the HTTP "status" of a failure
+    """
+    try:
+        body = json.loads(batch_item.get('body') or '{}')
+    except ValueError:
+        body = {}
+
+    if 200 <= batch_item.get('code', 500) < 300:
+        return {'id': body.get('id'), 'error': None}
+
+    error = body.get('value', body)
+    if isinstance(error, dict):
+        error = error.get('Message', error.get('message', error))
+    return {'id': None, 'error': 'HTTP {0}: {1}'.format(batch_item.get('code'), error),
+            'status': batch_item.get('code')}
+
+
+def get_error_result(error):
+    """
+    Translates a failed request to a result dictionary
+    :param error: the request exception
+    :return: a dictionary with no item "id", the "error" and its HTTP "status"
+             (None if the request wasn't answered)
+    """
+    response = getattr(error, 'response', None)
+    return {'id': None, 'error': str(error),
+            'status': response.status_code if response is not None else None}
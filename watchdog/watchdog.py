@@ -2,21 +2,47 @@
 The Watchdog module created a generic watchdog implementation to handle
 the program timeout.
 Once the instance is created it is updated againt everey user activity.
-Once expired, the program is terminated.
+A single monitor thread waits for a monotonic deadline, and every activity pushes it forward.
+Once expired, the program is terminated. If an operation is running, it is asked to stop
+at its next item boundary (see heartbeat and is_cancelled), and the program ends after it.
 """
 
+import contextlib
 import signal
 import threading
+import time
 import os
 
+_ACTIVE_WATCHDOG = None
+
+
+class OperationCancelledError(Exception):
+    """
+    An exception that represents an item that was not handled, since the watchdog expired
+    """
+
 
 class Watchdog:
     """
     Watchdog class that handled the program timeout
     """
     def __init__(self):
-        self.timeout = self.get_timeout()
-        self._t = None
+        self._timeout = None
+        self._deadline = None
+        self._thread = None
+        self._busy = 0
+        self._condition = threading.Condition()
+        self.cancelled = threading.Event()
+
+    @property
+    def timeout(self):
+        """
+        The timeout is read from the config only when the watchdog is first started
+        :return: timeout in seconds
+        """
+        if self._timeout is None:
+            self._timeout = self.get_timeout()
+        return self._timeout
 
     @staticmethod
     def do_expire():
@@ -39,27 +65,73 @@ class Watchdog:
         Start monitoring the user actions
         :return: None
         """
-        if self._t is None:
-            self._t = threading.Timer(self.timeout, self._expire)
-            self._t.start()
+        global _ACTIVE_WATCHDOG  # pylint: disable=global-statement
+        with self._condition:
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self.timeout
+                self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._monitor, name="watchdog",
+                                                daemon=True)
+                self._thread.start()
+        _ACTIVE_WATCHDOG = self
 
     def stop(self):
         """
-        Stops the monitoring
+        Stops the monitoring (the monitor thread waits for the next start)
         :return: None
         """
-        if self._t is not None:
-            self._t.cancel()
-            self._t = None
+        with self._condition:
+            self._deadline = None
+            self._condition.notify()
 
     def refresh(self):
         """
-        Once the watchdog is refreshed, it restart itself
+        Once the watchdog is refreshed, its deadline is pushed forward
         :return:
         """
-        if self._t is not None:
-            self.stop()
-            self.start()
+        with self._condition:
+            if self._deadline is not None:
+                self._deadline = time.monotonic() + self.timeout
+
+    @contextlib.contextmanager
+    def busy(self):
+        """
+        Marks an operation as running: an expiry asks it to stop instead of killing it,
+        and the program is closed once it stopped
+        """
+        with self._condition:
+            self._busy += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._busy -= 1
+                expired = self.cancelled.is_set() and not self._busy
+            if expired:
+                self.do_expire()
+
+    def _monitor(self):
+        """
+        Waits for the deadline, for as long as the program runs
+        :return: None
+        """
+        while True:
+            with self._condition:
+                if self._deadline is None:
+                    self._condition.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                self._deadline = None
+                busy = self._busy > 0
+            if busy:
+                print("\nWatchdog expire, stopping the operation")
+                self.cancelled.set()
+            else:
+                self._expire()
 
     @staticmethod
     def get_timeout(default=120):
@@ -83,3 +155,19 @@ class Watchdog:
                 with open(file_path, "w+") as file:
                     file.write(str(default))
                 return default
+
+
+def heartbeat():
+    """
+    Keeps the running watchdog (if any) from expiring, for long operations
+    :return: None
+    """
+    if _ACTIVE_WATCHDOG is not None:
+        _ACTIVE_WATCHDOG.refresh()
+
+
+def is_cancelled():
+    """
+    :return: True if the running watchdog expired, and the operation should stop
+    """
+    return _ACTIVE_WATCHDOG is not None and _ACTIVE_WATCHDOG.cancelled.is_set()